@@ -0,0 +1,98 @@
+# Agendador em processo: um heap de prazos (instante, ordem de chegada) e uma thread
+# que dorme até o próximo vencer. Tarefas únicas (ex.: expirar um PIX no fim do prazo)
+# e periódicas (arquivamento, limpezas). Tarefas com chave não são agendadas duas vezes;
+# cancelar só marca a entrada, que é descartada quando chega ao topo do heap.
+# As tarefas rodam na thread do agendador: devem ser curtas.
+import heapq
+import itertools
+import os
+import threading
+import time
+
+class Agendador:
+    def __init__(self):
+        self._heap = []
+        self._por_chave = {}
+        self._periodicas = []
+        self._ordem = itertools.count()
+        self._condicao = threading.Condition()
+        self._pid = None
+        self.executadas = 0
+        self.erros = 0
+
+    # Executa funcao() no instante "quando" (epoch; no passado roda assim que possível).
+    # Retorna False se a chave já está agendada.
+    def agendar(self, quando, funcao, chave=None):
+        with self._condicao:
+            if chave is not None and chave in self._por_chave:
+                return False
+            entrada = [quando, next(self._ordem), funcao, chave, True]
+            heapq.heappush(self._heap, entrada)
+            if chave is not None:
+                self._por_chave[chave] = entrada
+            # Acorda a thread se a nova tarefa vence antes da que ela está esperando
+            if self._heap[0] is entrada:
+                self._condicao.notify()
+            return True
+
+    def cancelar(self, chave):
+        with self._condicao:
+            entrada = self._por_chave.pop(chave, None)
+            if entrada is not None:
+                entrada[4] = False
+
+    # funcao() a cada "intervalo" segundos, em todo processo que iniciar o agendador
+    def repetir(self, intervalo, funcao, nome):
+        self._periodicas.append((intervalo, funcao, nome))
+        if self._pid == os.getpid():
+            self._agendar_periodica(intervalo, funcao, nome)
+
+    def _agendar_periodica(self, intervalo, funcao, nome):
+        def executar():
+            try:
+                funcao()
+            finally:
+                self.agendar(time.time() + intervalo, executar, chave=nome)
+
+        self.agendar(time.time() + intervalo, executar, chave=nome)
+
+    def pendentes(self):
+        with self._condicao:
+            return sum(1 for entrada in self._heap if entrada[4])
+
+    # Thread do agendador no processo atual (de novo depois de um fork do gunicorn)
+    def garantir_iniciado(self):
+        if self._pid == os.getpid():
+            return
+        with self._condicao:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for intervalo, funcao, nome in self._periodicas:
+                # A entrada herdada do processo pai daria uma segunda execução
+                self.cancelar(nome)
+                self._agendar_periodica(intervalo, funcao, nome)
+            threading.Thread(target=self._executar, name="agendador", daemon=True).start()
+
+    def _proxima(self):
+        with self._condicao:
+            while True:
+                while self._heap and not self._heap[0][4]:
+                    heapq.heappop(self._heap)
+                espera = self._heap[0][0] - time.time() if self._heap else None
+                if espera is not None and espera <= 0:
+                    _, _, funcao, chave, _ = heapq.heappop(self._heap)
+                    if chave is not None:
+                        self._por_chave.pop(chave, None)
+                    return funcao
+                self._condicao.wait(espera)
+
+    def _executar(self):
+        while True:
+            funcao = self._proxima()
+            try:
+                funcao()
+                self.executadas += 1
+            except Exception as e:
+                self.erros += 1
+                print(f"❌ Erro em tarefa agendada: {e}")
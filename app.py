@@ -1,10 +1,40 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, abort, g, stream_with_context
 from flask_cors import CORS
-import requests
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
+import math
+import time
 from datetime import datetime, timedelta
 import json
+import base64
+import click
+import csv
+import io
 from dotenv import load_dotenv
+from eventos import HubEventos, formatar_evento, transmitir
+from pagbank import ClientePagBank, CircuitBreaker, PagBankIndisponivel, PagBankSaturado
+from cache import CacheTTL
+from spool import SpoolWebhooks
+from armazem_memoria import ArmazemMemoria
+from armazem_sqlite import ArmazemSQLite
+from estaticos import ArquivosEstaticos, responder_pagina
+from cardapio import CarregadorCardapio, ErroCardapio, CardapioIndisponivel
+from metricas import RegistroMetricas, ouvinte_mongo
+from conexao_mongo import ConexaoMongo
+from limitador import LimitadorTaxa
+from reconciliacao import Reconciliador, AGUARDANDO, PAGO, FINALIZADO, EXPIRADO
+from agendador import Agendador
+from vendas import CuboVendas, NIVEIS, contribuicao, faixa, periodos, relatorio
+
+# Encoder JSON rápido para a exportação (orjson, se instalado)
+try:
+    import orjson
+
+    def json_linha(obj):
+        return orjson.dumps(obj, default=str) + b"\n"
+except ImportError:
+    def json_linha(obj):
+        return (json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str) + "\n").encode()
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -12,17 +42,99 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# Atrás do proxy do Render o IP do cliente vem no X-Forwarded-For; só confia nos
+# PROXIES_CONFIAVEIS últimos saltos (0: usa o endereço da conexão)
+PROXIES_CONFIAVEIS = int(os.getenv("PROXIES_CONFIAVEIS", "0"))
+if PROXIES_CONFIAVEIS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIAVEIS)
+
+# Métricas no formato Prometheus (/metrics). Com METRICAS_DIR (o gunicorn.conf.py define)
+# cada worker grava um snapshot e a exportação soma todos.
+registro_metricas = RegistroMetricas(
+    os.getenv("METRICAS_DIR"),
+    intervalo=float(os.getenv("METRICAS_INTERVALO", "5"))
+)
+registro_metricas.descrever("delmonte_http_requisicao_segundos", "histogram", "Duração das requisições por rota, método e status")
+registro_metricas.descrever("delmonte_pagbank_requisicao_segundos", "histogram", "Latência das chamadas ao PagBank por operação e status")
+registro_metricas.descrever("delmonte_pagbank_rejeitadas_total", "counter", "Chamadas ao PagBank barradas pelo circuit breaker")
+registro_metricas.descrever("delmonte_pagbank_fila_esgotada_total", "counter", "Chamadas ao PagBank sem vaga dentro da espera máxima")
+registro_metricas.descrever("delmonte_limite_taxa_total", "counter", "Requisições recusadas com 429 por regra de limite")
+registro_metricas.descrever(
+    "delmonte_mongo_operacao_segundos", "histogram", "Duração dos comandos do MongoDB",
+    limites=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+registro_metricas.descrever("delmonte_fallback_memoria_total", "counter", "Operações atendidas pelo armazém local com MongoDB configurado (motivo: erro ou desconectado)")
+registro_metricas.descrever("delmonte_mongo_conectado", "gauge", "Workers com MongoDB conectado")
+registro_metricas.descrever("delmonte_sse_conexoes", "gauge", "Conexões SSE abertas")
+
+def _observar_pagbank(operacao, status, segundos):
+    if status == "rejeitada":
+        registro_metricas.contar("delmonte_pagbank_rejeitadas_total", {"operacao": operacao})
+    elif status == "fila":
+        registro_metricas.contar("delmonte_pagbank_fila_esgotada_total", {"operacao": operacao})
+    else:
+        registro_metricas.observar(
+            "delmonte_pagbank_requisicao_segundos", segundos, {"operacao": operacao, "status": str(status)}
+        )
+
 # Configurações do PagBank
 PAGBANK_TOKEN = os.getenv("PAGBANK_TOKEN", "SEU_TOKEN_SANDBOX_AQUI")
 PAGBANK_ENV = os.getenv("PAGBANK_ENV", "sandbox")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "https://seu-site.com/webhook-pagbank")
 
-# URLs da API baseadas no ambiente
-if PAGBANK_ENV == "sandbox":
+# URLs da API baseadas no ambiente (PAGBANK_URL_API sobrescreve, ex.: PagBank falso do bench/)
+if os.getenv("PAGBANK_URL_API"):
+    URL_API = os.getenv("PAGBANK_URL_API")
+elif PAGBANK_ENV == "sandbox":
     URL_API = "https://sandbox.api.pagseguro.com/orders"
 else:
     URL_API = "https://api.pagseguro.com/orders"
 
+# Cliente do PagBank (um por worker, com pool de conexões keep-alive e no máximo
+# PAGBANK_MAX_SIMULTANEAS chamadas ao mesmo tempo; as demais esperam uma vaga). Sem
+# PAGBANK_POOL_CONEXOES o tamanho do pool sai do tipo de worker, na primeira chamada.
+pagbank = ClientePagBank(
+    URL_API,
+    PAGBANK_TOKEN,
+    tamanho_pool=int(os.getenv("PAGBANK_POOL_CONEXOES", "0")) or None,
+    timeout_conexao=float(os.getenv("PAGBANK_TIMEOUT_CONEXAO", "3.05")),
+    timeout_leitura=float(os.getenv("PAGBANK_TIMEOUT_LEITURA", "20")),
+    retentativas=int(os.getenv("PAGBANK_RETENTATIVAS", "2")),
+    breaker=CircuitBreaker(
+        limite_falhas=int(os.getenv("PAGBANK_BREAKER_FALHAS", "5")),
+        segundos_aberto=int(os.getenv("PAGBANK_BREAKER_SEGUNDOS", "30"))
+    ),
+    observador=_observar_pagbank,
+    max_simultaneas=int(os.environ["PAGBANK_MAX_SIMULTANEAS"]) if os.getenv("PAGBANK_MAX_SIMULTANEAS") else None,
+    espera_vaga=float(os.getenv("PAGBANK_ESPERA_VAGA", "2"))
+)
+
+# 503 com Retry-After: fila cheia libera em instantes, circuit breaker só depois do intervalo
+def resposta_pagbank_indisponivel(erro):
+    espera = 1 if isinstance(erro, PagBankSaturado) else pagbank.breaker.segundos_aberto
+    return jsonify({"erro": str(erro)}), 503, {"Retry-After": str(espera)}
+
+# Cache das consultas de /status-pedido (invalidado pelo webhook)
+CACHE_STATUS_TTL = float(os.getenv("CACHE_STATUS_TTL", "3"))
+CACHE_STATUS_TTL_FINAL = float(os.getenv("CACHE_STATUS_TTL_FINAL", "60"))
+STATUS_PAGAMENTO_FINAIS = {"PAID", "DECLINED", "CANCELED", "EXPIRED"}
+cache_status = CacheTTL(
+    capacidade=int(os.getenv("CACHE_STATUS_CAPACIDADE", "5000")),
+    ttl=CACHE_STATUS_TTL
+)
+
+# Cache curto das estatísticas calculadas no MongoDB (o painel consulta com frequência)
+cache_estatisticas = CacheTTL(capacidade=4, ttl=float(os.getenv("CACHE_ESTATISTICAS_TTL", "2")))
+
+# Hub de eventos (SSE) do painel da cozinha e das páginas de pagamento
+TOPICO_COZINHA = "cozinha"
+hub_eventos = HubEventos(
+    capacidade_fila=int(os.getenv("SSE_CAPACIDADE_FILA", "50")),
+    max_assinantes=int(os.getenv("SSE_MAX_CONEXOES", "500"))
+)
+SSE_HEARTBEAT_SEGUNDOS = int(os.getenv("SSE_HEARTBEAT_SEGUNDOS", "15"))
+SSE_DURACAO_MAXIMA_SEGUNDOS = int(os.getenv("SSE_DURACAO_MAXIMA_SEGUNDOS", "300"))
+
 # Configuração MongoDB (opcional com fallback)
 MONGODB_URI = os.getenv("MONGODB_URI")
 client = None
@@ -31,23 +143,185 @@ pedidos_collection = None
 
 if MONGODB_URI:
     try:
-        from pymongo import MongoClient
+        from pymongo import MongoClient, ReturnDocument, ASCENDING, DESCENDING, UpdateOne, ReplaceOne
+        from pymongo.errors import BulkWriteError
         from bson import ObjectId
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        client.admin.command('ping')
-        db = client['delmonte_pizzaria']
-        pedidos_collection = db['pedidos']
-        print("✅ MongoDB conectado!")
-    except Exception as e:
-        print(f"⚠️ MongoDB indisponível: {str(e)}")
-        client = None
-        db = None
-        pedidos_collection = None
+    except ImportError as e:
+        print(f"⚠️ pymongo indisponível: {e}")
+        MONGODB_URI = None
 else:
     print("⚠️ MONGODB_URI não configurada")
 
-# Fallback para lista em memória se MongoDB não disponível
-pedidos_confirmados = []
+# Nada conecta no import: cada worker abre o próprio cliente na primeira requisição
+# (ver conexao_mongo). Até lá, e enquanto o MongoDB estiver fora, vale a memória.
+def criar_cliente_mongo():
+    return MongoClient(
+        MONGODB_URI,
+        maxPoolSize=int(os.getenv("MONGO_POOL_MAX", "50")),
+        minPoolSize=int(os.getenv("MONGO_POOL_MIN", "0")),
+        maxIdleTimeMS=int(os.getenv("MONGO_POOL_OCIOSO_MS", "60000")),
+        serverSelectionTimeoutMS=int(os.getenv("MONGO_TIMEOUT_SELECAO_MS", "2000")),
+        connectTimeoutMS=int(os.getenv("MONGO_TIMEOUT_CONEXAO_MS", "3000")),
+        socketTimeoutMS=int(os.getenv("MONGO_TIMEOUT_SOCKET_MS", "10000")),
+        event_listeners=[ouvinte_mongo(registro_metricas)]
+    )
+
+def ao_conectar_mongo(novo_cliente):
+    global client, db, pedidos_collection
+    client = novo_cliente
+    db = client['delmonte_pizzaria']
+    pedidos_collection = db['pedidos']
+    garantir_indices()
+    print(f"✅ MongoDB conectado! (pid {os.getpid()})")
+
+def ao_desconectar_mongo(erro):
+    global pedidos_collection
+    # As operações passam direto para a memória em vez de esperar o timeout a cada chamada
+    pedidos_collection = None
+    print(f"⚠️ MongoDB indisponível, usando memória até reconectar: {erro}")
+
+# Índices da coleção de pedidos (create_index é idempotente; roda a cada inicialização)
+def garantir_indices():
+    indices = [
+        # Busca por id e garantia de que o mesmo pedido não é gravado duas vezes
+        ([("id", ASCENDING)], {"unique": True, "name": "id_unico"}),
+        # Colunas do painel e contagens por status
+        ([("status", ASCENDING), ("created_at", DESCENDING)], {"name": "status_created_at"}),
+        # Paginação por cursor (created_at desc, id desc) e filtros por data
+        ([("created_at", DESCENDING), ("id", DESCENDING)], {"name": "created_at_id"}),
+        # Feed incremental de alterações
+        ([("seq", ASCENDING)], {"name": "seq"})
+    ]
+    # Coleção fria dos pedidos arquivados (exportação com ?arquivo=1)
+    indices_arquivo = [
+        ([("id", ASCENDING)], {"unique": True, "name": "id_unico"}),
+        ([("created_at", DESCENDING), ("id", DESCENDING)], {"name": "created_at_id"})
+    ]
+    for colecao, lista in ((pedidos_collection, indices), (db[COLECAO_ARQUIVO], indices_arquivo)):
+        for chaves, opcoes in lista:
+            try:
+                colecao.create_index(chaves, **opcoes)
+            except Exception as e:
+                # Ex.: pedidos duplicados antigos impedem o índice único; o app segue sem ele
+                print(f"⚠️ Não foi possível criar o índice {opcoes['name']} em {colecao.name}: {e}")
+
+# Conta cada operação que cai para o armazém local com MongoDB configurado: por erro na
+# chamada ou porque ele nem está conectado (falha na conexão inicial, queda). Sem
+# MONGODB_URI o armazém local é o modo normal e não conta.
+def contar_fallback(operacao, motivo="erro"):
+    if MONGODB_URI:
+        registro_metricas.contar("delmonte_fallback_memoria_total", {"operacao": operacao, "motivo": motivo})
+
+registro_metricas.coletar_com(lambda: [
+    ("delmonte_mongo_conectado", None, 1 if pedidos_collection is not None else 0),
+    ("delmonte_sse_conexoes", None, hub_eventos.total_assinantes())
+])
+
+# Armazém local se MongoDB não disponível: em memória (indexado, com limite de tamanho,
+# um por worker) ou, com ARMAZEM_PEDIDOS=sqlite, um arquivo SQLite compartilhado por
+# todos os workers do gunicorn
+ARMAZEM_PEDIDOS = os.getenv("ARMAZEM_PEDIDOS", "memoria")
+if ARMAZEM_PEDIDOS == "sqlite":
+    armazem_local = ArmazemSQLite(os.getenv("ARMAZEM_SQLITE_PATH", "pedidos_local.db"))
+else:
+    armazem_local = ArmazemMemoria(
+        capacidade=int(os.getenv("MEMORIA_MAX_PEDIDOS", "50000")),
+        arquivo_descarte=os.getenv("MEMORIA_ARQUIVO_DESCARTE"),
+        max_log=int(os.getenv("MAX_LOG_ALTERACOES", "10000")),
+        # Com MongoDB configurado todo pedido na memória ainda vai ser drenado para ele
+        status_descartaveis=() if MONGODB_URI else ("delivered",)
+    )
+print(f"💾 Armazém local de pedidos: {ARMAZEM_PEDIDOS}")
+
+# Pedidos entregues há mais de ARQUIVO_DIAS saem da coleção quente para esta
+COLECAO_ARQUIVO = "pedidos_arquivo"
+ARQUIVO_DIAS = int(os.getenv("ARQUIVO_DIAS", "30"))
+
+# Rollups de vendas (/api/vendas): coleções no MongoDB, cubo em memória no fallback
+COLECOES_VENDAS = {"hora": "vendas_por_hora", "dia": "vendas_por_dia"}
+cubo_vendas = CuboVendas()
+
+# Soma os pedidos gravados nos baldes de hora e dia com um único bulk_write de $inc
+def _registrar_vendas_mongo(pedidos):
+    operacoes = {nivel: [] for nivel in NIVEIS}
+    for pedido in pedidos:
+        incrementos = contribuicao(pedido)
+        for nivel, periodo in periodos(pedido).items():
+            operacoes[nivel].append(UpdateOne({"_id": periodo}, {"$inc": incrementos}, upsert=True))
+    try:
+        for nivel, lista in operacoes.items():
+            db[COLECOES_VENDAS[nivel]].bulk_write(lista, ordered=False)
+    except Exception as e:
+        # O pedido já está gravado; "flask reconstruir-vendas" recalcula os baldes depois
+        print(f"⚠️ Erro ao atualizar rollups de vendas: {e}")
+
+# Move para o MongoDB os pedidos que ficaram na memória enquanto ele esteve fora.
+# Pedido que já existia no MongoDB só recebe o status da memória se ele for mais recente.
+def drenar_memoria(tamanho_lote=500):
+    if pedidos_collection is None or not len(armazem_local):
+        return 0
+    movidos = 0
+    pedidos = armazem_local.listar()
+    for inicio in range(0, len(pedidos), tamanho_lote):
+        lote = pedidos[inicio:inicio + tamanho_lote]
+        seq_memoria = [(pedido["id"], pedido.get("seq")) for pedido in lote]
+        ultima = _proxima_sequencia_mongo(len(lote))
+        for seq, pedido in enumerate(lote, ultima - len(lote) + 1):
+            pedido["seq"] = pedido["seq_criacao"] = seq
+
+        falhas = {}
+        try:
+            pedidos_collection.insert_many(lote, ordered=False)
+        except BulkWriteError as e:
+            falhas = {erro["index"]: erro for erro in e.details.get("writeErrors", [])}
+
+        gravados = []
+        transferidos = []
+        for i, pedido in enumerate(lote):
+            erro = falhas.get(i)
+            if erro is None:
+                gravados.append(pedido)
+            elif erro.get("code") == 11000:
+                pedidos_collection.update_one(
+                    {"id": pedido["id"], "updated_at": {"$not": {"$gte": pedido.get("updated_at", "")}}},
+                    {"$set": {
+                        "status": pedido.get("status"),
+                        "status_anterior": pedido.get("status_anterior"),
+                        "updated_at": pedido.get("updated_at"),
+                        "seq": _proxima_sequencia_mongo()
+                    }}
+                )
+            else:
+                # Continua na memória para a próxima tentativa
+                continue
+            transferidos.append(seq_memoria[i])
+        if gravados:
+            _registrar_vendas_mongo(gravados)
+        movidos += armazem_local.remover(transferidos)
+
+    if movidos:
+        print(f"🔄 {movidos} pedidos movidos da memória para o MongoDB")
+    return movidos
+
+def _drenar_memoria_periodicamente():
+    try:
+        drenar_memoria()
+    except Exception as e:
+        print(f"⚠️ Erro ao mover pedidos da memória para o MongoDB: {e}")
+
+conexao_mongo = ConexaoMongo(
+    criar_cliente_mongo,
+    ao_conectar_mongo,
+    ao_desconectar_mongo,
+    periodicamente=_drenar_memoria_periodicamente,
+    intervalo_verificacao=float(os.getenv("MONGO_INTERVALO_VERIFICACAO", "10"))
+) if MONGODB_URI else None
+# Primeira requisição do worker espera um pouco pela conexão em vez de já cair na memória
+MONGO_ESPERA_INICIAL = float(os.getenv("MONGO_ESPERA_INICIAL", "2"))
+
+def garantir_mongo(esperar=0):
+    if conexao_mongo is not None:
+        conexao_mongo.garantir_iniciado(esperar)
 
 # Função auxiliar para converter ObjectId para string
 def serialize_pedido(pedido):
@@ -55,66 +329,551 @@ def serialize_pedido(pedido):
         pedido['_id'] = str(pedido['_id'])
     return pedido
 
-# Função para salvar pedido (MongoDB ou memória)
-def salvar_pedido(pedido):
-    if pedidos_collection:
+# Sequência monotônica de alterações usada pelo feed incremental (/api/pedidos/novos).
+# No MongoDB o contador fica na coleção "contadores" e vale para todos os workers;
+# na memória a sequência e o log de alterações ficam no próprio ArmazemMemoria.
+
+# Uma escrita no MongoDB pode reservar a seq N e ficar visível depois da N+1.
+# Lacunas mais novas que esta janela seguram o token para o pedido não se perder.
+JANELA_SEQUENCIA_SEGUNDOS = 2
+
+# Reserva "quantidade" valores da sequência em uma ida ao banco; retorna o último
+def _proxima_sequencia_mongo(quantidade=1):
+    contador = db['contadores'].find_one_and_update(
+        {"_id": "pedidos"},
+        {"$inc": {"seq": quantidade}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return contador["seq"]
+
+# Grava o lote no armazém local (uma transação no SQLite); retorna os pedidos novos
+def _salvar_local(pedidos):
+    for pedido in pedidos:
+        pedido.pop("_id", None)
+    salvos = armazem_local.adicionar_lote(pedidos)
+    ids_salvos = {pedido["id"] for pedido in salvos}
+    for pedido in pedidos:
+        if pedido["id"] not in ids_salvos:
+            print(f"Pedido {pedido.get('id')} já registrado, ignorando")
+    if not armazem_local.compartilhado:
+        for pedido in salvos:
+            cubo_vendas.registrar(pedido)
+    return salvos
+
+# Salva um lote de pedidos com um único insert_many (ordered=False: um erro não
+# interrompe o resto). Retorna os pedidos realmente gravados; ids que já existiam
+# (reenvio do mesmo pagamento) são ignorados pelo índice único.
+def salvar_pedidos(pedidos):
+    if not pedidos:
+        return []
+    if pedidos_collection is not None:
         try:
-            resultado = pedidos_collection.insert_one(pedido)
-            return resultado.inserted_id is not None
+            ultima = _proxima_sequencia_mongo(len(pedidos))
+            for seq, pedido in enumerate(pedidos, ultima - len(pedidos) + 1):
+                pedido["seq"] = pedido["seq_criacao"] = seq
+            pedidos_collection.insert_many(pedidos, ordered=False)
+            _registrar_vendas_mongo(pedidos)
+            return pedidos
+        except BulkWriteError as e:
+            falhas = {erro["index"]: erro for erro in e.details.get("writeErrors", [])}
+            gravados_mongo = []
+            para_local = []
+            for i, pedido in enumerate(pedidos):
+                erro = falhas.get(i)
+                if erro is None:
+                    gravados_mongo.append(pedido)
+                elif erro.get("code") == 11000:
+                    print(f"Pedido {pedido.get('id')} já registrado, ignorando")
+                else:
+                    print(f"Erro ao salvar no MongoDB: {erro.get('errmsg')}")
+                    contar_fallback("salvar")
+                    para_local.append(pedido)
+            if gravados_mongo:
+                _registrar_vendas_mongo(gravados_mongo)
+            return gravados_mongo + _salvar_local(para_local)
         except Exception as e:
             print(f"Erro ao salvar no MongoDB: {e}")
-            pedidos_confirmados.append(pedido)
-            return True
+            contar_fallback("salvar")
     else:
-        pedidos_confirmados.append(pedido)
-        return True
+        contar_fallback("salvar", "desconectado")
 
-# Função para listar pedidos (MongoDB ou memória)
-def listar_pedidos():
-    if pedidos_collection:
+    return _salvar_local(pedidos)
+
+# Função para salvar pedido (MongoDB ou memória)
+def salvar_pedido(pedido):
+    salvar_pedidos([pedido])
+    return True
+
+# Campos usados pelo painel da cozinha (pedidos.html) - projeção padrão de /api/pedidos
+CAMPOS_PAINEL = [
+    "id", "customer", "delivery_address", "items", "subtotal", "delivery_fee", "total",
+    "payment_method", "payment_status", "status", "created_at", "paid_at", "updated_at"
+]
+# Campos que ?campos= pode pedir: qualquer outro valor montaria uma projeção inválida no MongoDB
+CAMPOS_PEDIDO = frozenset(CAMPOS_PAINEL) | {"_id", "status_anterior", "seq", "seq_criacao"}
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 200
+
+# Cursor opaco com a chave (created_at, id) do último pedido da página
+def codificar_cursor(pedido):
+    chave = json.dumps([pedido.get("created_at", ""), pedido.get("id", "")])
+    return base64.urlsafe_b64encode(chave.encode()).decode()
+
+def decodificar_cursor(cursor):
+    try:
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), str(order_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+# Converte "desde"/"ate" (AAAA-MM-DD ou data/hora ISO) no intervalo [inicio, fim) de created_at
+def intervalo_datas(desde=None, ate=None):
+    try:
+        inicio = datetime.fromisoformat(desde).isoformat() if desde else None
+        fim = None
+        if ate:
+            fim_dt = datetime.fromisoformat(ate)
+            if len(ate) == 10:
+                # Data sem hora inclui o dia inteiro
+                fim_dt += timedelta(days=1)
+            fim = fim_dt.isoformat()
+    except ValueError:
+        raise ValueError("Data inválida, use AAAA-MM-DD ou AAAA-MM-DDTHH:MM:SS")
+    return inicio, fim
+
+def _filtro_mongo(status=None, inicio=None, fim=None, cursor=None):
+    condicoes = []
+    if status:
+        condicoes.append({"status": {"$in": list(status)}})
+    intervalo = {}
+    if inicio:
+        intervalo["$gte"] = inicio
+    if fim:
+        intervalo["$lt"] = fim
+    if intervalo:
+        condicoes.append({"created_at": intervalo})
+    if cursor:
+        created_at, order_id = cursor
+        condicoes.append({"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": order_id}}
+        ]})
+    return {"$and": condicoes} if condicoes else {}
+
+def _projetar(pedido, campos):
+    if not campos:
+        return pedido
+    return {campo: pedido[campo] for campo in campos if campo in pedido}
+
+# Busca paginada por cursor (keyset em created_at + id, mais recentes primeiro)
+def buscar_pedidos(status=None, inicio=None, fim=None, cursor=None, limite=LIMITE_PADRAO, campos=None):
+    if pedidos_collection is not None:
         try:
-            pedidos = list(pedidos_collection.find().sort("created_at", -1))
-            return [serialize_pedido(p) for p in pedidos]
+            projecao = None
+            if campos:
+                projecao = {campo: 1 for campo in campos}
+                projecao.update({"id": 1, "created_at": 1})
+                if "_id" not in campos:
+                    projecao["_id"] = 0
+            consulta = pedidos_collection.find(
+                _filtro_mongo(status, inicio, fim, cursor), projecao
+            ).sort([("created_at", -1), ("id", -1)]).limit(limite + 1)
+            pedidos = [serialize_pedido(p) for p in consulta]
+            proximo = codificar_cursor(pedidos[limite - 1]) if len(pedidos) > limite else None
+            return [_projetar(p, campos) for p in pedidos[:limite]], proximo
         except Exception as e:
             print(f"Erro ao buscar no MongoDB: {e}")
-            return pedidos_confirmados
+            contar_fallback("buscar")
     else:
-        return pedidos_confirmados
+        contar_fallback("buscar", "desconectado")
+
+    pedidos, tem_mais = armazem_local.buscar(status, inicio, fim, cursor, limite)
+    proximo = codificar_cursor(pedidos[-1]) if tem_mais else None
+    return [_projetar(p, campos) for p in pedidos], proximo
+
+# Percorre todos os pedidos do filtro em lotes (keyset em created_at + id, mais recentes
+# primeiro) sem montar o resultado inteiro. Um erro do MongoDB no meio interrompe a
+# iteração em vez de continuar pela memória e misturar as fontes.
+# local=True lê só o armazém local; arquivados=True lê a coleção fria do MongoDB.
+def iterar_pedidos(status=None, inicio=None, fim=None, tamanho_lote=500, local=False, arquivados=False):
+    colecao = None if local else pedidos_collection
+    if arquivados:
+        if colecao is None:
+            return
+        colecao = db[COLECAO_ARQUIVO]
+    elif colecao is None and not local:
+        contar_fallback("exportar", "desconectado")
+    cursor = None
+    while True:
+        if colecao is not None:
+            lote = list(
+                colecao.find(_filtro_mongo(status, inicio, fim, cursor), {"_id": 0})
+                .sort([("created_at", -1), ("id", -1)])
+                .limit(tamanho_lote)
+            )
+            mais = len(lote) == tamanho_lote
+        else:
+            lote, mais = armazem_local.buscar(status, inicio, fim, cursor, tamanho_lote)
+        if lote:
+            yield lote
+        if not mais or not lote:
+            return
+        cursor = (lote[-1].get("created_at", ""), lote[-1]["id"])
+
+COLUNAS_CSV = [
+    "id", "created_at", "paid_at", "updated_at", "status", "payment_method", "payment_status",
+    "cliente_nome", "cliente_email", "cliente_telefone", "cep", "endereco", "bairro", "cidade",
+    "itens", "subtotal", "delivery_fee", "total"
+]
+
+def _linha_csv(pedido):
+    cliente = pedido.get("customer") or {}
+    endereco = pedido.get("delivery_address") or {}
+    return [
+        pedido.get("id"), pedido.get("created_at"), pedido.get("paid_at"), pedido.get("updated_at"),
+        pedido.get("status"), pedido.get("payment_method"), pedido.get("payment_status"),
+        cliente.get("name"), cliente.get("email"), cliente.get("phone"),
+        endereco.get("cep"),
+        " ".join(str(parte) for parte in (endereco.get("street"), endereco.get("number"), endereco.get("complement")) if parte),
+        endereco.get("neighborhood"), endereco.get("city"),
+        "; ".join(f"{item.get('quantity', 1)}x {item.get('name', '')}" for item in pedido.get("items") or []),
+        pedido.get("subtotal"), pedido.get("delivery_fee"), pedido.get("total")
+    ]
+
+# Corpo da exportação: um pedaço por lote, memória constante qualquer que seja o total
+def gerar_exportacao(formato, status, inicio, fim, arquivados=False):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if formato == "csv":
+        # BOM para o Excel abrir acentos corretamente
+        escritor.writerow(COLUNAS_CSV)
+        yield ("\ufeff" + buffer.getvalue()).encode()
+    exportados = 0
+    try:
+        for lote in iterar_pedidos(status, inicio, fim, arquivados=arquivados):
+            if formato == "csv":
+                buffer.seek(0)
+                buffer.truncate()
+                escritor.writerows(_linha_csv(pedido) for pedido in lote)
+                yield buffer.getvalue().encode()
+            else:
+                yield b"".join(json_linha(pedido) for pedido in lote)
+            exportados += len(lote)
+    except Exception as e:
+        # O status 200 já foi enviado: registra e, no NDJSON, avisa na última linha
+        print(f"❌ Exportação interrompida depois de {exportados} pedidos: {e}")
+        if formato == "ndjson":
+            yield json_linha({"erro": f"Exportação interrompida: {e}", "exportados": exportados})
+        return
+    print(f"📤 Exportação {formato}: {exportados} pedidos")
+
+def _atualizar_status_memoria(order_id, novo_status):
+    return armazem_local.atualizar_status(order_id, novo_status, datetime.now().isoformat())
 
 # Função para atualizar status (MongoDB ou memória)
 def atualizar_status_pedido_db(order_id, novo_status):
-    if pedidos_collection:
+    if pedidos_collection is not None:
         try:
-            resultado = pedidos_collection.update_one(
+            # Seq só para pedido que existe: um id desconhecido (404) deixaria uma lacuna no feed
+            if pedidos_collection.find_one({"id": order_id}, {"_id": 1}) is None:
+                return None
+            # Pipeline de update para guardar o status anterior (usado nos tombstones do feed);
+            # uma única ida ao banco devolve o pedido já atualizado
+            return pedidos_collection.find_one_and_update(
                 {"id": order_id},
-                {"$set": {"status": novo_status, "updated_at": datetime.now().isoformat()}}
+                [{"$set": {
+                    "status_anterior": "$status",
+                    "status": {"$literal": novo_status},
+                    "updated_at": datetime.now().isoformat(),
+                    "seq": _proxima_sequencia_mongo()
+                }}],
+                return_document=ReturnDocument.AFTER
             )
-            if resultado.matched_count > 0:
-                return pedidos_collection.find_one({"id": order_id})
-            return None
         except Exception as e:
             print(f"Erro ao atualizar no MongoDB: {e}")
+            contar_fallback("atualizar_status")
             # Fallback para memória
-            for pedido in pedidos_confirmados:
-                if pedido["id"] == order_id:
-                    pedido["status"] = novo_status
-                    pedido["updated_at"] = datetime.now().isoformat()
-                    return pedido
-            return None
+            return _atualizar_status_memoria(order_id, novo_status)
+    else:
+        contar_fallback("atualizar_status", "desconectado")
+        return _atualizar_status_memoria(order_id, novo_status)
+
+def _limite_recente():
+    return (datetime.now() - timedelta(seconds=JANELA_SEQUENCIA_SEGUNDOS)).isoformat()
+
+# Token a partir do qual um cliente que acabou de carregar a lista deve pedir alterações
+def token_atual():
+    if pedidos_collection is not None:
+        try:
+            # Tudo que mudou dentro da janela volta no feed (repetido é inofensivo, faltante não)
+            ultimo = pedidos_collection.find_one(
+                {"updated_at": {"$lt": _limite_recente()}, "seq": {"$exists": True}},
+                {"seq": 1},
+                sort=[("seq", -1)]
+            )
+            return ultimo["seq"] if ultimo else 0
+        except Exception as e:
+            print(f"Erro ao ler sequência no MongoDB: {e}")
+            contar_fallback("token")
+    else:
+        contar_fallback("token", "desconectado")
+    return armazem_local.ultima_sequencia
+
+def _token_sem_lacunas(token, alterados):
+    limite_recente = _limite_recente()
+    esperado = token + 1
+    for pedido in alterados:
+        if pedido["seq"] != esperado and pedido.get("updated_at", "") >= limite_recente:
+            break
+        esperado = pedido["seq"] + 1
+    return esperado - 1
+
+# Separa as alterações em pedidos novos (completos) e tombstones de mudança de status
+def _montar_alteracoes(alterados, token, campos):
+    novos = []
+    movimentos = []
+    for pedido in alterados:
+        if pedido.get("seq_criacao", 0) > token:
+            novos.append(_projetar(pedido, campos))
+        else:
+            movimentos.append({
+                "id": pedido["id"],
+                "status": pedido.get("status"),
+                "status_anterior": pedido.get("status_anterior"),
+                "updated_at": pedido.get("updated_at")
+            })
+    return novos, movimentos
+
+# Pedidos criados ou alterados depois do token, em ordem de seq.
+# Retorna (novos, movimentos, novo_token, mais, resync)
+def buscar_alteracoes(token, limite=LIMITE_MAXIMO, campos=CAMPOS_PAINEL):
+    if pedidos_collection is not None:
+        try:
+            projecao = {campo: 1 for campo in campos}
+            projecao.update({"_id": 0, "seq": 1, "seq_criacao": 1, "status_anterior": 1, "updated_at": 1})
+            alterados = list(
+                pedidos_collection.find({"seq": {"$gt": token}}, projecao).sort("seq", 1).limit(limite + 1)
+            )
+            mais = len(alterados) > limite
+            alterados = alterados[:limite]
+            novo_token = _token_sem_lacunas(token, alterados)
+            novos, movimentos = _montar_alteracoes(alterados, token, campos)
+            return novos, movimentos, novo_token, mais, False
+        except Exception as e:
+            print(f"Erro ao buscar alterações no MongoDB: {e}")
+            contar_fallback("alteracoes")
+    else:
+        contar_fallback("alteracoes", "desconectado")
+
+    alterados, novo_token, mais, resync = armazem_local.alteracoes_desde(token, limite)
+    if resync:
+        return [], [], novo_token, False, True
+    novos, movimentos = _montar_alteracoes(alterados, token, campos)
+    return novos, movimentos, novo_token, mais, False
+
+# Estatísticas do dia direto no MongoDB: agregações pelos índices de created_at e de status,
+# sem trazer os pedidos para a aplicação
+def _estatisticas_mongo(hoje):
+    amanha = (datetime.fromisoformat(hoje) + timedelta(days=1)).date().isoformat()
+    resumo_dia = list(pedidos_collection.aggregate([
+        {"$match": {"created_at": {"$gte": hoje, "$lt": amanha}}},
+        {"$group": {"_id": None, "pedidos": {"$sum": 1}, "receita": {"$sum": "$total"}}}
+    ]))
+    por_status = {
+        item["_id"]: item["quantidade"]
+        for item in pedidos_collection.aggregate([
+            {"$match": {"status": {"$in": ["pending", "preparing"]}}},
+            {"$group": {"_id": "$status", "quantidade": {"$sum": 1}}}
+        ])
+    }
+    pedidos_hoje, receita_hoje = (resumo_dia[0]["pedidos"], resumo_dia[0]["receita"]) if resumo_dia else (0, 0)
+    return {
+        "pedidos_hoje": pedidos_hoje,
+        "pendentes": por_status.get("pending", 0),
+        "preparando": por_status.get("preparing", 0),
+        "receita_hoje": round(receita_hoje, 2)
+    }
+
+# Estatísticas do dia (MongoDB ou contadores incrementais da memória).
+# reconciliar=True ignora o cache (MongoDB) ou recalcula os contadores a partir dos pedidos
+# (memória); retorna (stats, divergencias)
+def calcular_estatisticas(reconciliar=False):
+    hoje = datetime.now().date().isoformat()
+    if pedidos_collection is not None:
+        try:
+            if reconciliar:
+                cache_estatisticas.invalidar(hoje)
+            return cache_estatisticas.obter_ou_carregar(hoje, lambda: _estatisticas_mongo(hoje)), {}
+        except Exception as e:
+            print(f"Erro ao calcular estatísticas no MongoDB: {e}")
+            contar_fallback("estatisticas")
+    else:
+        contar_fallback("estatisticas", "desconectado")
+
+    divergencias = armazem_local.reconciliar() if reconciliar else {}
+    if divergencias:
+        print(f"⚠️ Contadores de estatísticas divergentes corrigidos: {divergencias}")
+    pedidos_hoje, receita_hoje = armazem_local.resumo_dia(hoje)
+    por_status = armazem_local.contagem_por_status()
+    return {
+        "pedidos_hoje": pedidos_hoje,
+        "pendentes": por_status.get("pending", 0),
+        "preparando": por_status.get("preparing", 0),
+        "receita_hoje": receita_hoje
+    }, divergencias
+
+def _filtro_baldes(inicio, fim, nivel):
+    de, ate = faixa(inicio, fim, nivel)
+    filtro = {"$gte": de}
+    if ate is not None:
+        filtro["$lt"] = ate
+    return {"_id": filtro}
+
+# Relatório de vendas de [inicio, fim) lendo só os baldes do nível (hora ou dia)
+def consultar_vendas(inicio, fim, nivel, top=10):
+    if pedidos_collection is not None:
+        try:
+            baldes = db[COLECOES_VENDAS[nivel]].find(_filtro_baldes(inicio, fim, nivel)).sort("_id", 1)
+            return relatorio([(balde.pop("_id"), balde) for balde in baldes], top)
+        except Exception as e:
+            print(f"Erro ao consultar vendas no MongoDB: {e}")
+            contar_fallback("vendas")
     else:
-        for pedido in pedidos_confirmados:
-            if pedido["id"] == order_id:
-                pedido["status"] = novo_status
-                pedido["updated_at"] = datetime.now().isoformat()
-                return pedido
+        contar_fallback("vendas", "desconectado")
+    # O cubo é de cada worker; o armazém SQLite guarda os baldes no arquivo compartilhado
+    if armazem_local.compartilhado:
+        return armazem_local.relatorio_vendas(inicio, fim, nivel, top)
+    return cubo_vendas.relatorio(inicio, fim, nivel, top)
+
+# Recalcula os baldes de [inicio, fim) a partir dos pedidos (backfill ou correção de deriva).
+# Retorna quantos pedidos foram lidos.
+def reconstruir_vendas_mongo(inicio=None, fim=None):
+    cubo = CuboVendas()
+    lidos = 0
+    projecao = {"_id": 0, "created_at": 1, "total": 1, "payment_method": 1, "items": 1}
+    for pedido in pedidos_collection.find(_filtro_mongo(inicio=inicio, fim=fim), projecao):
+        cubo.registrar(pedido)
+        lidos += 1
+    for nivel, nome in COLECOES_VENDAS.items():
+        colecao = db[nome]
+        baldes = cubo.baldes(nivel)
+        if baldes:
+            colecao.bulk_write(
+                [ReplaceOne({"_id": periodo}, balde, upsert=True) for periodo, balde in baldes],
+                ordered=False
+            )
+        # Baldes do intervalo que não têm mais pedidos
+        filtro = _filtro_baldes(inicio, fim, nivel)
+        filtro["_id"]["$nin"] = [periodo for periodo, _ in baldes]
+        colecao.delete_many(filtro)
+    return lidos
+
+# Páginas HTML carregadas e comprimidas na inicialização (recarregadas se o arquivo mudar)
+paginas_estaticas = ArquivosEstaticos(
+    app.root_path,
+    ["index.html", "pagamento.html", "pedidos.html"],
+    max_age=int(os.getenv("ESTATICOS_MAX_AGE", "0"))
+)
+
+# Preços e taxas de entrega: o total cobrado é calculado aqui, com o cardápio do servidor
+cardapio = CarregadorCardapio(os.getenv("CARDAPIO_PATH", os.path.join(app.root_path, "cardapio.json")))
+
+# Substitui itens, taxa de entrega e total enviados pelo navegador pelos do cardápio
+def cotar_pedido(dados):
+    endereco = dados.get("delivery_address") or {}
+    return {**dados, **cardapio.cotar(dados.get("items"), endereco.get("cep"))}
+
+# Campos do pedido guardados até o pagamento confirmar (spool, tabela de pagamentos): só o
+# que montar_pedido_confirmado usa. Nunca o corpo inteiro: o do cartão traz número e CVV.
+CAMPOS_PEDIDO_PENDENTE = ("customer", "delivery_address", "items", "subtotal", "delivery_fee", "total_amount", "versao_cardapio")
+
+def dados_pedido_pendente(dados, reference_id):
+    pendente = {campo: dados[campo] for campo in CAMPOS_PEDIDO_PENDENTE if campo in dados}
+    pendente["reference_id"] = reference_id
+    return pendente
+
+def _servir_pagina(nome):
+    resposta = paginas_estaticas.responder(nome, request)
+    if resposta is None:
+        abort(404)
+    return resposta
+
+# Conexão e threads de fundo de cada worker nascem na primeira requisição, depois do fork
+@app.before_request
+def iniciar_servicos_do_worker():
+    garantir_mongo(esperar=MONGO_ESPERA_INICIAL)
+    # Com --preload o app é importado no master: nenhuma thread pode nascer no import
+    spool_webhooks.garantir_iniciado()
+    reconciliador.garantir_iniciado()
+    agendador.garantir_iniciado()
+
+# Tempo de cada requisição pela regra da rota (não pela URL, para não explodir a cardinalidade)
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def registrar_tempo_requisicao(resposta):
+    inicio = g.pop("inicio_requisicao", None)
+    if inicio is not None:
+        registro_metricas.observar("delmonte_http_requisicao_segundos", time.perf_counter() - inicio, {
+            "rota": request.url_rule.rule if request.url_rule else "nao_encontrada",
+            "metodo": request.method,
+            "status": str(resposta.status_code)
+        })
+    return resposta
+
+# Limite de taxa (token bucket) por IP e por pedido, com os baldes em SQLite para valer
+# em todos os workers. Regra: (capacidade, reposição por segundo) = rajada e ritmo sustentado.
+LIMITES_ATIVOS = os.getenv("LIMITES_ATIVOS", "1") == "1"
+LIMITES_TAXA = {
+    # Cada /criar-pedido cria um pedido de verdade no PagBank
+    "criar_pedido_ip": (
+        int(os.getenv("LIMITE_CRIAR_PEDIDO_RAJADA", "5")),
+        float(os.getenv("LIMITE_CRIAR_PEDIDO_POR_MINUTO", "10")) / 60
+    ),
+    "status_ip": (
+        int(os.getenv("LIMITE_STATUS_IP_RAJADA", "30")),
+        float(os.getenv("LIMITE_STATUS_IP_POR_SEGUNDO", "1"))
+    ),
+    # Abas esquecidas abertas na página de pagamento consultando o mesmo pedido
+    "status_pedido": (
+        int(os.getenv("LIMITE_STATUS_PEDIDO_RAJADA", "20")),
+        float(os.getenv("LIMITE_STATUS_PEDIDO_POR_SEGUNDO", "0.5"))
+    )
+}
+# Endpoint -> [(regra, "ip" ou nome do parâmetro da rota)]
+ROTAS_LIMITADAS = {
+    "criar_pedido_pix": [("criar_pedido_ip", "ip")],
+    "criar_pedido_cartao": [("criar_pedido_ip", "ip")],
+    "consultar_status": [("status_ip", "ip"), ("status_pedido", "order_id")]
+}
+limitador = LimitadorTaxa(os.getenv("LIMITES_PATH", "limites.db")) if LIMITES_ATIVOS else None
+
+@app.before_request
+def controlar_admissao():
+    regras = ROTAS_LIMITADAS.get(request.endpoint)
+    if not regras or limitador is None:
         return None
+    for regra, origem in regras:
+        valor = request.remote_addr if origem == "ip" else request.view_args.get(origem)
+        capacidade, por_segundo = LIMITES_TAXA[regra]
+        espera = limitador.consumir(f"{regra}:{valor}", capacidade, por_segundo)
+        if espera:
+            registro_metricas.contar("delmonte_limite_taxa_total", {"regra": regra})
+            segundos = math.ceil(espera)
+            return jsonify({
+                "erro": "Muitas requisições, tente novamente em instantes",
+                "tentar_novamente_em": segundos
+            }), 429, {"Retry-After": str(segundos)}
+    return None
 
 # ROTAS PARA SERVIR ARQUIVOS HTML
 @app.route("/")
 def home_page():
-    try:
-        return send_from_directory('.', 'index.html')
-    except:
+    resposta = paginas_estaticas.responder('index.html', request)
+    if resposta is None:
         return jsonify({
             "status": "API PagBank DEL MONTE funcionando!",
             "ambiente": PAGBANK_ENV,
@@ -129,24 +888,32 @@ def home_page():
                 "POST /webhook-pagbank - Receber notificações"
             ]
         })
+    return resposta
 
 @app.route("/index.html")
 def index_page():
-    return send_from_directory('.', 'index.html')
+    return _servir_pagina('index.html')
 
 @app.route("/pagamento.html")
 def pagamento_page():
-    return send_from_directory('.', 'pagamento.html')
+    return _servir_pagina('pagamento.html')
 
 @app.route("/pedidos.html")
 def pedidos_page():
-    return send_from_directory('.', 'pedidos.html')
+    return _servir_pagina('pedidos.html')
 
 # ROTAS DA API
+@app.route("/api/cardapio", methods=["GET"])
+def api_cardapio():
+    atual = cardapio.atual()
+    if atual is None:
+        return jsonify({"erro": "Cardápio indisponível no momento"}), 503
+    return responder_pagina(atual.pagina, request)
+
 @app.route("/api", methods=["GET"])
 def api_info():
-    mongodb_status = "Conectado" if pedidos_collection else "Desconectado"
-    storage_type = "MongoDB" if pedidos_collection else "Memória RAM"
+    mongodb_status = "Conectado" if pedidos_collection is not None else "Desconectado"
+    storage_type = "MongoDB" if pedidos_collection is not None else "Memória RAM"
     
     return jsonify({
         "status": "API PagBank DEL MONTE funcionando!",
@@ -162,24 +929,156 @@ def api_info():
             "POST /criar-pedido-cartao - Criar pedido com cartão",
             "GET /status-pedido/<order_id> - Consultar status",
             "POST /webhook-pagbank - Receber notificações",
-            "GET /api/pedidos - Listar pedidos",
-            "PUT /api/pedidos/<order_id>/status - Atualizar status"
+            "GET /api/cardapio - Cardápio com preços e taxas de entrega (ETag = versão)",
+            "GET /api/pedidos - Listar pedidos (?limite, cursor, status, desde, ate, campos)",
+            "GET /api/pedidos/exportar - Exportação em streaming (?formato=ndjson|csv, desde, ate, status, arquivo=1)",
+            "GET /api/pedidos/novos?token=<n> - Pedidos novos e mudanças de status desde o token",
+            "GET /api/pedidos/eventos - Stream SSE do painel da cozinha",
+            "GET /status-pedido/<order_id>/eventos - Stream SSE do status do pagamento",
+            "GET /api/pagbank/metricas - Latência e erros das chamadas ao PagBank",
+            "GET /metrics - Métricas no formato Prometheus (todos os workers)",
+            "GET /saude/vivo - Liveness",
+            "GET /saude/pronto - Readiness (estado real da conexão com o MongoDB)",
+            "PUT /api/pedidos/<order_id>/status - Atualizar status",
+            "GET /api/pedidos/stats - Estatísticas do dia (?reconciliar=1 recalcula e mostra divergências)",
+            "GET /api/vendas - Receita, ticket médio, PIX x cartão e itens populares (?desde, ate, granularidade=hora|dia, top)"
         ]
     })
 
 @app.route("/api/pedidos", methods=["GET"])
 def api_listar_pedidos():
     try:
-        pedidos = listar_pedidos()
+        try:
+            limite = min(max(int(request.args.get("limite", LIMITE_PADRAO)), 1), LIMITE_MAXIMO)
+            cursor = request.args.get("cursor")
+            cursor = decodificar_cursor(cursor) if cursor else None
+            inicio, fim = intervalo_datas(request.args.get("desde"), request.args.get("ate"))
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
+
+        status = [s for s in request.args.get("status", "").split(",") if s] or None
+        campos = [c.strip() for c in request.args.get("campos", "").split(",") if c.strip()] or CAMPOS_PAINEL
+        invalidos = [c for c in campos if c not in CAMPOS_PEDIDO]
+        if invalidos:
+            return jsonify({"erro": f"Campos inválidos: {', '.join(invalidos)}"}), 400
+
+        # Token lido antes da listagem: alterações concorrentes aparecem no feed incremental
+        token = token_atual()
+        pedidos, proximo_cursor = buscar_pedidos(status, inicio, fim, cursor, limite, campos)
         return jsonify({
             "sucesso": True,
             "pedidos": pedidos,
             "total": len(pedidos),
-            "storage": "MongoDB" if pedidos_collection else "Memória"
+            "proximo_cursor": proximo_cursor,
+            "token": token,
+            "storage": "MongoDB" if pedidos_collection is not None else "Memória"
         }), 200
     except Exception as e:
         return jsonify({"erro": f"Erro interno: {str(e)}"}), 500
 
+# Exportação completa em streaming (?formato=ndjson|csv, desde, ate, status)
+@app.route("/api/pedidos/exportar", methods=["GET"])
+def api_exportar_pedidos():
+    formato = request.args.get("formato", "ndjson")
+    if formato not in ("ndjson", "csv"):
+        return jsonify({"erro": "formato deve ser ndjson ou csv"}), 400
+    try:
+        inicio, fim = intervalo_datas(request.args.get("desde"), request.args.get("ate"))
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    status = [s for s in request.args.get("status", "").split(",") if s] or None
+    arquivados = request.args.get("arquivo") == "1"
+
+    nome = "pedidos_arquivo" if arquivados else "pedidos"
+    if request.args.get("desde"):
+        nome += f"_{request.args['desde'][:10]}"
+    if request.args.get("ate"):
+        nome += f"_{request.args['ate'][:10]}"
+    return Response(
+        stream_with_context(gerar_exportacao(formato, status, inicio, fim, arquivados)),
+        mimetype="text/csv" if formato == "csv" else "application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{nome}.{formato}"',
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@app.route("/api/pedidos/novos", methods=["GET"])
+def api_pedidos_novos():
+    try:
+        try:
+            token = int(request.args.get("token", 0))
+            limite = min(max(int(request.args.get("limite", LIMITE_MAXIMO)), 1), LIMITE_MAXIMO)
+        except ValueError:
+            return jsonify({"erro": "Token inválido"}), 400
+
+        novos, movimentos, novo_token, mais, resync = buscar_alteracoes(token, limite)
+        return jsonify({
+            "sucesso": True,
+            "pedidos": novos,
+            "movimentos": movimentos,
+            "token": novo_token,
+            "mais": mais,
+            "resync": resync
+        }), 200
+    except Exception as e:
+        return jsonify({"erro": f"Erro interno: {str(e)}"}), 500
+
+def _resposta_sse(gerador):
+    return Response(
+        stream_with_context(gerador),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Stream do painel da cozinha: os eventos do hub acordam a conexão, que relê o feed
+# incremental a partir do token. A cada heartbeat o feed também é relido, o que
+# cobre pedidos gravados por outros workers do gunicorn.
+@app.route("/api/pedidos/eventos", methods=["GET"])
+def api_eventos_cozinha():
+    try:
+        token_inicial = request.headers.get("Last-Event-ID") or request.args.get("token")
+        token_inicial = int(token_inicial) if token_inicial else None
+    except ValueError:
+        return jsonify({"erro": "Token inválido"}), 400
+
+    assinatura = hub_eventos.assinar(TOPICO_COZINHA)
+    if assinatura is None:
+        return jsonify({"erro": "Limite de conexões atingido, tente novamente"}), 503
+
+    estado = {"token": token_inicial if token_inicial is not None else token_atual()}
+
+    def ler_alteracoes(_recebidos=None):
+        eventos = []
+        mais = True
+        while mais:
+            anterior = estado["token"]
+            novos, movimentos, novo_token, mais, resync = buscar_alteracoes(anterior)
+            estado["token"] = novo_token
+            # Token segurado por uma lacuna recente: tenta de novo no próximo despertar
+            mais = mais and novo_token != anterior
+            if resync:
+                return [formatar_evento("resync", {"token": novo_token}, novo_token)]
+            if novos or movimentos:
+                eventos.append(formatar_evento(
+                    "alteracoes",
+                    {"pedidos": novos, "movimentos": movimentos, "token": novo_token},
+                    novo_token
+                ))
+        return eventos
+
+    def ao_conectar():
+        if token_inicial is None:
+            return [formatar_evento("token", {"token": estado["token"]}, estado["token"])]
+        return ler_alteracoes()
+
+    return _resposta_sse(transmitir(
+        hub_eventos, assinatura, ler_alteracoes, ao_conectar,
+        heartbeat=SSE_HEARTBEAT_SEGUNDOS,
+        duracao_maxima=SSE_DURACAO_MAXIMA_SEGUNDOS,
+        so_despertar=True
+    ))
+
 @app.route("/api/pedidos/<order_id>/status", methods=["PUT"])
 def api_atualizar_status_pedido(order_id):
     try:
@@ -193,10 +1092,13 @@ def api_atualizar_status_pedido(order_id):
         
         if not pedido:
             return jsonify({"erro": "Pedido não encontrado"}), 404
+
+        hub_eventos.publicar(TOPICO_COZINHA, "status", {"id": order_id, "status": novo_status})
+        hub_eventos.publicar(f"pedido:{order_id}", "preparo", {"id": order_id, "status": novo_status})
         
         return jsonify({
             "sucesso": True,
-            "pedido": serialize_pedido(pedido) if pedidos_collection else pedido,
+            "pedido": serialize_pedido(pedido) if pedidos_collection is not None else pedido,
             "mensagem": f"Status atualizado para {novo_status}"
         }), 200
         
@@ -206,66 +1108,277 @@ def api_atualizar_status_pedido(order_id):
 @app.route("/api/pedidos/stats", methods=["GET"])
 def estatisticas_pedidos():
     try:
-        pedidos = listar_pedidos()
-        hoje = datetime.now().date().isoformat()
-        
-        # Filtros usando Python (funciona para MongoDB e memória)
-        pedidos_hoje = [p for p in pedidos if p.get("created_at", "").startswith(hoje)]
-        pendentes = [p for p in pedidos if p.get("status") == "pending"]
-        preparando = [p for p in pedidos if p.get("status") == "preparing"]
-        
-        receita_hoje = sum(p.get("total", 0) for p in pedidos_hoje)
-        
-        return jsonify({
-            "sucesso": True,
-            "stats": {
-                "pedidos_hoje": len(pedidos_hoje),
-                "pendentes": len(pendentes),
-                "preparando": len(preparando),
-                "receita_hoje": receita_hoje
-            }
-        }), 200
+        reconciliar = request.args.get("reconciliar") == "1"
+        stats, divergencias = calcular_estatisticas(reconciliar)
+        resposta = {"sucesso": True, "stats": stats}
+        if reconciliar:
+            resposta["divergencias"] = divergencias
+        return jsonify(resposta), 200
         
     except Exception as e:
         return jsonify({"erro": f"Erro interno: {str(e)}"}), 500
 
+@app.route("/api/vendas", methods=["GET"])
+def api_vendas():
+    try:
+        nivel = request.args.get("granularidade", "dia")
+        if nivel not in NIVEIS:
+            return jsonify({"erro": "granularidade deve ser hora ou dia"}), 400
+        try:
+            top = min(max(int(request.args.get("top", 10)), 1), 100)
+            # Sem intervalo: últimos 30 dias
+            desde = request.args.get("desde") or (datetime.now() - timedelta(days=30)).date().isoformat()
+            inicio, fim = intervalo_datas(desde, request.args.get("ate"))
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
+
+        vendas = consultar_vendas(inicio, fim, nivel, top)
+        return jsonify({"sucesso": True, "granularidade": nivel, "desde": inicio, "ate": fim, **vendas}), 200
+    except Exception as e:
+        return jsonify({"erro": f"Erro interno: {str(e)}"}), 500
+
+def montar_pedido_confirmado(order_data, payment_method, payment_status, confirmado_em=None):
+    agora = datetime.now().isoformat()
+    confirmado_em = confirmado_em or agora
+    # Campos podem vir como null no payload (webhook): "or {}" em vez de default do get
+    cliente = order_data.get("customer") or {}
+    return {
+        "id": order_data.get("reference_id") or f"DELMONTE_{int(datetime.now().timestamp())}",
+        "customer": {
+            "name": cliente.get("name", "Cliente"),
+            "email": cliente.get("email", ""),
+            "phone": cliente.get("phone", ""),
+            "tax_id": cliente.get("tax_id", "")
+        },
+        "delivery_address": order_data.get("delivery_address") or {},
+        "items": order_data.get("items") or [],
+        "subtotal": (order_data.get("total_amount", 0) - order_data.get("delivery_fee", 0)) / 100,
+        "delivery_fee": order_data.get("delivery_fee", 0) / 100,
+        "total": order_data.get("total_amount", 0) / 100,
+        "payment_method": payment_method,
+        "payment_status": payment_status,
+        "status": "pending",
+        "created_at": confirmado_em,
+        "paid_at": confirmado_em,
+        "updated_at": agora
+    }
+
+# Salva um lote de pedidos confirmados e avisa o painel da cozinha
+def processar_pedidos_confirmados(pedidos):
+    storage = "MongoDB" if pedidos_collection is not None else "memória"
+    salvos = [pedido["id"] for pedido in salvar_pedidos(pedidos)]
+    for order_id in salvos:
+        print(f"✅ Pedido salvo em {storage}: {order_id}")
+
+    if salvos:
+        hub_eventos.publicar(TOPICO_COZINHA, "pedido_novo", {"ids": salvos})
+    return True
+
 def processar_pedido_confirmado(order_data, payment_method, payment_status):
     try:
-        pedido = {
-            "id": order_data.get("reference_id", f"DELMONTE_{int(datetime.now().timestamp())}"),
-            "customer": {
-                "name": order_data.get("customer", {}).get("name", "Cliente"),
-                "email": order_data.get("customer", {}).get("email", ""),
-                "phone": order_data.get("customer", {}).get("phone", ""),
-                "tax_id": order_data.get("customer", {}).get("tax_id", "")
-            },
-            "delivery_address": order_data.get("delivery_address", {}),
-            "items": order_data.get("items", []),
-            "subtotal": (order_data.get("total_amount", 0) - order_data.get("delivery_fee", 0)) / 100,
-            "delivery_fee": order_data.get("delivery_fee", 0) / 100,
-            "total": order_data.get("total_amount", 0) / 100,
-            "payment_method": payment_method,
-            "payment_status": payment_status,
-            "status": "pending",
-            "created_at": datetime.now().isoformat(),
-            "paid_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
-        }
-        
-        sucesso = salvar_pedido(pedido)
-        storage = "MongoDB" if pedidos_collection else "memória"
-        
-        if sucesso:
-            print(f"✅ Pedido salvo em {storage}: {pedido['id']}")
-            return True
-        else:
-            print(f"❌ Erro ao salvar pedido em {storage}")
-            return False
-        
+        return processar_pedidos_confirmados([
+            montar_pedido_confirmado(order_data, payment_method, payment_status)
+        ])
     except Exception as e:
         print(f"❌ Erro ao processar pedido confirmado: {str(e)}")
         return False
 
+# Chave de idempotência do PagBank para esta tentativa de pagamento. O navegador manda
+# Idempotency-Key (nova a cada clique em pagar) para reenviar a mesma requisição sem
+# duplicar o pedido; sem ela, cada requisição é uma tentativa nova.
+def chave_idempotencia(reference_id):
+    chave = request.headers.get("Idempotency-Key", "").strip()
+    if not chave:
+        return None
+    return f"{reference_id}:{chave}"[:100]
+
+# Chave de deduplicação de um pagamento: o mesmo pedido/status só é processado uma vez,
+# venha da resposta do cartão ou de qualquer reenvio do webhook
+def chave_pagamento(dados, status):
+    referencia = dados.get("reference_id") or dados.get("id")
+    if not referencia and dados.get("charges"):
+        referencia = dados["charges"][0].get("id")
+    return f"{referencia}:{status}"
+
+# Monta o pedido a partir do payload do webhook (executado pelo worker do spool)
+def _pedido_do_webhook(registro):
+    dados = registro["dados"]
+    charge = (dados.get("charges") or [{}])[0] or {}
+    payment_method = (charge.get("payment_method") or {}).get("type", "UNKNOWN")
+    # PIX criado por aqui: itens, endereço e taxa já cotados pelo cardápio
+    registrado = reconciliador.obter(dados["id"]) if dados.get("id") else None
+    if registrado is not None:
+        order_data = registrado["dados"]
+    else:
+        # Sem registro (ex.: cartão): o total é o valor cobrado e a taxa é o que passa dos itens
+        itens = dados.get("items") or []
+        subtotal = sum((item.get("unit_amount") or 0) * (item.get("quantity") or 0) for item in itens)
+        total_amount = (charge.get("amount") or {}).get("value") or subtotal
+        order_data = {
+            "reference_id": dados.get("reference_id"),
+            "customer": dados.get("customer") or {},
+            "items": itens,
+            "total_amount": total_amount,
+            "delivery_fee": max(total_amount - subtotal, 0)
+        }
+    return montar_pedido_confirmado(order_data, payment_method, "PAID", registro.get("recebido_em"))
+
+def _processar_lote_webhooks(registros):
+    garantir_mongo(esperar=MONGO_ESPERA_INICIAL)
+    processar_pedidos_confirmados([_pedido_do_webhook(registro) for _, registro in registros])
+
+spool_webhooks = SpoolWebhooks(
+    os.getenv("WEBHOOK_SPOOL_PATH", "webhooks_spool.db"),
+    _processar_lote_webhooks,
+    tamanho_lote=int(os.getenv("WEBHOOK_SPOOL_LOTE", "50")),
+    janela_ms=int(os.getenv("WEBHOOK_SPOOL_JANELA_MS", "200")),
+    trabalhadores=int(os.getenv("WEBHOOK_SPOOL_TRABALHADORES", "1")),
+    max_tentativas=int(os.getenv("WEBHOOK_SPOOL_MAX_TENTATIVAS", "5"))
+)
+
+# Versões anteriores gravavam o corpo do pagamento com cartão inteiro no spool
+def _sem_dados_cartao(payload):
+    (payload.get("dados") or {}).pop("card_data", None)
+    return payload
+
+_expurgados = spool_webhooks.reescrever('"card_data"', _sem_dados_cartao)
+if _expurgados:
+    print(f"🔒 Dados de cartão removidos de {_expurgados} registros do spool de webhooks")
+
+# Reconciliação: consulta no PagBank os pedidos PIX ainda sem confirmação (webhook perdido)
+def _consultar_reconciliacao(order_id):
+    response = pagbank.consultar_pedido(order_id)
+    if response.status_code != 200:
+        raise Exception(f"PagBank respondeu {response.status_code}")
+    dados = response.json()
+    return resumir_status_pagbank(dados)["status"], dados
+
+# Grava os pagos em um único lote. O índice único descarta quem o webhook já tinha salvo;
+# a chave no spool faz o webhook que chegar depois ser ignorado.
+def _aplicar_pagamentos_reconciliados(pagos):
+    pedidos = []
+    for registro, dados in pagos:
+        charge = (dados.get("charges") or [{}])[0]
+        order_data = {**registro["dados"], "reference_id": registro["reference_id"] or dados.get("reference_id")}
+        pedidos.append(montar_pedido_confirmado(
+            order_data, charge.get("payment_method", {}).get("type", "PIX"), "PAID"
+        ))
+    processar_pedidos_confirmados(pedidos)
+
+    recebido_em = datetime.now().isoformat()
+    for registro, dados in pagos:
+        spool_webhooks.registrar(chave_pagamento(dados, "PAID"), {"dados": dados, "recebido_em": recebido_em}, processado=True)
+        evento = {"order_id": registro["order_id"], "reference_id": registro["reference_id"], "status": "PAID"}
+        for chave in {registro["order_id"], registro["reference_id"]} - {None}:
+            cache_status.invalidar(chave)
+            hub_eventos.publicar(f"pedido:{chave}", "status", evento)
+
+reconciliador = Reconciliador(
+    os.getenv("WEBHOOK_SPOOL_PATH", "webhooks_spool.db"),
+    _consultar_reconciliacao,
+    _aplicar_pagamentos_reconciliados,
+    # Abaixo de PAGBANK_MAX_SIMULTANEAS: a varredura não ocupa todas as vagas do worker
+    trabalhadores=int(os.getenv("RECONCILIACAO_TRABALHADORES", "4")),
+    por_segundo=float(os.getenv("RECONCILIACAO_POR_SEGUNDO", "50")),
+    intervalo=float(os.getenv("RECONCILIACAO_INTERVALO", "60")),
+    idade_minima=float(os.getenv("RECONCILIACAO_IDADE_MINIMA", "120")),
+    horas_expiracao=float(os.getenv("RECONCILIACAO_HORAS_EXPIRACAO", "6"))
+)
+
+# Prazos (PIX vencido) e manutenção periódica rodam no agendador de cada worker
+PIX_EXPIRACAO_MINUTOS = int(os.getenv("PIX_EXPIRACAO_MINUTOS", "30"))
+# Folga depois do vencimento para um pagamento de última hora chegar ao PagBank
+PIX_EXPIRACAO_TOLERANCIA = float(os.getenv("PIX_EXPIRACAO_TOLERANCIA_SEGUNDOS", "120"))
+PRAZOS_INTERVALO = float(os.getenv("PRAZOS_INTERVALO", "60"))
+agendador = Agendador()
+
+def agendar_expiracao_pix(order_id, reference_id, criado_em):
+    agendador.agendar(
+        criado_em + PIX_EXPIRACAO_MINUTOS * 60 + PIX_EXPIRACAO_TOLERANCIA,
+        lambda: expirar_pix(order_id, reference_id),
+        chave=f"pix:{order_id}"
+    )
+
+# Fim do prazo do QR Code: uma última consulta ao PagBank decide entre pago e expirado.
+# Todo worker que agendou o prazo avisa as próprias páginas abertas e limpa o próprio cache.
+def expirar_pix(order_id, reference_id):
+    if reconciliador.estado(order_id) == AGUARDANDO:
+        try:
+            status, dados = _consultar_reconciliacao(order_id)
+        except Exception as e:
+            # Continua aguardando: a reconciliação tenta de novo
+            print(f"⚠️ Não foi possível confirmar a expiração do PIX {order_id}: {e}")
+            return
+        if status == "PAID":
+            _aplicar_pagamentos_reconciliados([(reconciliador.obter(order_id), dados)])
+            reconciliador.concluir(order_id, PAGO)
+            return
+        if status in ("DECLINED", "CANCELED"):
+            reconciliador.concluir(order_id, FINALIZADO)
+            return
+        if reconciliador.concluir(order_id, EXPIRADO):
+            print(f"⌛ PIX {order_id} expirado sem pagamento")
+    if reconciliador.estado(order_id) != EXPIRADO:
+        return
+    evento = {"order_id": order_id, "reference_id": reference_id, "status": "EXPIRED"}
+    for chave in {order_id, reference_id} - {None}:
+        cache_status.invalidar(chave)
+        hub_eventos.publicar(f"pedido:{chave}", "status", evento)
+
+# Agenda os prazos que vencem até a próxima rodada, inclusive os criados em outros
+# workers ou antes de um restart (o heap fica só com o que está perto de vencer)
+def carregar_prazos_pix():
+    prazo = PIX_EXPIRACAO_MINUTOS * 60 + PIX_EXPIRACAO_TOLERANCIA
+    for order_id, reference_id, criado_em in reconciliador.aguardando_desde(time.time() + 2 * PRAZOS_INTERVALO - prazo):
+        agendar_expiracao_pix(order_id, reference_id, criado_em)
+
+# Move os entregues criados há mais de "dias" para a coleção fria, em lotes pelo índice
+# status_created_at: painel, feed e estatísticas leem só a coleção quente.
+# Sem MongoDB configurado, o armazém local arquiva (arquivo JSONL na memória, tabela no SQLite);
+# na memória sem MEMORIA_ARQUIVO_DESCARTE não há onde guardar e os entregues ficam.
+# Com MongoDB fora do ar a memória só guarda o que ainda vai ser drenado.
+def arquivar_pedidos(dias=ARQUIVO_DIAS, tamanho_lote=500):
+    antes_de = (datetime.now() - timedelta(days=dias)).isoformat()
+    arquivados = 0
+    if pedidos_collection is not None:
+        colecao = pedidos_collection
+        while True:
+            lote = list(
+                colecao.find({"status": "delivered", "created_at": {"$lt": antes_de}})
+                .sort("created_at", 1).limit(tamanho_lote)
+            )
+            if not lote:
+                break
+            try:
+                db[COLECAO_ARQUIVO].insert_many(lote, ordered=False)
+            except BulkWriteError as e:
+                # Já arquivado por outro worker ou numa rodada interrompida: pode remover
+                if any(erro.get("code") != 11000 for erro in e.details.get("writeErrors", [])):
+                    raise
+            colecao.delete_many({"_id": {"$in": [pedido["_id"] for pedido in lote]}, "status": "delivered"})
+            arquivados += len(lote)
+            if len(lote) < tamanho_lote:
+                break
+    elif conexao_mongo is None and (ARMAZEM_PEDIDOS == "sqlite" or armazem_local.arquivo_descarte):
+        while True:
+            movidos = armazem_local.arquivar("delivered", antes_de, tamanho_lote)
+            arquivados += movidos
+            if movidos < tamanho_lote:
+                break
+    if arquivados:
+        print(f"🗄️ {arquivados} pedidos entregues arquivados")
+    return arquivados
+
+# Estado que só cresceria: entradas vencidas dos caches e pagamentos já concluídos
+def limpar_estado_antigo():
+    removidos = cache_status.limpar_expirados() + cache_estatisticas.limpar_expirados()
+    removidos += reconciliador.limpar(float(os.getenv("RECONCILIACAO_DIAS_RETENCAO", "7")))
+    return removidos
+
+agendador.repetir(PRAZOS_INTERVALO, carregar_prazos_pix, "carregar_prazos_pix")
+agendador.repetir(float(os.getenv("ARQUIVO_INTERVALO", "3600")), arquivar_pedidos, "arquivar_pedidos")
+agendador.repetir(float(os.getenv("LIMPEZA_INTERVALO", "300")), limpar_estado_antigo, "limpar_estado_antigo")
+
 @app.route("/criar-pedido", methods=["POST"])
 def criar_pedido_pix():
     try:
@@ -274,12 +1387,10 @@ def criar_pedido_pix():
         if not dados or not dados.get("items"):
             return jsonify({"erro": "Dados do pedido inválidos"}), 400
 
-        total_amount = dados.get("total_amount", 0)
-        if total_amount == 0:
-            for item in dados.get("items", []):
-                total_amount += item.get("unit_amount", 0) * item.get("quantity", 1)
+        dados = cotar_pedido(dados)
+        total_amount = dados["total_amount"]
 
-        expiration_date = (datetime.now() + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%M:%S-03:00")
+        expiration_date = (datetime.now() + timedelta(minutes=PIX_EXPIRACAO_MINUTOS)).strftime("%Y-%m-%dT%H:%M:%S-03:00")
 
         pedido = {
             "reference_id": dados.get("reference_id", f"DELMONTE_{int(datetime.now().timestamp())}"),
@@ -302,17 +1413,22 @@ def criar_pedido_pix():
             "notification_urls": [WEBHOOK_URL]
         }
 
-        headers = {
-            "Authorization": f"Bearer {PAGBANK_TOKEN}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-
-        response = requests.post(URL_API, json=pedido, headers=headers)
+        response = pagbank.criar_pedido(pedido, chave_idempotencia(pedido["reference_id"]))
 
         if response.status_code in [200, 201]:
             response_data = response.json()
 
+            # Fica aguardando o webhook; a reconciliação consulta o PagBank se ele não vier
+            # e o agendador encerra o pedido quando o QR Code vence
+            try:
+                reconciliador.registrar(
+                    response_data.get("id"), pedido["reference_id"],
+                    dados_pedido_pendente(dados, pedido["reference_id"])
+                )
+                agendar_expiracao_pix(response_data.get("id"), pedido["reference_id"], time.time())
+            except Exception as e:
+                print(f"⚠️ Erro ao registrar pedido para reconciliação: {e}")
+
             qr_code_info = {}
             if "qr_codes" in response_data and len(response_data["qr_codes"]) > 0:
                 qr_code = response_data["qr_codes"][0]
@@ -327,6 +1443,8 @@ def criar_pedido_pix():
                 "order_id": response_data.get("id"),
                 "reference_id": response_data.get("reference_id"),
                 "qr_code": qr_code_info,
+                "total_amount": total_amount,
+                "delivery_fee": dados["delivery_fee"],
                 "status": "WAITING",
                 "mensagem": "Pedido criado com sucesso! Aguardando pagamento."
             }), 201
@@ -337,6 +1455,12 @@ def criar_pedido_pix():
                 "status_code": response.status_code
             }), response.status_code
 
+    except CardapioIndisponivel as e:
+        return jsonify({"erro": str(e)}), 503
+    except ErroCardapio as e:
+        return jsonify({"erro": str(e)}), 400
+    except PagBankIndisponivel as e:
+        return resposta_pagbank_indisponivel(e)
     except Exception as e:
         return jsonify({"erro": f"Erro interno: {str(e)}"}), 500
 
@@ -351,10 +1475,8 @@ def criar_pedido_cartao():
                    card_data.get("security_code")]):
             return jsonify({"erro": "Dados do cartão incompletos"}), 400
 
-        total_amount = dados.get("total_amount", 0)
-        if total_amount == 0:
-            for item in dados.get("items", []):
-                total_amount += item.get("unit_amount", 0) * item.get("quantity", 1)
+        dados = cotar_pedido(dados)
+        total_amount = dados["total_amount"]
 
         payment_type = dados.get("payment_type", "credit")
         installments = dados.get("installments", 1)
@@ -402,13 +1524,7 @@ def criar_pedido_cartao():
             "notification_urls": [WEBHOOK_URL]
         }
 
-        headers = {
-            "Authorization": f"Bearer {PAGBANK_TOKEN}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-
-        response = requests.post(URL_API, json=pedido, headers=headers)
+        response = pagbank.criar_pedido(pedido, chave_idempotencia(pedido["reference_id"]))
 
         if response.status_code in [200, 201]:
             response_data = response.json()
@@ -418,7 +1534,12 @@ def criar_pedido_cartao():
                 charge_status = response_data["charges"][0].get("status", "UNKNOWN")
 
             if charge_status == "PAID":
-                processar_pedido_confirmado(dados, payment_type.upper(), "PAID")
+                # Marca o pagamento no spool: o webhook do mesmo pedido que chegar depois é ignorado
+                # (e, se ele chegou antes, é ele quem grava o pedido)
+                order_data = dados_pedido_pendente(dados, pedido["reference_id"])
+                registro = {"dados": order_data, "recebido_em": datetime.now().isoformat()}
+                if spool_webhooks.registrar(chave_pagamento(order_data, "PAID"), registro, processado=True):
+                    processar_pedido_confirmado(order_data, payment_type.upper(), "PAID")
                 
                 return jsonify({
                     "sucesso": True,
@@ -443,95 +1564,214 @@ def criar_pedido_cartao():
                 "status_code": response.status_code
             }), response.status_code
 
+    except CardapioIndisponivel as e:
+        return jsonify({"erro": str(e)}), 503
+    except ErroCardapio as e:
+        return jsonify({"erro": str(e)}), 400
+    except PagBankIndisponivel as e:
+        return resposta_pagbank_indisponivel(e)
     except Exception as e:
         return jsonify({"erro": f"Erro interno: {str(e)}"}), 500
 
-@app.route("/status-pedido/<order_id>", methods=["GET"])
-def consultar_status(order_id):
-    try:
-        headers = {
-            "Authorization": f"Bearer {PAGBANK_TOKEN}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+# Resume a resposta do PagBank no formato de /status-pedido
+def resumir_status_pagbank(data):
+    status = "UNKNOWN"
+    payment_method = "UNKNOWN"
 
-        response = requests.get(f"{URL_API}/{order_id}", headers=headers)
+    if data.get("charges"):
+        charge = data["charges"][0]
+        status = charge.get("status", "UNKNOWN")
+        payment_method = charge.get("payment_method", {}).get("type", "CARD")
+    elif data.get("qr_codes"):
+        if data.get("charges") and len(data["charges"]) > 0:
+            status = data["charges"][0].get("status", "WAITING")
+        else:
+            status = "WAITING"
+        payment_method = "PIX"
 
-        if response.status_code == 200:
-            data = response.json()
+    return {
+        "order_id": data.get("id"),
+        "reference_id": data.get("reference_id"),
+        "status": status,
+        "payment_method": payment_method,
+        "created_at": data.get("created_at"),
+        "customer": data.get("customer", {}).get("name"),
+        "total": sum(item.get("unit_amount", 0) * item.get("quantity", 0) for item in data.get("items", []))
+    }
 
-            status = "UNKNOWN"
-            payment_method = "UNKNOWN"
+# Consulta o PagBank e devolve (corpo, status_code) já no formato da rota
+def _consultar_status_pagbank(order_id):
+    response = pagbank.consultar_pedido(order_id)
 
-            if data.get("charges"):
-                charge = data["charges"][0]
-                status = charge.get("status", "UNKNOWN")
-                payment_method = charge.get("payment_method", {}).get("type", "CARD")
-            elif data.get("qr_codes"):
-                if data.get("charges") and len(data["charges"]) > 0:
-                    status = data["charges"][0].get("status", "WAITING")
-                else:
-                    status = "WAITING"
-                payment_method = "PIX"
+    if response.status_code == 200:
+        resumo = resumir_status_pagbank(response.json())
+        # O PagBank segue respondendo WAITING depois que o QR Code vence
+        if resumo["status"] == "WAITING" and reconciliador.estado(order_id) == EXPIRADO:
+            resumo["status"] = "EXPIRED"
+        return resumo, 200
+    return {
+        "erro": "Pedido não encontrado",
+        "detalhes": response.json() if response.text else "Sem detalhes"
+    }, response.status_code
 
-            return jsonify({
-                "order_id": data.get("id"),
-                "reference_id": data.get("reference_id"),
-                "status": status,
-                "payment_method": payment_method,
-                "created_at": data.get("created_at"),
-                "customer": data.get("customer", {}).get("name"),
-                "total": sum(item.get("unit_amount", 0) * item.get("quantity", 0) for item in data.get("items", []))
-            }), 200
-        else:
-            return jsonify({
-                "erro": "Pedido não encontrado",
-                "detalhes": response.json() if response.text else "Sem detalhes"
-            }), response.status_code
+# Status final muda pouco: fica mais tempo no cache. Erros do PagBank não são guardados.
+def _ttl_status(resultado):
+    corpo, codigo = resultado
+    if codigo >= 500 or codigo == 429:
+        return 0
+    if corpo.get("status") in STATUS_PAGAMENTO_FINAIS:
+        return CACHE_STATUS_TTL_FINAL
+    return CACHE_STATUS_TTL
+
+@app.route("/status-pedido/<order_id>", methods=["GET"])
+def consultar_status(order_id):
+    try:
+        # Polls simultâneos do mesmo pedido dividem uma única chamada ao PagBank
+        corpo, codigo = cache_status.obter_ou_carregar(
+            order_id, lambda: _consultar_status_pagbank(order_id), _ttl_status
+        )
+        return jsonify(corpo), codigo
 
+    except PagBankIndisponivel as e:
+        return resposta_pagbank_indisponivel(e)
     except Exception as e:
         return jsonify({"erro": f"Erro interno: {str(e)}"}), 500
 
+# Stream de um pedido para a página de pagamento (substitui o polling de /status-pedido)
+@app.route("/status-pedido/<order_id>/eventos", methods=["GET"])
+def eventos_status_pedido(order_id):
+    assinatura = hub_eventos.assinar(f"pedido:{order_id}")
+    if assinatura is None:
+        return jsonify({"erro": "Limite de conexões atingido, tente novamente"}), 503
+
+    def repassar(recebidos):
+        return [formatar_evento(tipo, dados) for tipo, dados in recebidos]
+
+    return _resposta_sse(transmitir(
+        hub_eventos, assinatura, repassar,
+        heartbeat=SSE_HEARTBEAT_SEGUNDOS,
+        duracao_maxima=SSE_DURACAO_MAXIMA_SEGUNDOS
+    ))
+
 @app.route("/webhook-pagbank", methods=["POST"])
 def webhook_pagbank():
     try:
         dados = request.json
 
         if dados and dados.get("charges"):
-            charge = dados["charges"][0]
+            charge = dados["charges"][0] or {}
             status = charge.get("status")
             reference_id = dados.get("reference_id")
-            payment_method = charge.get("payment_method", {}).get("type", "UNKNOWN")
+
+            # Descarta o status em cache e avisa as páginas de pagamento abertas
+            # (pelo id do PagBank e pelo reference_id)
+            evento = {"order_id": dados.get("id"), "reference_id": reference_id, "status": status}
+            for chave in {dados.get("id"), reference_id} - {None}:
+                cache_status.invalidar(chave)
+                hub_eventos.publicar(f"pedido:{chave}", "status", evento)
 
             if status == "PAID":
-                order_data = {
-                    "reference_id": reference_id,
-                    "customer": dados.get("customer", {}),
-                    "items": dados.get("items", []),
-                    "total_amount": sum(item.get("unit_amount", 0) * item.get("quantity", 0) 
-                                      for item in dados.get("items", [])),
-                    "delivery_fee": 500
-                }
-                
-                processar_pedido_confirmado(order_data, payment_method, "PAID")
+                reconciliador.concluir(dados.get("id"), PAGO)
+            elif status in ("DECLINED", "CANCELED"):
+                reconciliador.concluir(dados.get("id"), FINALIZADO)
+
+            # Só grava no spool e responde; o pedido é salvo em segundo plano.
+            # Reenvios do mesmo pagamento caem na mesma chave e são descartados.
+            if status == "PAID":
+                spool_webhooks.registrar(
+                    chave_pagamento(dados, status),
+                    {"dados": dados, "recebido_em": datetime.now().isoformat()}
+                )
 
-        return jsonify({"status": "webhook processado"}), 200
+        return jsonify({"status": "webhook recebido"}), 200
     except Exception as e:
         return jsonify({"erro": str(e)}), 500
 
+@app.route("/api/pagbank/metricas", methods=["GET"])
+def metricas_pagbank():
+    metricas = pagbank.resumo_metricas()
+    metricas["cache_status"] = cache_status.resumo()
+    return jsonify(metricas)
+
+# Liveness: o processo responde (não depende do MongoDB nem do PagBank)
+@app.route("/saude/vivo", methods=["GET"])
+def saude_vivo():
+    return jsonify({"status": "vivo", "pid": os.getpid()}), 200
+
+# Readiness: com MONGODB_URI configurada, só fica pronto com o MongoDB conectado neste worker
+@app.route("/saude/pronto", methods=["GET"])
+def saude_pronto():
+    if conexao_mongo is None:
+        mongo = {"conectado": False, "configurado": False}
+        pronto = True
+    else:
+        mongo = {**conexao_mongo.resumo(), "configurado": True}
+        pronto = conexao_mongo.conectado
+    corpo = {
+        "status": "pronto" if pronto else "indisponivel",
+        "pid": os.getpid(),
+        "mongodb": mongo,
+        "armazem_local": ARMAZEM_PEDIDOS,
+        "pedidos_na_memoria": len(armazem_local),
+        "webhooks_pendentes": spool_webhooks.pendentes(),
+        "webhooks_falhados": spool_webhooks.falhados(),
+        "tarefas_agendadas": agendador.pendentes(),
+        "pagbank_circuit_breaker": pagbank.breaker.estado
+    }
+    return jsonify(corpo), 200 if pronto else 503
+
+@app.route("/metrics", methods=["GET"])
+def metricas_prometheus():
+    return Response(registro_metricas.exportar(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route("/config", methods=["GET"])
 def get_config():
     return jsonify({
         "ambiente": PAGBANK_ENV,
         "moeda": "BRL",
-        "pix_expiracao_minutos": 30,
+        "pix_expiracao_minutos": PIX_EXPIRACAO_MINUTOS,
         "aceita_cartao": True,
         "aceita_pix": True,
         "max_parcelas": 6,
-        "mongodb_status": "Conectado" if pedidos_collection else "Desconectado",
-        "storage_type": "MongoDB" if pedidos_collection else "Memória RAM"
+        "mongodb_status": "Conectado" if pedidos_collection is not None else "Desconectado",
+        "storage_type": "MongoDB" if pedidos_collection is not None else "Memória RAM"
     })
 
+# flask --app app reconciliar-pagamentos [--limite N]
+@app.cli.command("reconciliar-pagamentos")
+@click.option("--limite", type=int, help="Máximo de pedidos consultados nesta execução")
+def comando_reconciliar_pagamentos(limite):
+    garantir_mongo(esperar=10)
+    # Pedidos pagos salvos na memória deste processo sumiriam com ele, e o pagamento ficaria
+    # marcado como tratado: o webhook de verdade seria descartado como repetido
+    if pedidos_collection is None and not armazem_local.compartilhado:
+        raise click.ClickException("MongoDB não conectado: sem ele (ou ARMAZEM_PEDIDOS=sqlite) os pedidos pagos não chegariam à cozinha")
+    print(f"🔎 {reconciliador.aguardando()} pedidos aguardando pagamento")
+    print(f"✅ Reconciliação: {reconciliador.varrer(limite)}")
+
+# flask --app app arquivar-pedidos [--dias N]
+@app.cli.command("arquivar-pedidos")
+@click.option("--dias", type=int, default=ARQUIVO_DIAS, show_default=True, help="Arquiva entregues criados há mais de N dias")
+def comando_arquivar_pedidos(dias):
+    garantir_mongo(esperar=10)
+    print(f"✅ {arquivar_pedidos(dias)} pedidos arquivados")
+
+# flask --app app reconstruir-vendas --desde AAAA-MM-DD --ate AAAA-MM-DD
+@app.cli.command("reconstruir-vendas")
+@click.option("--desde", help="Primeiro dia (AAAA-MM-DD); padrão: desde o primeiro pedido")
+@click.option("--ate", help="Último dia, inclusive (AAAA-MM-DD); padrão: até hoje")
+def comando_reconstruir_vendas(desde, ate):
+    garantir_mongo(esperar=10)
+    if pedidos_collection is None:
+        raise click.ClickException("MongoDB não conectado: no modo memória os rollups vivem no próprio processo")
+    try:
+        # Dias inteiros, para que os baldes apagados e recalculados coincidam
+        inicio, fim = intervalo_datas(desde[:10] if desde else None, ate[:10] if ate else None)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    lidos = reconstruir_vendas_mongo(inicio, fim)
+    print(f"✅ Rollups de vendas recalculados a partir de {lidos} pedidos")
+
 if __name__ == "__main__":
     if PAGBANK_TOKEN == "SEU_TOKEN_SANDBOX_AQUI":
         print("⚠️  ATENÇÃO: Configure seu token do PagBank no arquivo .env!")
@@ -539,7 +1779,8 @@ if __name__ == "__main__":
         print(f"✅ Token PagBank configurado!")
         print(f"📍 Ambiente: {PAGBANK_ENV}")
     
-    storage_info = "MongoDB Atlas" if pedidos_collection else "Memória RAM (temporário)"
+    garantir_mongo(esperar=MONGO_ESPERA_INICIAL)
+    storage_info = "MongoDB Atlas" if pedidos_collection is not None else "Memória RAM (temporário)"
     print(f"💾 Armazenamento: {storage_info}")
     print("🍕 API DEL MONTE rodando em http://localhost:5000")
     app.run(port=5000, debug=True)
\ No newline at end of file
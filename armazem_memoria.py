@@ -0,0 +1,269 @@
+# Armazenamento de pedidos em memória (modo sem MongoDB ou com MongoDB falhando).
+# Índices: dicionário por id, listas ordenadas por (created_at, id) globais e por
+# status, e log de alterações por seq para o feed incremental. Tudo sob uma trava;
+# quem chama recebe cópias, nunca os dicionários internos.
+import heapq
+import json
+import threading
+from bisect import bisect_left, insort
+
+class RegistroPedido:
+    __slots__ = ("id", "status", "chave", "dados")
+
+    def __init__(self, dados):
+        self.id = dados["id"]
+        self.status = dados.get("status")
+        self.chave = (dados.get("created_at", ""), self.id)
+        self.dados = dados
+
+def _remover_chave(lista, chave):
+    i = bisect_left(lista, chave)
+    if i < len(lista) and lista[i] == chave:
+        del lista[i]
+
+def _decrescente(lista, baixo, alto):
+    for i in range(alto - 1, baixo - 1, -1):
+        yield lista[i]
+
+class ArmazemMemoria:
+    compartilhado = False
+
+    def __init__(self, capacidade=50000, arquivo_descarte=None, max_log=10000,
+                 status_descartaveis=("delivered",)):
+        self.capacidade = capacidade
+        self.arquivo_descarte = arquivo_descarte
+        self.max_log = max_log
+        self.status_descartaveis = status_descartaveis
+        self.ultima_sequencia = 0
+        self.descartados = 0
+        self.acima_da_capacidade = False
+        self._trava = threading.RLock()
+        self._por_id = {}
+        self._cronologico = []
+        self._por_status = {}
+        self._log = []
+        # Contadores incrementais por dia de created_at: "AAAA-MM-DD" -> [pedidos, receita]
+        self._por_dia = {}
+
+    def __len__(self):
+        return len(self._por_id)
+
+    def __contains__(self, order_id):
+        return order_id in self._por_id
+
+    # Seq atribuída e registrada no log sob a mesma trava: o feed nunca vê lacunas
+    def _registrar_alteracao(self, registro, novo=False):
+        self.ultima_sequencia += 1
+        registro.dados["seq"] = self.ultima_sequencia
+        if novo:
+            registro.dados["seq_criacao"] = self.ultima_sequencia
+        self._log.append((self.ultima_sequencia, registro))
+        # Descarta a metade mais antiga de uma vez para não pagar o deslocamento a cada inserção
+        if len(self._log) > 2 * self.max_log:
+            del self._log[:self.max_log]
+
+    def _contabilizar(self, dados, sinal):
+        dia = dados.get("created_at", "")[:10]
+        totais = self._por_dia.setdefault(dia, [0, 0])
+        totais[0] += sinal
+        totais[1] += sinal * (dados.get("total") or 0)
+        if totais[0] == 0:
+            del self._por_dia[dia]
+
+    # Retorna False se já existe pedido com o mesmo id
+    def adicionar(self, pedido):
+        with self._trava:
+            if pedido["id"] in self._por_id:
+                return False
+            registro = RegistroPedido(dict(pedido))
+            self._por_id[registro.id] = registro
+            insort(self._cronologico, registro.chave)
+            insort(self._por_status.setdefault(registro.status, []), registro.chave)
+            self._contabilizar(registro.dados, 1)
+            self._registrar_alteracao(registro, novo=True)
+            pedido["seq"] = pedido["seq_criacao"] = registro.dados["seq"]
+            if len(self._por_id) > self.capacidade:
+                self._descartar()
+            return True
+
+    # Retorna os pedidos novos do lote
+    def adicionar_lote(self, pedidos):
+        return [pedido for pedido in pedidos if self.adicionar(pedido)]
+
+    def obter(self, order_id):
+        with self._trava:
+            registro = self._por_id.get(order_id)
+            return dict(registro.dados) if registro else None
+
+    def atualizar_status(self, order_id, novo_status, updated_at):
+        with self._trava:
+            registro = self._por_id.get(order_id)
+            if registro is None:
+                return None
+            _remover_chave(self._por_status.get(registro.status, []), registro.chave)
+            insort(self._por_status.setdefault(novo_status, []), registro.chave)
+            registro.dados["status_anterior"] = registro.status
+            registro.dados["status"] = novo_status
+            registro.dados["updated_at"] = updated_at
+            registro.status = novo_status
+            self._registrar_alteracao(registro)
+            return dict(registro.dados)
+
+    def listar(self):
+        with self._trava:
+            return [dict(self._por_id[chave[1]].dados) for chave in reversed(self._cronologico)]
+
+    def contagem_por_status(self):
+        with self._trava:
+            return {status: len(chaves) for status, chaves in self._por_status.items() if chaves}
+
+    # (pedidos, receita) criados no dia "AAAA-MM-DD", sem percorrer os pedidos
+    def resumo_dia(self, dia):
+        with self._trava:
+            pedidos, receita = self._por_dia.get(dia, (0, 0))
+            return pedidos, round(receita, 2)
+
+    # Recalcula os contadores a partir dos registros, corrige e devolve as divergências
+    def reconciliar(self):
+        with self._trava:
+            por_dia = {}
+            por_status = {}
+            for registro in self._por_id.values():
+                totais = por_dia.setdefault(registro.dados.get("created_at", "")[:10], [0, 0])
+                totais[0] += 1
+                totais[1] += registro.dados.get("total") or 0
+                por_status[registro.status] = por_status.get(registro.status, 0) + 1
+
+            divergencias = {}
+            for dia in set(por_dia) | set(self._por_dia):
+                esperado = por_dia.get(dia, [0, 0])
+                atual = self._por_dia.get(dia, [0, 0])
+                if esperado[0] != atual[0] or abs(esperado[1] - atual[1]) > 0.005:
+                    divergencias[dia] = {"esperado": esperado, "contador": atual}
+            for status in set(por_status) | set(self._por_status):
+                atual = len(self._por_status.get(status, []))
+                if por_status.get(status, 0) != atual:
+                    divergencias[f"status:{status}"] = {"esperado": por_status.get(status, 0), "contador": atual}
+
+            self._por_dia = por_dia
+            return divergencias
+
+    # Remove pedidos já transferidos (ex.: para o MongoDB). Pares (id, seq): o pedido só
+    # sai se não mudou desde a leitura. Retorna quantos foram removidos.
+    def remover(self, pares):
+        with self._trava:
+            ids = set()
+            for order_id, seq in pares:
+                registro = self._por_id.get(order_id)
+                if registro is not None and registro.dados.get("seq") == seq:
+                    ids.add(order_id)
+            if ids:
+                self._remover_ids(ids)
+            return len(ids)
+
+    # Página mais recente primeiro, abaixo do cursor (created_at, id), com created_at em [inicio, fim).
+    # Retorna (pedidos, tem_mais).
+    def buscar(self, status=None, inicio=None, fim=None, cursor=None, limite=50):
+        with self._trava:
+            listas = [self._por_status.get(s, []) for s in status] if status else [self._cronologico]
+            fatias = []
+            for lista in listas:
+                alto = len(lista)
+                if cursor:
+                    alto = min(alto, bisect_left(lista, tuple(cursor)))
+                if fim:
+                    alto = min(alto, bisect_left(lista, (fim,)))
+                baixo = bisect_left(lista, (inicio,)) if inicio else 0
+                fatias.append(_decrescente(lista, baixo, alto))
+
+            chaves = []
+            for chave in heapq.merge(*fatias, reverse=True):
+                chaves.append(chave)
+                if len(chaves) > limite:
+                    break
+            pedidos = [dict(self._por_id[chave[1]].dados) for chave in chaves[:limite]]
+            return pedidos, len(chaves) > limite
+
+    # Pedidos alterados depois do token, em ordem de seq.
+    # Retorna (alterados, novo_token, mais, resync)
+    def alteracoes_desde(self, token, limite):
+        with self._trava:
+            # Token de antes de um restart ou mais antigo que o log: o cliente precisa recarregar tudo
+            primeira = self._log[0][0] if self._log else self.ultima_sequencia + 1
+            if token > self.ultima_sequencia or token < primeira - 1:
+                return [], self.ultima_sequencia, False, True
+
+            inicio = bisect_left(self._log, token + 1, key=lambda entrada: entrada[0])
+            alterados = []
+            mais = False
+            for seq, registro in self._log[inicio:]:
+                # Entradas antigas de um pedido que mudou de novo depois (ou foi descartado)
+                if registro.dados.get("seq") != seq or self._por_id.get(registro.id) is not registro:
+                    continue
+                if len(alterados) == limite:
+                    mais = True
+                    break
+                alterados.append(dict(registro.dados))
+            novo_token = alterados[-1]["seq"] if mais else self.ultima_sequencia
+            return alterados, novo_token, mais, False
+
+    # Acima da capacidade, libera 10% de uma vez, os mais antigos primeiro, só entre os
+    # status descartáveis (entregues). Os demais (pagamento em andamento, pedido na
+    # cozinha, pedido ainda por drenar para o MongoDB) só saem se a cópia for gravada no
+    # arquivo de descarte; sem ele a memória passa da capacidade em vez de perder pedidos.
+    def _descartar(self):
+        quantidade = len(self._por_id) - int(self.capacidade * 0.9)
+        vitimas = []
+        for status in self.status_descartaveis:
+            vitimas.extend(self._por_status.get(status, [])[:quantidade - len(vitimas)])
+        descartaveis = {chave[1] for chave in vitimas}
+        outros = set()
+        if len(vitimas) < quantidade and self.arquivo_descarte:
+            for chave in self._cronologico:
+                if len(descartaveis) + len(outros) == quantidade:
+                    break
+                if chave[1] not in descartaveis:
+                    outros.add(chave[1])
+
+        if not self._gravar_arquivo(descartaveis | outros):
+            outros = set()
+        ids = descartaveis | outros
+        if len(ids) < quantidade and not self.acima_da_capacidade:
+            print(f"⚠️ Memória acima da capacidade ({len(self._por_id)} pedidos): pedidos não entregues só são descartados com MEMORIA_ARQUIVO_DESCARTE")
+        self.acima_da_capacidade = len(ids) < quantidade
+        if ids:
+            self._remover_ids(ids)
+            self.descartados += len(ids)
+
+    # Move para o arquivo até "limite" pedidos do status criados antes de "antes_de", os
+    # mais antigos primeiro. Sem arquivo (ou se a gravação falha) nada sai da memória:
+    # arquivar não pode virar apagar. Retorna quantos saíram.
+    def arquivar(self, status, antes_de, limite=500):
+        with self._trava:
+            chaves = self._por_status.get(status, [])
+            ids = {chave[1] for chave in chaves[:min(limite, bisect_left(chaves, (antes_de,)))]}
+            if not self._gravar_arquivo(ids):
+                return 0
+            self._remover_ids(ids)
+            return len(ids)
+
+    # Retorna se os pedidos estão no arquivo
+    def _gravar_arquivo(self, ids):
+        if not self.arquivo_descarte or not ids:
+            return False
+        try:
+            with open(self.arquivo_descarte, "a", encoding="utf-8") as arquivo:
+                for order_id in ids:
+                    arquivo.write(json.dumps(self._por_id[order_id].dados, ensure_ascii=False, default=str) + "\n")
+            return True
+        except OSError as e:
+            print(f"⚠️ Erro ao gravar pedidos descartados da memória: {e}")
+            return False
+
+    def _remover_ids(self, ids):
+        for order_id in ids:
+            self._contabilizar(self._por_id[order_id].dados, -1)
+            del self._por_id[order_id]
+        self._cronologico = [chave for chave in self._cronologico if chave[1] not in ids]
+        for status, chaves in self._por_status.items():
+            self._por_status[status] = [chave for chave in chaves if chave[1] not in ids]
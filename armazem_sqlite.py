@@ -0,0 +1,265 @@
+# Armazenamento local de pedidos em SQLite (modo WAL), compartilhado entre os workers
+# do gunicorn: o pedido gravado pelo webhook em um worker aparece no /api/pedidos
+# servido por outro. Mesma interface do ArmazemMemoria (adicionar, obter, buscar,
+# alteracoes_desde...), escolhida por ARMAZEM_PEDIDOS=sqlite no app.
+# Os campos que mudam (status, seq...) ficam em colunas; o resto do pedido em JSON.
+# Os rollups de vendas (por hora e por dia) ficam na tabela "vendas", somados na mesma
+# transação que grava os pedidos: /api/vendas lê só os baldes, como no MongoDB.
+import json
+from datetime import date, timedelta
+
+from banco_sqlite import BancoSQLite
+from vendas import aplicar, contribuicao, faixa, periodos, relatorio
+
+# Consultas fixas: o sqlite3 guarda os comandos já preparados no cache da conexão
+SQL_INSERIR = """INSERT OR IGNORE INTO pedidos
+    (id, created_at, status, status_anterior, updated_at, total, seq, seq_criacao, dados)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+SQL_COLUNAS = "SELECT dados, status, status_anterior, updated_at, seq, seq_criacao FROM pedidos"
+SQL_SEQUENCIA = "UPDATE contadores SET valor = valor + ? WHERE nome = 'pedidos' RETURNING valor"
+# Um caminho pontilhado de contribuicao() por linha: o $inc do MongoDB em SQL
+SQL_VENDAS = """INSERT INTO vendas (nivel, periodo, caminho, valor) VALUES (?, ?, ?, ?)
+    ON CONFLICT (nivel, periodo, caminho) DO UPDATE SET valor = valor + excluded.valor"""
+
+CAMPOS_COLUNAS = ("status", "status_anterior", "updated_at", "seq", "seq_criacao")
+
+def _pedido(linha):
+    pedido = json.loads(linha[0])
+    for campo, valor in zip(CAMPOS_COLUNAS, linha[1:]):
+        if valor is not None:
+            pedido[campo] = valor
+    return pedido
+
+# Soma os pedidos nos baldes de hora e dia, agregando o lote antes (um comando por caminho)
+def _somar_vendas(conexao, pedidos):
+    somas = {}
+    for pedido in pedidos:
+        incrementos = contribuicao(pedido)
+        for nivel, periodo in periodos(pedido).items():
+            for caminho, valor in incrementos.items():
+                chave = (nivel, periodo, caminho)
+                somas[chave] = somas.get(chave, 0) + valor
+    conexao.executemany(SQL_VENDAS, [(*chave, valor) for chave, valor in somas.items()])
+
+class ArmazemSQLite:
+    compartilhado = True
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.descartados = 0
+        self._banco = BancoSQLite(caminho, cached_statements=256)
+        self._criar_tabelas()
+
+    def _criar_tabelas(self):
+        with self._banco.conexao() as conexao:
+            conexao.execute("""
+                CREATE TABLE IF NOT EXISTS pedidos (
+                    id TEXT PRIMARY KEY,
+                    created_at TEXT NOT NULL,
+                    status TEXT,
+                    status_anterior TEXT,
+                    updated_at TEXT,
+                    total REAL,
+                    seq INTEGER NOT NULL,
+                    seq_criacao INTEGER NOT NULL,
+                    dados TEXT NOT NULL
+                )
+            """)
+            # Paginação por cursor (created_at, id), colunas do painel por status e feed por seq
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_created_at ON pedidos (created_at, id)")
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_status ON pedidos (status, created_at, id)")
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_seq ON pedidos (seq)")
+            conexao.execute("""
+                CREATE TABLE IF NOT EXISTS pedidos_arquivo (
+                    id TEXT PRIMARY KEY,
+                    created_at TEXT NOT NULL,
+                    dados TEXT NOT NULL
+                )
+            """)
+            conexao.execute("CREATE TABLE IF NOT EXISTS contadores (nome TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+            conexao.execute("INSERT OR IGNORE INTO contadores (nome, valor) VALUES ('pedidos', 0)")
+
+        # Numa transação: com vários workers só o primeiro cria a tabela e soma os pedidos
+        # gravados antes dela (inclusive os arquivados, que continuam valendo nas vendas)
+        with self._banco.transacao() as conexao:
+            if conexao.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'vendas'").fetchone():
+                return
+            # NUMERIC: contagens continuam inteiras, receitas em ponto flutuante
+            conexao.execute("""
+                CREATE TABLE vendas (
+                    nivel TEXT NOT NULL,
+                    periodo TEXT NOT NULL,
+                    caminho TEXT NOT NULL,
+                    valor NUMERIC NOT NULL,
+                    PRIMARY KEY (nivel, periodo, caminho)
+                ) WITHOUT ROWID
+            """)
+            for consulta in (SQL_COLUNAS, "SELECT dados FROM pedidos_arquivo"):
+                cursor = conexao.execute(consulta)
+                while True:
+                    linhas = cursor.fetchmany(500)
+                    if not linhas:
+                        break
+                    _somar_vendas(conexao, [_pedido(linha) for linha in linhas])
+
+    # Transação de escrita: BEGIN IMMEDIATE já reserva o banco, a seq sai e é gravada
+    # na mesma transação e o feed nunca vê lacunas
+    def _escrever(self, operacao):
+        with self._banco.transacao() as conexao:
+            return operacao(conexao)
+
+    def __len__(self):
+        return self._banco.consultar_um("SELECT COUNT(*) FROM pedidos")[0]
+
+    def __contains__(self, order_id):
+        return self._banco.consultar_um("SELECT 1 FROM pedidos WHERE id = ?", (order_id,)) is not None
+
+    @property
+    def ultima_sequencia(self):
+        return self._banco.consultar_um("SELECT valor FROM contadores WHERE nome = 'pedidos'")[0]
+
+    # Grava o lote em uma transação; retorna os pedidos novos (ids repetidos são ignorados)
+    def adicionar_lote(self, pedidos):
+        def gravar(conexao):
+            ultima = conexao.execute(SQL_SEQUENCIA, (len(pedidos),)).fetchone()[0]
+            novos = []
+            for seq, pedido in enumerate(pedidos, ultima - len(pedidos) + 1):
+                dados = {campo: valor for campo, valor in pedido.items() if campo not in CAMPOS_COLUNAS}
+                cursor = conexao.execute(SQL_INSERIR, (
+                    pedido["id"], pedido.get("created_at", ""), pedido.get("status"),
+                    pedido.get("status_anterior"), pedido.get("updated_at"), pedido.get("total"),
+                    seq, seq, json.dumps(dados, ensure_ascii=False, default=str)
+                ))
+                if cursor.rowcount:
+                    pedido["seq"] = pedido["seq_criacao"] = seq
+                    novos.append(pedido)
+            _somar_vendas(conexao, novos)
+            return novos
+
+        return self._escrever(gravar) if pedidos else []
+
+    # Retorna False se já existe pedido com o mesmo id
+    def adicionar(self, pedido):
+        return bool(self.adicionar_lote([pedido]))
+
+    def obter(self, order_id):
+        linha = self._banco.consultar_um(f"{SQL_COLUNAS} WHERE id = ?", (order_id,))
+        return _pedido(linha) if linha else None
+
+    def atualizar_status(self, order_id, novo_status, updated_at):
+        def gravar(conexao):
+            if conexao.execute("SELECT 1 FROM pedidos WHERE id = ?", (order_id,)).fetchone() is None:
+                return None
+            seq = conexao.execute(SQL_SEQUENCIA, (1,)).fetchone()[0]
+            conexao.execute(
+                """UPDATE pedidos SET status_anterior = status, status = ?, updated_at = ?, seq = ?
+                   WHERE id = ?""",
+                (novo_status, updated_at, seq, order_id)
+            )
+            return _pedido(conexao.execute(f"{SQL_COLUNAS} WHERE id = ?", (order_id,)).fetchone())
+
+        return self._escrever(gravar)
+
+    def listar(self):
+        linhas = self._banco.consultar(f"{SQL_COLUNAS} ORDER BY created_at DESC, id DESC")
+        return [_pedido(linha) for linha in linhas]
+
+    def contagem_por_status(self):
+        return dict(self._banco.consultar("SELECT status, COUNT(*) FROM pedidos GROUP BY status"))
+
+    # (pedidos, receita) criados no dia "AAAA-MM-DD", pelo índice de created_at
+    def resumo_dia(self, dia):
+        pedidos, receita = self._banco.consultar_um(
+            "SELECT COUNT(*), TOTAL(total) FROM pedidos WHERE created_at >= ? AND created_at < ?",
+            (dia, (date.fromisoformat(dia) + timedelta(days=1)).isoformat())
+        )
+        return pedidos, round(receita, 2)
+
+    # Relatório de vendas de [inicio, fim) lendo só os baldes do nível (hora ou dia).
+    # Não acompanha remover/arquivar: o histórico de vendas continua valendo.
+    def relatorio_vendas(self, inicio, fim, nivel, top=10):
+        de, ate = faixa(inicio, fim, nivel)
+        sql = "SELECT periodo, caminho, valor FROM vendas WHERE nivel = ? AND periodo >= ?"
+        parametros = [nivel, de]
+        if ate is not None:
+            sql += " AND periodo < ?"
+            parametros.append(ate)
+        baldes = {}
+        for periodo, caminho, valor in self._banco.consultar(f"{sql} ORDER BY periodo", parametros):
+            aplicar(baldes.setdefault(periodo, {}), {caminho: valor})
+        return relatorio(list(baldes.items()), top)
+
+    # As contagens saem direto da tabela: não há contador para divergir
+    def reconciliar(self):
+        return {}
+
+    # Remove pedidos já transferidos (ex.: para o MongoDB). Pares (id, seq): o pedido só
+    # sai se não mudou desde a leitura. Retorna quantos foram removidos.
+    def remover(self, pares):
+        if not pares:
+            return 0
+        return self._escrever(
+            lambda conexao: conexao.executemany("DELETE FROM pedidos WHERE id = ? AND seq = ?", pares).rowcount
+        )
+
+    # Move para a tabela pedidos_arquivo até "limite" pedidos do status criados antes de
+    # "antes_de", os mais antigos primeiro. Retorna quantos saíram da tabela principal.
+    def arquivar(self, status, antes_de, limite=500):
+        def mover(conexao):
+            linhas = conexao.execute(
+                f"{SQL_COLUNAS} WHERE status = ? AND created_at < ? ORDER BY created_at, id LIMIT ?",
+                (status, antes_de, limite)
+            ).fetchall()
+            pedidos = [_pedido(linha) for linha in linhas]
+            conexao.executemany(
+                "INSERT OR REPLACE INTO pedidos_arquivo (id, created_at, dados) VALUES (?, ?, ?)",
+                [(p["id"], p.get("created_at", ""), json.dumps(p, ensure_ascii=False, default=str)) for p in pedidos]
+            )
+            conexao.executemany("DELETE FROM pedidos WHERE id = ?", [(p["id"],) for p in pedidos])
+            return len(pedidos)
+
+        return self._escrever(mover)
+
+    # Página mais recente primeiro, abaixo do cursor (created_at, id), com created_at em [inicio, fim).
+    # Retorna (pedidos, tem_mais).
+    def buscar(self, status=None, inicio=None, fim=None, cursor=None, limite=50):
+        condicoes = []
+        parametros = []
+        if status:
+            condicoes.append(f"status IN ({', '.join('?' * len(status))})")
+            parametros.extend(status)
+        if inicio:
+            condicoes.append("created_at >= ?")
+            parametros.append(inicio)
+        if fim:
+            condicoes.append("created_at < ?")
+            parametros.append(fim)
+        if cursor:
+            condicoes.append("(created_at, id) < (?, ?)")
+            parametros.extend(cursor)
+        onde = f" WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        linhas = self._banco.consultar(
+            f"{SQL_COLUNAS}{onde} ORDER BY created_at DESC, id DESC LIMIT ?", (*parametros, limite + 1)
+        )
+        return [_pedido(linha) for linha in linhas[:limite]], len(linhas) > limite
+
+    # Pedidos alterados depois do token, em ordem de seq.
+    # Retorna (alterados, novo_token, mais, resync)
+    def alteracoes_desde(self, token, limite):
+        # Leitura em uma transação: a seq e os pedidos vêm do mesmo snapshot do WAL
+        with self._banco.conexao() as conexao:
+            conexao.execute("BEGIN")
+            try:
+                ultima = self.ultima_sequencia
+                if token > ultima:
+                    # Token de outro banco (arquivo apagado ou trocado): o cliente recarrega tudo
+                    return [], ultima, False, True
+                linhas = conexao.execute(
+                    f"{SQL_COLUNAS} WHERE seq > ? ORDER BY seq LIMIT ?", (token, limite + 1)
+                ).fetchall()
+            finally:
+                conexao.execute("COMMIT")
+        alterados = [_pedido(linha) for linha in linhas[:limite]]
+        mais = len(linhas) > limite
+        novo_token = alterados[-1]["seq"] if mais else ultima
+        return alterados, novo_token, mais, False
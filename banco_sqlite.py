@@ -0,0 +1,74 @@
+# Conexão SQLite (modo WAL) do processo, usada pelo spool, reconciliação, limite de taxa
+# e armazém local. Uma conexão só, com os PRAGMAs aplicados uma vez e o cache de comandos
+# preparados aproveitado por todas as requisições. Por thread não serve: com o worker
+# gevent threading.local é local de cada greenlet e toda requisição abriria uma conexão.
+# As chamadas ao SQLite não cedem a vez a outro greenlet; a trava só serializa threads de
+# verdade (worker sync, flask run) e segura a conexão durante uma transação inteira.
+# Depois de um fork do gunicorn o processo filho abre a sua.
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+_trava_abertura = threading.Lock()
+
+class BancoSQLite:
+    def __init__(self, caminho, timeout=10, cached_statements=128):
+        self.caminho = caminho
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._conexao = None
+        self._trava = None
+        self._pid = None
+
+    def _garantir_aberto(self):
+        if self._pid == os.getpid():
+            return
+        with _trava_abertura:
+            if self._pid == os.getpid():
+                return
+            conexao = sqlite3.connect(
+                self.caminho, timeout=self.timeout, isolation_level=None,
+                check_same_thread=False, cached_statements=self.cached_statements
+            )
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            self._conexao = conexao
+            self._trava = threading.RLock()
+            self._pid = os.getpid()
+
+    # Conexão exclusiva enquanto o bloco roda (várias consultas, ou uma transação de leitura)
+    @contextmanager
+    def conexao(self):
+        self._garantir_aberto()
+        with self._trava:
+            yield self._conexao
+
+    # Transação de escrita: BEGIN IMMEDIATE já reserva o banco; erro no bloco desfaz tudo
+    @contextmanager
+    def transacao(self):
+        with self.conexao() as conexao:
+            conexao.execute("BEGIN IMMEDIATE")
+            try:
+                yield conexao
+            except BaseException:
+                conexao.execute("ROLLBACK")
+                raise
+            conexao.execute("COMMIT")
+
+    # Comando avulso (autocommit); retorna as linhas afetadas
+    def executar(self, sql, parametros=()):
+        with self.conexao() as conexao:
+            return conexao.execute(sql, parametros).rowcount
+
+    def executar_varios(self, sql, sequencia):
+        with self.conexao() as conexao:
+            return conexao.executemany(sql, sequencia).rowcount
+
+    def consultar(self, sql, parametros=()):
+        with self.conexao() as conexao:
+            return conexao.execute(sql, parametros).fetchall()
+
+    def consultar_um(self, sql, parametros=()):
+        with self.conexao() as conexao:
+            return conexao.execute(sql, parametros).fetchone()
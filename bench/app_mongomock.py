@@ -0,0 +1,24 @@
+# Entrada do gunicorn para benchmarks com MongoDB simulado (mongomock, em memória e
+# por worker). Exercita o caminho MongoDB do app sem um banco real:
+#   gunicorn -c gunicorn.conf.py bench.app_mongomock:app
+import mongomock
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import app as aplicacao
+
+# O bloco de conexão do app só importa esses nomes quando MONGODB_URI está configurada
+aplicacao.ASCENDING = ASCENDING
+aplicacao.DESCENDING = DESCENDING
+aplicacao.ReplaceOne = ReplaceOne
+aplicacao.ReturnDocument = ReturnDocument
+aplicacao.UpdateOne = UpdateOne
+aplicacao.BulkWriteError = BulkWriteError
+
+aplicacao.client = mongomock.MongoClient()
+aplicacao.db = aplicacao.client["delmonte_pizzaria"]
+aplicacao.pedidos_collection = aplicacao.db["pedidos"]
+aplicacao.garantir_indices()
+print("🧪 MongoDB simulado (mongomock) ativo")
+
+app = aplicacao.app
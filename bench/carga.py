@@ -0,0 +1,353 @@
+# Benchmark do app sob gunicorn: sobe o PagBank falso e o gunicorn (a menos que --url
+# aponte para um servidor já rodando), executa os cenários e mede p50/p95/p99 e vazão
+# por rota. Com --baseline compara com uma execução salva e sai com código 1 se regredir.
+# Com o PagBank falso, informa também o pico de chamadas simultâneas ao PagBank: compare
+# --worker-class sync e gevent com um worker, latência alta e muitos clientes.
+#   python bench/carga.py --mongo mongomock --workers 2 --salvar bench/resultado.json
+#   python bench/carga.py --baseline bench/baseline.json --tolerancia 0.2
+#   python bench/carga.py --cenarios pix --workers 1 --worker-class sync --concorrencia 300 --latencia-ms 1000
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def esperar_pronto(url, segundos=30):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} não respondeu em {segundos}s")
+
+# PagBank falso + gunicorn em subprocessos; retorna (url_base, url_pagbank, processos)
+def subir_servidores(args, pasta):
+    porta_pagbank = porta_livre()
+    porta_app = porta_livre()
+    processos = [subprocess.Popen([
+        sys.executable, os.path.join(RAIZ, "bench", "fake_pagbank.py"),
+        "--porta", str(porta_pagbank),
+        "--latencia-ms", str(args.latencia_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--taxa-erro", str(args.taxa_erro)
+    ])]
+
+    ambiente = dict(os.environ)
+    ambiente.update({
+        "PAGBANK_URL_API": f"http://127.0.0.1:{porta_pagbank}/orders",
+        "PAGBANK_TOKEN": "token-benchmark",
+        "WEBHOOK_SPOOL_PATH": os.path.join(pasta, "webhooks_spool.db"),
+        "METRICAS_DIR": os.path.join(pasta, "metricas"),
+        # Toda a carga sai de um IP só: o limite por cliente mediria só os 429
+        "LIMITES_ATIVOS": "0",
+        "PYTHONUNBUFFERED": "1"
+    })
+    modulo = "app:app"
+    if args.mongo == "mongomock":
+        ambiente.pop("MONGODB_URI", None)
+        modulo = "bench.app_mongomock:app"
+    elif args.mongo == "memoria":
+        ambiente.pop("MONGODB_URI", None)
+    else:
+        ambiente["MONGODB_URI"] = args.mongo
+
+    processos.append(subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "-w", str(args.workers), "-k", args.worker_class, "-b", f"127.0.0.1:{porta_app}", modulo],
+        cwd=RAIZ, env=ambiente,
+        stdout=open(os.path.join(pasta, "gunicorn.log"), "w"), stderr=subprocess.STDOUT
+    ))
+    url = f"http://127.0.0.1:{porta_app}"
+    esperar_pronto(f"http://127.0.0.1:{porta_pagbank}/orders/inexistente")
+    esperar_pronto(f"{url}/api")
+    return url, f"http://127.0.0.1:{porta_pagbank}", processos
+
+def pedido_exemplo():
+    return {
+        "reference_id": f"BENCH_{uuid.uuid4().hex[:16]}",
+        "customer": {"name": "Cliente Benchmark", "email": "bench@delmonte.com", "tax_id": "12345678909"},
+        # Ids do cardapio.json: o servidor recalcula preços e taxa de entrega
+        "items": [
+            {"id": "calabresa", "name": "Calabresa", "quantity": random.randint(1, 3), "unit_amount": 100},
+            {"id": "refrigerante-lata", "name": "Refrigerante Lata", "quantity": 1, "unit_amount": 100}
+        ],
+        "delivery_address": {"cep": "20000-000", "city": "Rio de Janeiro"}
+    }
+
+# Cada cenário recebe (sessao, url, estado) e devolve a lista de (rota, status, segundos) medidos
+
+def cenario_pix(sessao, url, estado):
+    inicio = time.perf_counter()
+    resposta = sessao.post(f"{url}/criar-pedido", json=pedido_exemplo(), timeout=30)
+    duracao = time.perf_counter() - inicio
+    if resposta.status_code == 201:
+        estado["order_ids"].append(resposta.json()["order_id"])
+    return [("POST /criar-pedido", resposta.status_code, duracao)]
+
+def cenario_status(sessao, url, estado):
+    # Muitos clientes consultando poucos pedidos, como as páginas de pagamento abertas
+    order_id = random.choice(estado["order_ids"][-50:])
+    inicio = time.perf_counter()
+    resposta = sessao.get(f"{url}/status-pedido/{order_id}", timeout=30)
+    return [("GET /status-pedido/<id>", resposta.status_code, time.perf_counter() - inicio)]
+
+def cenario_webhook(sessao, url, estado):
+    pedido = pedido_exemplo()
+    corpo = {
+        "id": f"ORDE_{uuid.uuid4().hex[:24].upper()}",
+        "reference_id": pedido["reference_id"],
+        "customer": pedido["customer"],
+        "items": pedido["items"],
+        "charges": [{
+            "id": f"CHAR_{uuid.uuid4().hex[:24].upper()}",
+            "status": "PAID",
+            "payment_method": {"type": random.choice(["PIX", "CREDIT_CARD"])}
+        }]
+    }
+    inicio = time.perf_counter()
+    resposta = sessao.post(f"{url}/webhook-pagbank", json=corpo, timeout=30)
+    return [("POST /webhook-pagbank", resposta.status_code, time.perf_counter() - inicio)]
+
+def cenario_painel(sessao, url, estado):
+    # Um ciclo do painel da cozinha: feed incremental, estatísticas e, às vezes, a lista completa
+    medidas = []
+    token = estado.get("token", 0)
+    inicio = time.perf_counter()
+    resposta = sessao.get(f"{url}/api/pedidos/novos", params={"token": token}, timeout=30)
+    medidas.append(("GET /api/pedidos/novos", resposta.status_code, time.perf_counter() - inicio))
+    if resposta.status_code == 200:
+        estado["token"] = resposta.json().get("token", token)
+
+    inicio = time.perf_counter()
+    resposta = sessao.get(f"{url}/api/pedidos/stats", timeout=30)
+    medidas.append(("GET /api/pedidos/stats", resposta.status_code, time.perf_counter() - inicio))
+
+    if random.random() < 0.2:
+        # Mesma carga do loadOrders() do pedidos.html: em andamento + entregues de hoje
+        tokens = [
+            _listar_pedidos(sessao, url, {"status": "pending,preparing,completed"}, medidas),
+            _listar_pedidos(sessao, url, {"status": "delivered", "desde": time.strftime("%Y-%m-%d")}, medidas)
+        ]
+        if None not in tokens:
+            estado["token"] = min(tokens)
+    return medidas
+
+# Percorre as páginas de /api/pedidos seguindo o proximo_cursor; retorna o token da primeira
+def _listar_pedidos(sessao, url, params, medidas):
+    token = None
+    cursor = None
+    while True:
+        pagina = {"limite": 200, **params}
+        if cursor:
+            pagina["cursor"] = cursor
+        inicio = time.perf_counter()
+        resposta = sessao.get(f"{url}/api/pedidos", params=pagina, timeout=30)
+        medidas.append(("GET /api/pedidos", resposta.status_code, time.perf_counter() - inicio))
+        if resposta.status_code != 200:
+            return None
+        dados = resposta.json()
+        if token is None:
+            token = dados.get("token")
+        cursor = dados.get("proximo_cursor")
+        if not cursor:
+            return token
+
+CENARIOS = {
+    "pix": cenario_pix,
+    "status": cenario_status,
+    "webhook": cenario_webhook,
+    "painel": cenario_painel
+}
+
+def executar_cenario(nome, url, concorrencia, duracao, estado):
+    medidas = []
+    trava = threading.Lock()
+    parar = time.monotonic() + duracao
+
+    def trabalhador():
+        sessao = requests.Session()
+        locais = []
+        while time.monotonic() < parar:
+            try:
+                locais.extend(CENARIOS[nome](sessao, url, estado))
+            except requests.RequestException as e:
+                locais.append((f"{nome}: erro de conexão", None, 0.0))
+                print(f"⚠️ {nome}: {e}")
+        with trava:
+            medidas.extend(locais)
+
+    threads = [threading.Thread(target=trabalhador) for _ in range(concorrencia)]
+    inicio = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return medidas, time.monotonic() - inicio
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    indice = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados))) - 1))
+    return ordenados[indice]
+
+def resumir(medidas, segundos):
+    por_rota = {}
+    for rota, status, duracao in medidas:
+        por_rota.setdefault(rota, []).append((status, duracao))
+
+    resumo = {}
+    for rota, itens in por_rota.items():
+        duracoes = sorted(d * 1000 for _, d in itens)
+        erros = sum(1 for status, _ in itens if status is None or status >= 500)
+        resumo[rota] = {
+            "requisicoes": len(itens),
+            "rps": round(len(itens) / segundos, 1),
+            "p50_ms": round(percentil(duracoes, 50), 1),
+            "p95_ms": round(percentil(duracoes, 95), 1),
+            "p99_ms": round(percentil(duracoes, 99), 1),
+            "max_ms": round(duracoes[-1], 1),
+            "taxa_erro": round(erros / len(itens), 4)
+        }
+    return resumo
+
+def imprimir(resultado):
+    print(f"\n{'cenário / rota':<45} {'req':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'erro%':>7}")
+    for chave, r in resultado["rotas"].items():
+        print(f"{chave:<45} {r['requisicoes']:>7} {r['rps']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['p99_ms']:>8} {r['taxa_erro'] * 100:>6.2f}%")
+
+# Pico de chamadas simultâneas visto pelo PagBank falso desde a última leitura
+def pico_pagbank(url_pagbank):
+    return requests.get(f"{url_pagbank}/_estatisticas?zerar=1", timeout=5).json()["pico_em_voo"]
+
+# Regressão: p95/p99 acima da baseline + tolerância, vazão abaixo ou mais erros
+def comparar(resultado, baseline, tolerancia):
+    regressoes = []
+    for chave, atual in resultado["rotas"].items():
+        base = baseline["rotas"].get(chave)
+        if base is None:
+            continue
+        for metrica in ("p95_ms", "p99_ms"):
+            # Abaixo de 5 ms o ruído domina a comparação
+            if atual[metrica] > max(base[metrica] * (1 + tolerancia), base[metrica] + 5):
+                regressoes.append(f"{chave}: {metrica} {base[metrica]} -> {atual[metrica]}")
+        if atual["rps"] < base["rps"] * (1 - tolerancia):
+            regressoes.append(f"{chave}: rps {base['rps']} -> {atual['rps']}")
+        if atual["taxa_erro"] > base["taxa_erro"] + 0.01:
+            regressoes.append(f"{chave}: taxa_erro {base['taxa_erro']} -> {atual['taxa_erro']}")
+    return regressoes
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do app DEL MONTE")
+    parser.add_argument("--url", help="Usa um servidor já rodando em vez de subir PagBank falso + gunicorn")
+    parser.add_argument("--cenarios", default="pix,status,webhook,painel")
+    parser.add_argument("--duracao", type=float, default=15, help="Segundos por cenário")
+    parser.add_argument("--concorrencia", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--worker-class", default="gevent", help="Worker do gunicorn (gevent, sync...)")
+    parser.add_argument("--mongo", default="mongomock", help="mongomock, memoria ou uma MONGODB_URI")
+    parser.add_argument("--latencia-ms", type=float, default=150, help="Latência do PagBank falso")
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="Fração de respostas 503 do PagBank falso")
+    parser.add_argument("--salvar", help="Grava o resultado em JSON (use como baseline depois)")
+    parser.add_argument("--baseline", help="Resultado salvo para comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.15)
+    args = parser.parse_args()
+
+    nomes = [nome for nome in args.cenarios.split(",") if nome]
+    desconhecidos = set(nomes) - set(CENARIOS)
+    if desconhecidos:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    pasta = tempfile.mkdtemp(prefix="bench_delmonte_")
+    processos = []
+    try:
+        url_pagbank = None
+        if args.url:
+            url = args.url.rstrip("/")
+        else:
+            url, url_pagbank, processos = subir_servidores(args, pasta)
+        print(f"🧪 Benchmark em {url} (logs em {pasta})")
+
+        # Pedidos iniciais para o cenário de status ter o que consultar
+        estado = {"order_ids": [], "token": 0}
+        sessao = requests.Session()
+        for _ in range(20):
+            cenario_pix(sessao, url, estado)
+        if "status" in nomes and not estado["order_ids"]:
+            raise RuntimeError("Não foi possível criar pedidos iniciais para o cenário de status")
+
+        rotas = {}
+        picos = {}
+        for nome in nomes:
+            print(f"▶️ {nome}: {args.concorrencia} clientes por {args.duracao:g}s")
+            if url_pagbank:
+                pico_pagbank(url_pagbank)
+            medidas, segundos = executar_cenario(nome, url, args.concorrencia, args.duracao, estado)
+            for rota, resumo in resumir(medidas, segundos).items():
+                rotas[f"{nome} {rota}"] = resumo
+            if url_pagbank:
+                picos[nome] = pico_pagbank(url_pagbank)
+                print(f"   pico de {picos[nome]} chamadas simultâneas ao PagBank")
+
+        resultado = {
+            "meta": {
+                "data": datetime.now().isoformat(),
+                "url": url,
+                "workers": None if args.url else args.workers,
+                "worker_class": None if args.url else args.worker_class,
+                "mongo": None if args.url else args.mongo,
+                "concorrencia": args.concorrencia,
+                "duracao": args.duracao,
+                "latencia_pagbank_ms": args.latencia_ms
+            },
+            "rotas": rotas,
+            "pico_pagbank_simultaneas": picos
+        }
+        imprimir(resultado)
+
+        if args.salvar:
+            with open(args.salvar, "w", encoding="utf-8") as arquivo:
+                json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+            print(f"💾 Resultado salvo em {args.salvar}")
+
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as arquivo:
+                regressoes = comparar(resultado, json.load(arquivo), args.tolerancia)
+            if regressoes:
+                print("❌ Regressões em relação à baseline:")
+                for regressao in regressoes:
+                    print(f"   {regressao}")
+                return 1
+            print("✅ Sem regressões em relação à baseline")
+        return 0
+    finally:
+        for processo in reversed(processos):
+            processo.terminate()
+        for processo in processos:
+            try:
+                processo.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+
+if __name__ == "__main__":
+    sys.exit(main())
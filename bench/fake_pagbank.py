@@ -0,0 +1,128 @@
+# PagBank falso para benchmarks: POST /orders e GET /orders/<id> com latência e taxa de erro
+# configuráveis. Pedidos com "charges" (cartão) voltam PAID; pedidos PIX ficam WAITING.
+# GET /_estatisticas informa o pico de chamadas simultâneas (?zerar=1 recomeça a contagem).
+#   python bench/fake_pagbank.py --porta 8900 --latencia-ms 150 --jitter-ms 50 --taxa-erro 0.01
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+pedidos = {}
+trava = threading.Lock()
+config = {"latencia_ms": 0, "jitter_ms": 0, "taxa_erro": 0.0}
+estatisticas = {"em_voo": 0, "pico_em_voo": 0, "chamadas": 0}
+
+class ManipuladorPagBank(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, codigo, corpo):
+        dados = json.dumps(corpo).encode()
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    # Latência simulada e erros 5xx aleatórios; retorna True se a requisição deve falhar
+    def _simular(self):
+        with trava:
+            estatisticas["em_voo"] += 1
+            estatisticas["chamadas"] += 1
+            estatisticas["pico_em_voo"] = max(estatisticas["pico_em_voo"], estatisticas["em_voo"])
+        try:
+            atraso = config["latencia_ms"] + random.uniform(-1, 1) * config["jitter_ms"]
+            if atraso > 0:
+                time.sleep(atraso / 1000)
+        finally:
+            with trava:
+                estatisticas["em_voo"] -= 1
+        if random.random() < config["taxa_erro"]:
+            self._responder(503, {"error_messages": [{"description": "falha simulada"}]})
+            return True
+        return False
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length", 0))
+        corpo = json.loads(self.rfile.read(tamanho) or b"{}")
+        if self.path.rstrip("/") != "/orders":
+            return self._responder(404, {"error_messages": [{"description": "rota inexistente"}]})
+        if self._simular():
+            return
+
+        chave = self.headers.get("x-idempotency-key")
+        with trava:
+            # Mesma chave de idempotência devolve o pedido original
+            if chave and chave in pedidos:
+                return self._responder(201, pedidos[chave])
+
+            order_id = f"ORDE_{uuid.uuid4().hex[:24].upper()}"
+            pedido = {
+                "id": order_id,
+                "reference_id": corpo.get("reference_id"),
+                "created_at": datetime.now().isoformat(),
+                "customer": corpo.get("customer", {}),
+                "items": corpo.get("items", [])
+            }
+            if corpo.get("charges"):
+                pedido["charges"] = [{
+                    "id": f"CHAR_{uuid.uuid4().hex[:24].upper()}",
+                    "status": "PAID",
+                    "payment_method": {"type": corpo["charges"][0].get("payment_method", {}).get("type", "CREDIT_CARD")}
+                }]
+            else:
+                pedido["qr_codes"] = [{
+                    "id": f"QRCO_{uuid.uuid4().hex[:24].upper()}",
+                    "text": "00020101021226830014br.gov.bcb.pix",
+                    "links": [{"href": f"http://localhost/qrcode/{order_id}.png"}],
+                    "expiration_date": (corpo.get("qr_codes") or [{}])[0].get("expiration_date", "")
+                }]
+            pedidos[order_id] = pedido
+            if chave:
+                pedidos[chave] = pedido
+        self._responder(201, pedido)
+
+    def do_GET(self):
+        if self.path.startswith("/_estatisticas"):
+            with trava:
+                corpo = dict(estatisticas)
+                if self.path.endswith("zerar=1"):
+                    estatisticas.update(pico_em_voo=estatisticas["em_voo"], chamadas=0)
+            return self._responder(200, corpo)
+        partes = self.path.strip("/").split("/")
+        if len(partes) != 2 or partes[0] != "orders":
+            return self._responder(404, {"error_messages": [{"description": "rota inexistente"}]})
+        if self._simular():
+            return
+        with trava:
+            pedido = pedidos.get(partes[1])
+        if pedido is None:
+            return self._responder(404, {"error_messages": [{"description": "pedido não encontrado"}]})
+        self._responder(200, pedido)
+
+class ServidorPagBank(ThreadingHTTPServer):
+    daemon_threads = True
+    # Centenas de conexões chegando juntas não podem esbarrar no backlog padrão (5)
+    request_queue_size = 1024
+
+def iniciar(porta=0, latencia_ms=0, jitter_ms=0, taxa_erro=0.0):
+    config.update(latencia_ms=latencia_ms, jitter_ms=jitter_ms, taxa_erro=taxa_erro)
+    return ServidorPagBank(("127.0.0.1", porta), ManipuladorPagBank)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PagBank falso para benchmarks")
+    parser.add_argument("--porta", type=int, default=8900)
+    parser.add_argument("--latencia-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--taxa-erro", type=float, default=0.0)
+    args = parser.parse_args()
+
+    servidor = iniciar(args.porta, args.latencia_ms, args.jitter_ms, args.taxa_erro)
+    print(f"🧪 PagBank falso em http://127.0.0.1:{servidor.server_port}/orders", flush=True)
+    servidor.serve_forever()
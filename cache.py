@@ -0,0 +1,93 @@
+# Cache TTL com LRU limitado e coalescência de requisições (single-flight):
+# chamadas simultâneas para a mesma chave esperam uma única carga.
+import threading
+import time
+from collections import OrderedDict
+
+class _Carga:
+    def __init__(self):
+        self.evento = threading.Event()
+        self.valor = None
+        self.erro = None
+        self.invalidada = False
+
+class CacheTTL:
+    def __init__(self, capacidade=1000, ttl=3):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._cargas = {}
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.coalescidas = 0
+
+    # ttl_de(valor) permite variar o TTL pelo resultado (0 = não guardar)
+    def obter_ou_carregar(self, chave, carregar, ttl_de=None):
+        with self._trava:
+            item = self._dados.get(chave)
+            if item is not None and item[0] > time.monotonic():
+                self._dados.move_to_end(chave)
+                self.acertos += 1
+                return item[1]
+
+            carga = self._cargas.get(chave)
+            lider = carga is None
+            if lider:
+                carga = _Carga()
+                self._cargas[chave] = carga
+                self.falhas += 1
+            else:
+                self.coalescidas += 1
+
+        if not lider:
+            carga.evento.wait()
+            if carga.erro is not None:
+                raise carga.erro
+            return carga.valor
+
+        try:
+            valor = carregar()
+            carga.valor = valor
+            ttl = ttl_de(valor) if ttl_de else self.ttl
+            with self._trava:
+                if ttl > 0 and not carga.invalidada:
+                    self._dados[chave] = (time.monotonic() + ttl, valor)
+                    self._dados.move_to_end(chave)
+                    while len(self._dados) > self.capacidade:
+                        self._dados.popitem(last=False)
+            return valor
+        except Exception as e:
+            carga.erro = e
+            raise
+        finally:
+            with self._trava:
+                self._cargas.pop(chave, None)
+            carga.evento.set()
+
+    # Uma carga em andamento no momento da invalidação não é guardada (pode estar velha)
+    def invalidar(self, chave):
+        with self._trava:
+            self._dados.pop(chave, None)
+            carga = self._cargas.get(chave)
+            if carga is not None:
+                carga.invalidada = True
+
+    # Remove as entradas vencidas (sem isso só saem pelo LRU); retorna quantas
+    def limpar_expirados(self):
+        agora = time.monotonic()
+        with self._trava:
+            vencidas = [chave for chave, (expira, _) in self._dados.items() if expira <= agora]
+            for chave in vencidas:
+                del self._dados[chave]
+        return len(vencidas)
+
+    def resumo(self):
+        with self._trava:
+            return {
+                "itens": len(self._dados),
+                "capacidade": self.capacidade,
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "coalescidas": self.coalescidas
+            }
@@ -0,0 +1,206 @@
+# Cardápio do servidor (cardapio.json): itens, preços em centavos, tamanhos e taxas de
+# entrega por prefixo de CEP. O arquivo vira um índice imutável carregado uma vez e
+# trocado inteiro quando o arquivo muda no disco; quem está cotando um pedido continua
+# com o índice que pegou. O total do pedido sai daqui, não do que o navegador mandou.
+# A versão é o hash do arquivo, e o mesmo hash é o ETag de /api/cardapio.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from estaticos import PaginaEstatica
+
+MAX_LINHAS = 50
+MAX_QUANTIDADE = 50
+
+class ErroCardapio(ValueError):
+    pass
+
+# Sem cardápio carregado não há como cobrar: a rota responde 503
+class CardapioIndisponivel(ErroCardapio):
+    pass
+
+def _centavos(valor, onde):
+    if not isinstance(valor, int) or isinstance(valor, bool) or valor < 0:
+        raise ValueError(f"preço inválido em {onde}: {valor!r}")
+    return valor
+
+def _chave_nome(nome):
+    return " ".join(str(nome).split()).casefold()
+
+def nome_meio_a_meio(nome, segundo_nome):
+    return f"{nome} / {segundo_nome} (Meio a Meio)"
+
+class Cardapio:
+    __slots__ = ("assinatura", "versao", "pagina", "itens", "por_nome", "zonas", "taxa_padrao")
+
+    def __init__(self, assinatura, conteudo):
+        documento = json.loads(conteudo)
+        self.assinatura = assinatura
+        self.versao = hashlib.sha256(conteudo).hexdigest()[:32]
+        self.pagina = PaginaEstatica(assinatura, "application/json", conteudo)
+
+        self.itens = {}
+        for item in documento["itens"]:
+            if item["id"] in self.itens:
+                raise ValueError(f"item repetido: {item['id']}")
+            tamanhos = {
+                tamanho_id: (tamanho.get("nome", tamanho_id), _centavos(tamanho["preco"], f"{item['id']}/{tamanho_id}"))
+                for tamanho_id, tamanho in item.get("tamanhos", {}).items()
+            }
+            self.itens[item["id"]] = {
+                "id": item["id"],
+                "nome": item["nome"],
+                "preco": _centavos(item["preco"], item["id"]),
+                "meio_a_meio": bool(item.get("meio_a_meio")),
+                "disponivel": item.get("disponivel", True),
+                "tamanhos": tamanhos
+            }
+
+        # Nomes exibidos (inclusive "A / B (Meio a Meio)") para carrinhos montados antes
+        # de o navegador mandar o id do item
+        self.por_nome = {}
+        sabores = [item for item in self.itens.values() if item["meio_a_meio"]]
+        for item in self.itens.values():
+            self.por_nome[_chave_nome(item["nome"])] = (item["id"], None)
+        for item in sabores:
+            for segundo in sabores:
+                if segundo is not item:
+                    self.por_nome[_chave_nome(nome_meio_a_meio(item["nome"], segundo["nome"]))] = (item["id"], segundo["id"])
+
+        entrega = documento.get("entrega", {})
+        self.taxa_padrao = _centavos(entrega.get("taxa_padrao", 0), "taxa_padrao")
+        # Prefixo mais longo primeiro: "220" vence "2"
+        self.zonas = sorted(
+            ((str(prefixo), _centavos(zona["taxa"], zona.get("nome", prefixo)))
+             for zona in entrega.get("zonas", []) for prefixo in zona["prefixos_cep"]),
+            key=lambda zona: -len(zona[0])
+        )
+
+    def taxa_entrega(self, cep):
+        digitos = re.sub(r"\D", "", str(cep or ""))
+        if digitos:
+            for prefixo, taxa in self.zonas:
+                if digitos.startswith(prefixo):
+                    return taxa
+        return self.taxa_padrao
+
+    def _produto(self, id_item, linha):
+        item = self.itens.get(id_item)
+        if item is None or not item["disponivel"]:
+            raise ErroCardapio(f"Item {linha + 1}: produto indisponível ({id_item})")
+        return item
+
+    def _preco(self, item, tamanho, linha):
+        if not tamanho:
+            return item["preco"], ""
+        if tamanho not in item["tamanhos"]:
+            raise ErroCardapio(f"Item {linha + 1}: tamanho inválido ({tamanho})")
+        nome, preco = item["tamanhos"][tamanho]
+        return preco, nome
+
+    # Itens do carrinho ({id, quantity, segundo_sabor?, tamanho?} ou, no formato antigo,
+    # {name, quantity}) com os preços do cardápio, em uma passada. Levanta ErroCardapio
+    # no primeiro item inválido. Valores em centavos.
+    def cotar(self, itens, cep=None):
+        if not isinstance(itens, list) or not itens:
+            raise ErroCardapio("Pedido sem itens")
+        if len(itens) > MAX_LINHAS:
+            raise ErroCardapio(f"Pedido com mais de {MAX_LINHAS} itens")
+
+        cotados = []
+        subtotal = 0
+        for linha, pedido in enumerate(itens):
+            if not isinstance(pedido, dict):
+                raise ErroCardapio(f"Item {linha + 1}: formato inválido")
+            quantidade = pedido.get("quantity", 1)
+            if not isinstance(quantidade, int) or isinstance(quantidade, bool) or not 1 <= quantidade <= MAX_QUANTIDADE:
+                raise ErroCardapio(f"Item {linha + 1}: quantidade deve ser de 1 a {MAX_QUANTIDADE}")
+
+            if pedido.get("id"):
+                id_item, segundo_id = pedido["id"], pedido.get("segundo_sabor")
+            else:
+                id_item, segundo_id = self.por_nome.get(_chave_nome(pedido.get("name", "")), (None, None))
+                if id_item is None:
+                    raise ErroCardapio(f"Item {linha + 1}: produto não encontrado ({pedido.get('name')})")
+
+            item = self._produto(id_item, linha)
+            tamanho = pedido.get("tamanho")
+            preco, nome_tamanho = self._preco(item, tamanho, linha)
+            nome = item["nome"]
+            if segundo_id:
+                segundo = self._produto(segundo_id, linha)
+                if segundo is item or not (item["meio_a_meio"] and segundo["meio_a_meio"]):
+                    raise ErroCardapio(f"Item {linha + 1}: combinação meio a meio inválida")
+                preco_segundo, _ = self._preco(segundo, tamanho, linha)
+                # Média das metades, arredondada para cima no meio centavo
+                preco = (preco + preco_segundo + 1) // 2
+                nome = nome_meio_a_meio(nome, segundo["nome"])
+            if nome_tamanho:
+                nome = f"{nome} - {nome_tamanho}"
+
+            cotado = {"id": item["id"], "name": nome, "quantity": quantidade, "unit_amount": preco}
+            if segundo_id:
+                cotado["segundo_sabor"] = segundo_id
+            if tamanho:
+                cotado["tamanho"] = tamanho
+            cotados.append(cotado)
+            subtotal += preco * quantidade
+
+        taxa = self.taxa_entrega(cep)
+        return {
+            "items": cotados,
+            "subtotal": subtotal,
+            "delivery_fee": taxa,
+            "total_amount": subtotal + taxa,
+            "versao_cardapio": self.versao
+        }
+
+class CarregadorCardapio:
+    def __init__(self, caminho, intervalo_verificacao=1.0):
+        self.caminho = caminho
+        self.intervalo_verificacao = intervalo_verificacao
+        self._cardapio = None
+        self._assinatura = None
+        self._verificado_em = 0
+        self._trava = threading.Lock()
+        self._recarregar()
+
+    def _recarregar(self):
+        try:
+            info = os.stat(self.caminho)
+            assinatura = (info.st_mtime_ns, info.st_size)
+            if assinatura != self._assinatura:
+                # Um arquivo inválido é lido uma vez só, não a cada verificação
+                self._assinatura = assinatura
+                with open(self.caminho, "rb") as arquivo:
+                    conteudo = arquivo.read()
+                self._cardapio = Cardapio(assinatura, conteudo)
+                print(f"🍕 Cardápio carregado ({len(self._cardapio.itens)} itens, versão {self._cardapio.versao[:8]})")
+        except OSError as e:
+            if self._assinatura is not False:
+                print(f"⚠️ Cardápio {self.caminho} inacessível: {e}")
+            self._assinatura = False
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # Arquivo no meio de uma edição ou inválido: segue com a versão anterior
+            print(f"⚠️ Não foi possível carregar o cardápio {self.caminho}: {e}")
+        self._verificado_em = time.monotonic()
+
+    # Índice atual (ou None se nunca carregou); no máximo um stat a cada intervalo
+    def atual(self):
+        if time.monotonic() - self._verificado_em >= self.intervalo_verificacao:
+            if self._trava.acquire(blocking=self._cardapio is None):
+                try:
+                    if time.monotonic() - self._verificado_em >= self.intervalo_verificacao:
+                        self._recarregar()
+                finally:
+                    self._trava.release()
+        return self._cardapio
+
+    def cotar(self, itens, cep=None):
+        cardapio = self.atual()
+        if cardapio is None:
+            raise CardapioIndisponivel("Cardápio indisponível no momento")
+        return cardapio.cotar(itens, cep)
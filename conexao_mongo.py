@@ -0,0 +1,83 @@
+# Conexão com o MongoDB criada no próprio worker, na primeira requisição (depois do fork
+# do gunicorn, seguro com --preload), por uma thread que reconecta com backoff e
+# verifica a conexão periodicamente. Os callbacks decidem o que o app faz ao conectar,
+# ao perder a conexão e a cada verificação bem-sucedida.
+import os
+import threading
+import time
+
+class ConexaoMongo:
+    def __init__(self, criar_cliente, ao_conectar, ao_desconectar, periodicamente=None,
+                 intervalo_verificacao=10, falhas_para_desconectar=2, espera_maxima=60):
+        self.criar_cliente = criar_cliente
+        self.ao_conectar = ao_conectar
+        self.ao_desconectar = ao_desconectar
+        self.periodicamente = periodicamente
+        self.intervalo_verificacao = intervalo_verificacao
+        self.falhas_para_desconectar = falhas_para_desconectar
+        self.espera_maxima = espera_maxima
+        self.cliente = None
+        self.conectado = False
+        self.conectado_desde = None
+        self.ultimo_erro = None
+        self.ultima_verificacao = None
+        self._primeira_tentativa = threading.Event()
+        self._trava = threading.Lock()
+        self._pid = None
+
+    # Inicia a thread no processo atual; esperar > 0 aguarda a primeira tentativa de conexão
+    def garantir_iniciado(self, esperar=0):
+        if self._pid != os.getpid():
+            with self._trava:
+                if self._pid != os.getpid():
+                    # Cliente herdado do processo pai não é reaproveitado depois do fork
+                    self.cliente = None
+                    self.conectado = False
+                    self._primeira_tentativa = threading.Event()
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._executar, name="mongo-conexao", daemon=True).start()
+        if esperar:
+            self._primeira_tentativa.wait(esperar)
+
+    def _executar(self):
+        espera = 1
+        falhas = 0
+        while True:
+            try:
+                if self.cliente is None:
+                    self.cliente = self.criar_cliente()
+                self.cliente.admin.command("ping")
+                self.ultima_verificacao = time.time()
+                falhas = 0
+                espera = 1
+                if not self.conectado:
+                    self.ao_conectar(self.cliente)
+                    self.conectado = True
+                    self.conectado_desde = time.time()
+                    self.ultimo_erro = None
+                if self.periodicamente:
+                    self.periodicamente()
+            except Exception as e:
+                falhas += 1
+                self.ultimo_erro = str(e)
+                if self.conectado and falhas >= self.falhas_para_desconectar:
+                    self.conectado = False
+                    self.conectado_desde = None
+                    self.ao_desconectar(e)
+                elif not self.conectado:
+                    print(f"⚠️ MongoDB indisponível, nova tentativa em {espera}s: {e}")
+            finally:
+                self._primeira_tentativa.set()
+            if self.conectado:
+                time.sleep(self.intervalo_verificacao)
+            else:
+                time.sleep(espera)
+                espera = min(self.espera_maxima, espera * 2)
+
+    def resumo(self):
+        return {
+            "conectado": self.conectado,
+            "conectado_desde": self.conectado_desde,
+            "ultima_verificacao": self.ultima_verificacao,
+            "ultimo_erro": self.ultimo_erro
+        }
@@ -0,0 +1,116 @@
+# Páginas HTML servidas da memória: cada arquivo é lido e comprimido (gzip e, com o
+# pacote brotli instalado, br) uma vez, com ETag forte por variante e resposta 304
+# para If-None-Match. Se o arquivo mudar no disco (mtime/tamanho), as variantes são
+# refeitas na próxima requisição.
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Ordem de preferência quando o cliente aceita mais de uma
+CODIFICACOES = ("br", "gzip")
+
+class PaginaEstatica:
+    __slots__ = ("assinatura", "tipo", "variantes", "etags")
+
+    def __init__(self, assinatura, tipo, conteudo):
+        self.assinatura = assinatura
+        self.tipo = tipo
+        self.variantes = {"identity": conteudo}
+        if brotli is not None:
+            self.variantes["br"] = brotli.compress(conteudo, quality=11)
+        self.variantes["gzip"] = gzip.compress(conteudo, compresslevel=9, mtime=0)
+        # Variante comprimida maior que o original não compensa
+        for codificacao in CODIFICACOES:
+            if codificacao in self.variantes and len(self.variantes[codificacao]) >= len(conteudo):
+                del self.variantes[codificacao]
+
+        resumo = hashlib.sha256(conteudo).hexdigest()[:32]
+        self.etags = {
+            codificacao: f'"{resumo}"' if codificacao == "identity" else f'"{resumo}-{codificacao}"'
+            for codificacao in self.variantes
+        }
+
+class ArquivosEstaticos:
+    def __init__(self, diretorio, nomes, intervalo_verificacao=1.0, max_age=0):
+        self.diretorio = diretorio
+        self.intervalo_verificacao = intervalo_verificacao
+        self.max_age = max_age
+        self._paginas = {}
+        self._verificado_em = {}
+        self._trava = threading.Lock()
+        for nome in nomes:
+            self._recarregar(nome)
+
+    def _caminho(self, nome):
+        return os.path.join(self.diretorio, nome)
+
+    def _recarregar(self, nome):
+        try:
+            info = os.stat(self._caminho(nome))
+            assinatura = (info.st_mtime_ns, info.st_size)
+            pagina = self._paginas.get(nome)
+            if pagina is None or pagina.assinatura != assinatura:
+                with open(self._caminho(nome), "rb") as arquivo:
+                    conteudo = arquivo.read()
+                tipo = mimetypes.guess_type(nome)[0] or "application/octet-stream"
+                if tipo.startswith("text/"):
+                    tipo += "; charset=utf-8"
+                self._paginas[nome] = PaginaEstatica(assinatura, tipo, conteudo)
+                print(f"📄 {nome} carregado ({len(conteudo)} bytes, variantes: {', '.join(self._paginas[nome].variantes)})")
+        except OSError as e:
+            if self._paginas.pop(nome, None) is not None or nome not in self._verificado_em:
+                print(f"⚠️ Não foi possível carregar {nome}: {e}")
+        self._verificado_em[nome] = time.monotonic()
+
+    # No máximo um stat por arquivo a cada intervalo; quem chega durante a releitura
+    # continua recebendo a versão anterior
+    def _pagina(self, nome):
+        if time.monotonic() - self._verificado_em.get(nome, 0) >= self.intervalo_verificacao:
+            if self._trava.acquire(blocking=nome not in self._paginas):
+                try:
+                    if time.monotonic() - self._verificado_em.get(nome, 0) >= self.intervalo_verificacao:
+                        self._recarregar(nome)
+                finally:
+                    self._trava.release()
+        return self._paginas.get(nome)
+
+    # Resposta pronta para a página, ou None se o arquivo não existe
+    def responder(self, nome, requisicao):
+        pagina = self._pagina(nome)
+        if pagina is None:
+            return None
+        return responder_pagina(pagina, requisicao, self.max_age)
+
+def _codificacao(pagina, requisicao):
+    aceitas = requisicao.accept_encodings
+    for codificacao in CODIFICACOES:
+        if codificacao in pagina.variantes and aceitas[codificacao] > 0:
+            return codificacao
+    return "identity"
+
+# Escolhe a variante aceita pelo cliente e responde 304 se o ETag dela bate com If-None-Match
+def responder_pagina(pagina, requisicao, max_age=0):
+    codificacao = _codificacao(pagina, requisicao)
+    etag = pagina.etags[codificacao]
+    cabecalhos = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        # Sem versão na URL: o navegador revalida e recebe 304 enquanto o arquivo não muda
+        "Cache-Control": f"public, max-age={max_age}" if max_age else "no-cache"
+    }
+    if codificacao != "identity":
+        cabecalhos["Content-Encoding"] = codificacao
+
+    if requisicao.if_none_match.contains_weak(etag.strip('"')):
+        return Response(status=304, headers=cabecalhos)
+    return Response(pagina.variantes[codificacao], status=200, content_type=pagina.tipo, headers=cabecalhos)
@@ -0,0 +1,111 @@
+# Hub de eventos em processo para as rotas Server-Sent Events (SSE).
+# Cada assinante tem uma fila limitada; quem não consome a tempo é marcado
+# como atrasado em vez de bloquear quem publica.
+import json
+import queue
+import threading
+import time
+
+class Assinatura:
+    def __init__(self, topicos, capacidade):
+        self.topicos = topicos
+        self.fila = queue.Queue(maxsize=capacidade)
+        self.atrasada = False
+
+class HubEventos:
+    def __init__(self, capacidade_fila=50, max_assinantes=500):
+        self.capacidade_fila = capacidade_fila
+        self.max_assinantes = max_assinantes
+        self._trava = threading.Lock()
+        self._por_topico = {}
+        self._total = 0
+
+    # Retorna None quando o worker já está no limite de conexões abertas
+    def assinar(self, *topicos):
+        with self._trava:
+            if self._total >= self.max_assinantes:
+                return None
+            assinatura = Assinatura(topicos, self.capacidade_fila)
+            for topico in topicos:
+                self._por_topico.setdefault(topico, set()).add(assinatura)
+            self._total += 1
+            return assinatura
+
+    def cancelar(self, assinatura):
+        with self._trava:
+            removida = False
+            for topico in assinatura.topicos:
+                assinantes = self._por_topico.get(topico)
+                if assinantes and assinatura in assinantes:
+                    assinantes.discard(assinatura)
+                    removida = True
+                    if not assinantes:
+                        del self._por_topico[topico]
+            if removida:
+                self._total -= 1
+
+    def publicar(self, topico, tipo, dados=None):
+        with self._trava:
+            alvos = list(self._por_topico.get(topico, ()))
+        for assinatura in alvos:
+            try:
+                assinatura.fila.put_nowait((tipo, dados))
+            except queue.Full:
+                assinatura.atrasada = True
+        return len(alvos)
+
+    def total_assinantes(self):
+        return self._total
+
+def formatar_evento(tipo, dados, id_evento=None):
+    linhas = []
+    if id_evento is not None:
+        linhas.append(f"id: {id_evento}")
+    linhas.append(f"event: {tipo}")
+    linhas.append(f"data: {json.dumps(dados, ensure_ascii=False, default=str)}")
+    return "\n".join(linhas) + "\n\n"
+
+# Gerador do corpo text/event-stream.
+# - ao_conectar(): eventos iniciais (lista de strings já formatadas)
+# - ao_acordar(eventos): chamado com os eventos drenados da fila ou a cada
+#   heartbeat (lista vazia); devolve a lista de strings a enviar
+# - duracao_maxima: encerra a conexão para o navegador reconectar (EventSource)
+# - so_despertar: os eventos só acordam ao_acordar, que relê a fonte de verdade;
+#   fila cheia então não perde nada e não força o cliente a ressincronizar
+def transmitir(hub, assinatura, ao_acordar, ao_conectar=None, heartbeat=15, duracao_maxima=300,
+               so_despertar=False):
+    inicio = time.monotonic()
+    try:
+        yield "retry: 3000\n\n"
+        if ao_conectar:
+            for evento in ao_conectar():
+                yield evento
+
+        while time.monotonic() - inicio < duracao_maxima:
+            if assinatura.atrasada and so_despertar:
+                assinatura.atrasada = False
+            elif assinatura.atrasada:
+                # Cliente lento perdeu eventos: avisa para ressincronizar e encerra
+                yield formatar_evento("resync", {})
+                return
+
+            try:
+                recebidos = [assinatura.fila.get(timeout=heartbeat)]
+            except queue.Empty:
+                recebidos = []
+
+            # Drena o que chegou junto para responder com um único envio
+            while True:
+                try:
+                    recebidos.append(assinatura.fila.get_nowait())
+                except queue.Empty:
+                    break
+
+            enviados = ao_acordar(recebidos)
+            if enviados:
+                for evento in enviados:
+                    yield evento
+            elif not recebidos:
+                yield ": ping\n\n"
+    finally:
+        hub.cancelar(assinatura)
@@ -0,0 +1,23 @@
+# Configuração do gunicorn (render.yaml: gunicorn -c gunicorn.conf.py app:app)
+import os
+import tempfile
+
+# As rotas SSE mantêm conexões abertas e as de pagamento esperam o PagBank. Com o
+# worker gevent cada requisição é um greenlet barato em vez de um worker sync
+# bloqueado até o cliente sair ou o PagBank responder (ver PAGBANK_POOL_CONEXOES no app).
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+keepalive = 5
+
+# Snapshots de métricas de cada worker, somados por /metrics. Definido ao ler este
+# arquivo, antes de o app ser importado (com --preload ele é importado no master antes
+# de on_starting rodar e leria METRICAS_DIR vazio).
+os.environ.setdefault("METRICAS_DIR", os.path.join(tempfile.gettempdir(), "delmonte_metricas"))
+
+# Limpo a cada start do master para não somar contadores de uma execução anterior
+def on_starting(server):
+    diretorio = os.environ["METRICAS_DIR"]
+    os.makedirs(diretorio, exist_ok=True)
+    for nome in os.listdir(diretorio):
+        if nome.endswith(".json") or nome.endswith(".json.tmp"):
+            os.remove(os.path.join(diretorio, nome))
@@ -0,0 +1,58 @@
+# Limite de taxa por cliente (token bucket). Os baldes ficam em SQLite (modo WAL),
+# compartilhado pelos workers do gunicorn: o limite vale para o servidor inteiro, não
+# para cada worker. Cada balde guarda os tokens e o instante da última leitura; a
+# reposição é calculada na hora, sem thread de fundo.
+import sqlite3
+import time
+
+from banco_sqlite import BancoSQLite
+
+class LimitadorTaxa:
+    def __init__(self, caminho, segundos_ociosos=3600, limpar_a_cada=1000):
+        self.caminho = caminho
+        self.segundos_ociosos = segundos_ociosos
+        self.limpar_a_cada = limpar_a_cada
+        self._consumos = 0
+        self._banco = BancoSQLite(caminho, timeout=2)
+        self._criar_tabela()
+
+    def _criar_tabela(self):
+        self._banco.executar("""
+            CREATE TABLE IF NOT EXISTS baldes (
+                chave TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                atualizado_em REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    # Tenta gastar um token do balde "chave" (capacidade = rajada, por_segundo = ritmo
+    # sustentado). Retorna 0 se a requisição passa, senão os segundos até haver um token.
+    def consumir(self, chave, capacidade, por_segundo):
+        agora = time.time()
+        try:
+            with self._banco.transacao() as conexao:
+                linha = conexao.execute(
+                    "SELECT tokens, atualizado_em FROM baldes WHERE chave = ?", (chave,)
+                ).fetchone()
+                tokens = capacidade if linha is None else min(capacidade, linha[0] + (agora - linha[1]) * por_segundo)
+                espera = 0 if tokens >= 1 else (1 - tokens) / por_segundo
+                conexao.execute(
+                    "INSERT OR REPLACE INTO baldes (chave, tokens, atualizado_em) VALUES (?, ?, ?)",
+                    (chave, tokens - 1 if not espera else tokens, agora)
+                )
+        except sqlite3.Error as e:
+            # Banco travado ou indisponível: deixa passar em vez de derrubar a rota
+            print(f"⚠️ Limite de taxa indisponível: {e}")
+            return 0
+
+        self._consumos += 1
+        if self._consumos % self.limpar_a_cada == 0:
+            self._limpar(agora)
+        return espera
+
+    # Balde parado há muito tempo já estaria cheio: apagar é o mesmo que recriar
+    def _limpar(self, agora):
+        try:
+            self._banco.executar("DELETE FROM baldes WHERE atualizado_em < ?", (agora - self.segundos_ociosos,))
+        except sqlite3.Error as e:
+            print(f"⚠️ Erro ao limpar baldes do limite de taxa: {e}")
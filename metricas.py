@@ -0,0 +1,198 @@
+# Métricas no formato de texto do Prometheus (contadores, gauges e histogramas).
+# Cada worker acumula em memória (um dict e uma trava: custo de microssegundos por
+# registro) e, com um diretório configurado, grava um snapshot periódico em
+# <diretorio>/<pid>.json. A exportação soma os snapshots de todos os workers do gunicorn;
+# gauges de workers que já morreram são ignorados, contadores e histogramas não.
+import json
+import os
+import threading
+import time
+
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _rotulos_texto(rotulos, extra=None):
+    pares = list(rotulos) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{chave}="{_escapar(valor)}"' for chave, valor in pares) + "}"
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+
+class RegistroMetricas:
+    def __init__(self, diretorio=None, intervalo=5):
+        self.diretorio = diretorio
+        self.intervalo = intervalo
+        self._trava = threading.Lock()
+        self._descricoes = {}
+        self._contadores = {}
+        self._histogramas = {}
+        self._coletores = []
+        self._pid = None
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+
+    # tipo: counter, gauge ou histogram; limites só para histogramas
+    def descrever(self, nome, tipo, ajuda, limites=LIMITES_SEGUNDOS):
+        self._descricoes[nome] = (tipo, ajuda, tuple(limites) if tipo == "histogram" else None)
+
+    def contar(self, nome, rotulos=None, valor=1):
+        chave = (nome, tuple(sorted(rotulos.items())) if rotulos else ())
+        with self._trava:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+        self._garantir_iniciado()
+
+    def observar(self, nome, segundos, rotulos=None):
+        limites = self._descricoes[nome][2]
+        chave = (nome, tuple(sorted(rotulos.items())) if rotulos else ())
+        with self._trava:
+            histograma = self._histogramas.get(chave)
+            if histograma is None:
+                # Contagem por faixa (não acumulada), soma e total
+                histograma = self._histogramas[chave] = [[0] * (len(limites) + 1), 0.0, 0]
+            for i, limite in enumerate(limites):
+                if segundos <= limite:
+                    histograma[0][i] += 1
+                    break
+            else:
+                histograma[0][-1] += 1
+            histograma[1] += segundos
+            histograma[2] += 1
+        self._garantir_iniciado()
+
+    # coletor() -> [(nome, rotulos, valor)] de gauges lidos na hora do snapshot
+    def coletar_com(self, coletor):
+        self._coletores.append(coletor)
+
+    def _gauges(self):
+        valores = {}
+        for coletor in self._coletores:
+            try:
+                for nome, rotulos, valor in coletor():
+                    valores[(nome, tuple(sorted(rotulos.items())) if rotulos else ())] = valor
+            except Exception as e:
+                print(f"⚠️ Erro ao coletar métricas: {e}")
+        return valores
+
+    def _snapshot(self):
+        with self._trava:
+            contadores = [[nome, list(rotulos), valor] for (nome, rotulos), valor in self._contadores.items()]
+            histogramas = [
+                [nome, list(rotulos), list(h[0]), h[1], h[2]] for (nome, rotulos), h in self._histogramas.items()
+            ]
+        gauges = [[nome, list(rotulos), valor] for (nome, rotulos), valor in self._gauges().items()]
+        return {"contadores": contadores, "histogramas": histogramas, "gauges": gauges}
+
+    def _gravar(self):
+        caminho = os.path.join(self.diretorio, f"{os.getpid()}.json")
+        temporario = f"{caminho}.tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump(self._snapshot(), arquivo)
+        os.replace(temporario, caminho)
+
+    # Thread de snapshot no processo atual (de novo depois de um fork do gunicorn)
+    def _garantir_iniciado(self):
+        if not self.diretorio or self._pid == os.getpid():
+            return
+        with self._trava:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._executar, name="metricas-snapshot", daemon=True).start()
+
+    def _executar(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self._gravar()
+            except OSError as e:
+                print(f"⚠️ Erro ao gravar snapshot de métricas: {e}")
+
+    def _snapshots(self):
+        # O processo atual entra com o estado ao vivo, os outros pelo último snapshot
+        snapshots = [self._snapshot()]
+        if not self.diretorio:
+            return snapshots
+        for nome in os.listdir(self.diretorio):
+            if not nome.endswith(".json") or nome == f"{os.getpid()}.json":
+                continue
+            try:
+                with open(os.path.join(self.diretorio, nome), encoding="utf-8") as arquivo:
+                    snapshot = json.load(arquivo)
+            except (OSError, ValueError):
+                continue
+            if not _processo_vivo(int(nome[:-5])):
+                snapshot["gauges"] = []
+            snapshots.append(snapshot)
+        return snapshots
+
+    def exportar(self):
+        contadores = {}
+        gauges = {}
+        histogramas = {}
+        for snapshot in self._snapshots():
+            for nome, rotulos, valor in snapshot["contadores"]:
+                chave = (nome, tuple(map(tuple, rotulos)))
+                contadores[chave] = contadores.get(chave, 0) + valor
+            for nome, rotulos, valor in snapshot["gauges"]:
+                chave = (nome, tuple(map(tuple, rotulos)))
+                gauges[chave] = gauges.get(chave, 0) + valor
+            for nome, rotulos, faixas, soma, total in snapshot["histogramas"]:
+                chave = (nome, tuple(map(tuple, rotulos)))
+                atual = histogramas.setdefault(chave, [[0] * len(faixas), 0.0, 0])
+                atual[0] = [a + b for a, b in zip(atual[0], faixas)]
+                atual[1] += soma
+                atual[2] += total
+
+        por_nome = {}
+        for origem in (contadores, gauges, histogramas):
+            for (nome, rotulos), valor in origem.items():
+                por_nome.setdefault(nome, []).append((rotulos, valor))
+
+        linhas = []
+        for nome in sorted(por_nome):
+            tipo, ajuda, limites = self._descricoes.get(nome, ("untyped", "", None))
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for rotulos, valor in sorted(por_nome[nome]):
+                if tipo != "histogram":
+                    linhas.append(f"{nome}{_rotulos_texto(rotulos)} {_numero(valor)}")
+                    continue
+                faixas, soma, total = valor
+                acumulado = 0
+                for limite, quantidade in zip(list(limites) + [float("inf")], faixas):
+                    acumulado += quantidade
+                    linhas.append(f"{nome}_bucket{_rotulos_texto(rotulos, ('le', _numero(limite)))} {acumulado}")
+                linhas.append(f"{nome}_sum{_rotulos_texto(rotulos)} {_numero(soma)}")
+                linhas.append(f"{nome}_count{_rotulos_texto(rotulos)} {total}")
+        return "\n".join(linhas) + "\n"
+
+# Listener de comandos do pymongo: tempo de cada operação por comando e resultado
+def ouvinte_mongo(registro, nome="delmonte_mongo_operacao_segundos"):
+    from pymongo import monitoring
+
+    class OuvinteComandos(monitoring.CommandListener):
+        def started(self, evento):
+            pass
+
+        def succeeded(self, evento):
+            registro.observar(nome, evento.duration_micros / 1e6, {"comando": evento.command_name, "resultado": "ok"})
+
+        def failed(self, evento):
+            registro.observar(nome, evento.duration_micros / 1e6, {"comando": evento.command_name, "resultado": "erro"})
+
+    return OuvinteComandos()
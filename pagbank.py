@@ -0,0 +1,277 @@
+# Cliente HTTP do PagBank: sessão com pool keep-alive, timeouts de conexão/leitura,
+# retentativas com jitter só em chamadas idempotentes, chave de idempotência na
+# criação de pedidos, circuit breaker, limite de chamadas simultâneas e métricas
+# de latência por operação.
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class PagBankIndisponivel(Exception):
+    pass
+
+# Todas as vagas de chamadas simultâneas ocupadas durante toda a espera
+class PagBankSaturado(PagBankIndisponivel):
+    pass
+
+# Worker gevent (socket com monkey patch): cada requisição é um greenlet e a espera pelo
+# PagBank não prende o processo. Só vale depois do fork: com --preload o app é importado
+# no master, antes de o worker aplicar o patch.
+def worker_cooperativo():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+class CircuitBreaker:
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+
+    def __init__(self, limite_falhas=5, segundos_aberto=30):
+        self.limite_falhas = limite_falhas
+        self.segundos_aberto = segundos_aberto
+        self.estado = self.FECHADO
+        self._falhas = 0
+        self._aberto_em = 0
+        # Ficha da chamada de teste em andamento (meio aberto), ou None
+        self._teste = None
+        self._trava = threading.Lock()
+
+    # Aberto: falha rápido. Depois do intervalo deixa passar uma chamada de teste.
+    # Retorna False, True ou, para a chamada de teste, a ficha a devolver em encerrar().
+    def permitir(self):
+        with self._trava:
+            if self.estado == self.ABERTO:
+                if time.monotonic() - self._aberto_em < self.segundos_aberto:
+                    return False
+                self.estado = self.MEIO_ABERTO
+            if self.estado == self.MEIO_ABERTO:
+                if self._teste is not None:
+                    return False
+                self._teste = object()
+                return self._teste
+            return True
+
+    # Fim de uma chamada admitida, com ou sem resultado registrado: uma chamada de teste
+    # que saiu por exceção inesperada não deixa o breaker preso em meio aberto
+    def encerrar(self, ficha):
+        with self._trava:
+            if self._teste is ficha:
+                self._teste = None
+
+    def registrar_sucesso(self):
+        with self._trava:
+            self.estado = self.FECHADO
+            self._falhas = 0
+            self._teste = None
+
+    def registrar_falha(self):
+        with self._trava:
+            self._falhas += 1
+            self._teste = None
+            if self.estado == self.MEIO_ABERTO or self._falhas >= self.limite_falhas:
+                self.estado = self.ABERTO
+                self._aberto_em = time.monotonic()
+
+# Contadores e histograma de latência (em ms) de uma operação
+class MetricasOperacao:
+    LIMITES_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.chamadas = 0
+        self.falhas = 0
+        self.rejeitadas = 0
+        self.rejeitadas_fila = 0
+        self.latencia_total_ms = 0.0
+        self.latencia_max_ms = 0.0
+        self.por_status = {}
+        self.buckets = [0] * (len(self.LIMITES_MS) + 1)
+
+    def registrar(self, status, duracao_ms):
+        self.chamadas += 1
+        self.latencia_total_ms += duracao_ms
+        self.latencia_max_ms = max(self.latencia_max_ms, duracao_ms)
+        chave = str(status) if status is not None else "erro"
+        self.por_status[chave] = self.por_status.get(chave, 0) + 1
+        if status is None or status >= 500:
+            self.falhas += 1
+        for i, limite in enumerate(self.LIMITES_MS):
+            if duracao_ms <= limite:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def resumo(self):
+        histograma = {f"<={limite}ms": n for limite, n in zip(self.LIMITES_MS, self.buckets)}
+        histograma[f">{self.LIMITES_MS[-1]}ms"] = self.buckets[-1]
+        return {
+            "chamadas": self.chamadas,
+            "falhas": self.falhas,
+            "rejeitadas_circuit_breaker": self.rejeitadas,
+            "rejeitadas_fila": self.rejeitadas_fila,
+            "latencia_media_ms": round(self.latencia_total_ms / self.chamadas, 1) if self.chamadas else 0,
+            "latencia_max_ms": round(self.latencia_max_ms, 1),
+            "por_status": dict(self.por_status),
+            "histograma": histograma
+        }
+
+class ClientePagBank:
+    def __init__(self, url_api, token, tamanho_pool=None, timeout_conexao=3.05, timeout_leitura=20,
+                 retentativas=2, breaker=None, observador=None, max_simultaneas=None, espera_vaga=2):
+        self.url_api = url_api
+        self.token = token
+        self.timeout = (timeout_conexao, timeout_leitura)
+        self.retentativas = retentativas
+        self.breaker = breaker or CircuitBreaker()
+        # Sem tamanho_pool: 200 conexões no worker gevent, 10 no sync (e no flask run),
+        # onde cada chamada já ocupa uma thread inteira
+        self.tamanho_pool = tamanho_pool
+        # Num pico, as chamadas esperam até espera_vaga segundos por uma vaga em vez de
+        # ocupar todas as threads/greenlets do worker esperando o PagBank. Sem
+        # max_simultaneas vale o tamanho do pool; 0 desliga o limite.
+        self.max_simultaneas = max_simultaneas
+        self.espera_vaga = espera_vaga
+        self.vagas = None
+        self.session = None
+        self._pid = None
+        self.metricas = {}
+        self._trava_metricas = threading.Lock()
+        # observador(operacao, status, segundos): exportação externa das medições (ex.: Prometheus)
+        self.observador = observador
+
+    # Sessão, pool e vagas nascem na primeira chamada de cada processo, depois do fork e
+    # do monkey patch (um semáforo criado antes do patch travaria o worker gevent inteiro)
+    def _garantir_sessao(self):
+        if self._pid == os.getpid():
+            return
+        with self._trava_metricas:
+            if self._pid == os.getpid():
+                return
+            tamanho_pool = self.tamanho_pool or (200 if worker_cooperativo() else 10)
+            max_simultaneas = tamanho_pool if self.max_simultaneas is None else self.max_simultaneas
+            self.vagas = threading.BoundedSemaphore(max_simultaneas) if max_simultaneas else None
+
+            # Uma sessão por worker: conexões TCP/TLS reaproveitadas entre pagamentos
+            sessao = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho_pool, max_retries=0)
+            sessao.mount("https://", adaptador)
+            sessao.mount("http://", adaptador)
+            sessao.headers.update({
+                "Authorization": f"Bearer {self.token}",
+                "Content-Type": "application/json",
+                "Accept": "application/json"
+            })
+            self.session = sessao
+            self._pid = os.getpid()
+
+    # POST /orders. Uma chave de idempotência por tentativa de pagamento (a do cliente ou
+    # uma nova): as retentativas desta chamada devolvem o pedido original em vez de criar
+    # outro, e uma nova tentativa (ex.: mesmo cartão depois de recusado) vai de fato ao PagBank.
+    def criar_pedido(self, pedido, chave_idempotencia=None):
+        corpo = json.dumps(pedido, sort_keys=True, ensure_ascii=False)
+        chave = chave_idempotencia or uuid.uuid4().hex
+        return self._requisitar(
+            "criar_pedido", "POST", self.url_api,
+            idempotente=True,
+            data=corpo.encode(),
+            headers={"x-idempotency-key": chave}
+        )
+
+    def consultar_pedido(self, order_id):
+        return self._requisitar("consultar_pedido", "GET", f"{self.url_api}/{order_id}", idempotente=True)
+
+    def resumo_metricas(self):
+        with self._trava_metricas:
+            operacoes = {nome: m.resumo() for nome, m in self.metricas.items()}
+        return {"circuit_breaker": self.breaker.estado, "operacoes": operacoes}
+
+    def _metricas(self, operacao):
+        with self._trava_metricas:
+            if operacao not in self.metricas:
+                self.metricas[operacao] = MetricasOperacao()
+            return self.metricas[operacao]
+
+    def _observar(self, operacao, status, segundos):
+        if self.observador is not None:
+            self.observador(operacao, status, segundos)
+
+    def _esperar(self, tentativa):
+        # Backoff exponencial com jitter para não sincronizar as retentativas dos workers
+        time.sleep(0.2 * (2 ** tentativa) * random.uniform(0.5, 1.5))
+
+    def _requisitar(self, operacao, metodo, url, idempotente=False, **kwargs):
+        self._garantir_sessao()
+        if self.vagas is None:
+            return self._executar(operacao, metodo, url, idempotente, **kwargs)
+        # A vaga vale para a chamada inteira (com as retentativas): quem espera não chega
+        # a passar pelo circuit breaker, e uma chamada de teste sempre registra o resultado
+        if not self.vagas.acquire(timeout=self.espera_vaga):
+            metricas = self._metricas(operacao)
+            with self._trava_metricas:
+                metricas.rejeitadas_fila += 1
+            self._observar(operacao, "fila", 0.0)
+            raise PagBankSaturado("PagBank ocupado no momento, tente novamente em instantes")
+        try:
+            return self._executar(operacao, metodo, url, idempotente, **kwargs)
+        finally:
+            self.vagas.release()
+
+    def _executar(self, operacao, metodo, url, idempotente=False, **kwargs):
+        metricas = self._metricas(operacao)
+        ficha = self.breaker.permitir()
+        if not ficha:
+            self._rejeitar(operacao, metricas)
+        try:
+            return self._tentar(operacao, metricas, metodo, url, idempotente, **kwargs)
+        finally:
+            self.breaker.encerrar(ficha)
+
+    def _rejeitar(self, operacao, metricas):
+        with self._trava_metricas:
+            metricas.rejeitadas += 1
+        self._observar(operacao, "rejeitada", 0.0)
+        raise PagBankIndisponivel("PagBank indisponível no momento (circuit breaker aberto)")
+
+    def _tentar(self, operacao, metricas, metodo, url, idempotente, **kwargs):
+        tentativas = 1 + (self.retentativas if idempotente else 0)
+        for tentativa in range(tentativas):
+            # Breaker aberto por uma falha desta chamada (ou de outra, durante o backoff):
+            # as retentativas restantes não vão ao PagBank
+            if tentativa and self.breaker.estado == CircuitBreaker.ABERTO:
+                self._rejeitar(operacao, metricas)
+            ultima = tentativa == tentativas - 1
+            inicio = time.perf_counter()
+            try:
+                resposta = self.session.request(metodo, url, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                # Conexão, timeout, SSL, resposta truncada...: toda chamada admitida registra um resultado
+                duracao = time.perf_counter() - inicio
+                with self._trava_metricas:
+                    metricas.registrar(None, duracao * 1000)
+                self._observar(operacao, "erro", duracao)
+                self.breaker.registrar_falha()
+                if ultima:
+                    raise PagBankIndisponivel(f"Falha de comunicação com o PagBank: {e}")
+                self._esperar(tentativa)
+                continue
+
+            duracao = time.perf_counter() - inicio
+            with self._trava_metricas:
+                metricas.registrar(resposta.status_code, duracao * 1000)
+            self._observar(operacao, resposta.status_code, duracao)
+            if resposta.status_code >= 500 or resposta.status_code == 429:
+                self.breaker.registrar_falha()
+                if not ultima:
+                    self._esperar(tentativa)
+                    continue
+            else:
+                self.breaker.registrar_sucesso()
+            return resposta
@@ -0,0 +1,235 @@
+# Reconciliação de pagamentos: pedidos PIX criados no PagBank ficam registrados como
+# "aguardando" (SQLite em modo WAL, compartilhado entre os workers) até o webhook
+# confirmar. Uma varredura periódica consulta no PagBank os que passaram da idade
+# mínima, com pool de threads limitado e limite de taxa, e aplica os pagos em lote -
+# um webhook perdido não deixa mais o pedido pago fora da cozinha.
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from banco_sqlite import BancoSQLite
+from pagbank import PagBankIndisponivel
+
+AGUARDANDO = "aguardando"
+PAGO = "pago"
+FINALIZADO = "finalizado"
+EXPIRADO = "expirado"
+
+STATUS_FINAIS = {"DECLINED": FINALIZADO, "CANCELED": FINALIZADO}
+
+# Espaça as chamadas de todas as threads para no máximo "por_segundo"
+class LimiteTaxa:
+    def __init__(self, por_segundo):
+        self.intervalo = 1 / por_segundo
+        self._proximo = 0.0
+        self._trava = threading.Lock()
+
+    def aguardar(self):
+        with self._trava:
+            agora = time.monotonic()
+            vez = max(agora, self._proximo)
+            self._proximo = vez + self.intervalo
+        if vez > agora:
+            time.sleep(vez - agora)
+
+class Reconciliador:
+    # consultar(order_id) -> (status, dados) do PagBank; aplicar_pagos([(registro, dados)]) grava os pagos
+    def __init__(self, caminho, consultar, aplicar_pagos, trabalhadores=8, por_segundo=20, tamanho_lote=500,
+                 intervalo=60, idade_minima=120, horas_expiracao=6, segundos_reserva=300):
+        self.caminho = caminho
+        self.consultar = consultar
+        self.aplicar_pagos = aplicar_pagos
+        self.trabalhadores = trabalhadores
+        self.por_segundo = por_segundo
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.idade_minima = idade_minima
+        self.horas_expiracao = horas_expiracao
+        self.segundos_reserva = segundos_reserva
+        self._banco = BancoSQLite(caminho)
+        self._trava_inicio = threading.Lock()
+        self._pid = None
+        self._criar_tabela()
+
+    def _criar_tabela(self):
+        with self._banco.conexao() as conexao:
+            conexao.execute("""
+                CREATE TABLE IF NOT EXISTS pagamentos (
+                    order_id TEXT PRIMARY KEY,
+                    reference_id TEXT,
+                    dados TEXT NOT NULL,
+                    criado_em REAL NOT NULL,
+                    estado TEXT NOT NULL,
+                    verificado_em REAL,
+                    reservado_em REAL,
+                    tentativas INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_pagamentos_estado ON pagamentos (estado, criado_em)")
+
+    # Pedido criado no PagBank e ainda não pago
+    def registrar(self, order_id, reference_id, dados):
+        self._banco.executar(
+            "INSERT OR IGNORE INTO pagamentos (order_id, reference_id, dados, criado_em, estado) VALUES (?, ?, ?, ?, ?)",
+            (order_id, reference_id, json.dumps(dados, ensure_ascii=False), time.time(), AGUARDANDO)
+        )
+
+    # Status final recebido por outro caminho (webhook, prazo do PIX); estado: pago, finalizado
+    # ou expirado. Retorna False se o pedido já não estava aguardando.
+    def concluir(self, order_id, estado):
+        return self._banco.executar(
+            "UPDATE pagamentos SET estado = ?, verificado_em = ? WHERE order_id = ? AND estado = ?",
+            (estado, time.time(), order_id, AGUARDANDO)
+        ) > 0
+
+    def aguardando(self):
+        return self._banco.consultar_um(
+            "SELECT COUNT(*) FROM pagamentos WHERE estado = ?", (AGUARDANDO,)
+        )[0]
+
+    def obter(self, order_id):
+        linha = self._banco.consultar_um(
+            "SELECT order_id, reference_id, dados, criado_em, estado FROM pagamentos WHERE order_id = ?", (order_id,)
+        )
+        if linha is None:
+            return None
+        return {"order_id": linha[0], "reference_id": linha[1], "dados": json.loads(linha[2]),
+                "criado_em": linha[3], "estado": linha[4]}
+
+    def estado(self, order_id):
+        linha = self._banco.consultar_um("SELECT estado FROM pagamentos WHERE order_id = ?", (order_id,))
+        return linha[0] if linha else None
+
+    # (order_id, reference_id, criado_em) dos que ainda aguardam e foram criados antes de "criados_antes"
+    def aguardando_desde(self, criados_antes):
+        return self._banco.consultar(
+            "SELECT order_id, reference_id, criado_em FROM pagamentos WHERE estado = ? AND criado_em < ?",
+            (AGUARDANDO, criados_antes)
+        )
+
+    # Apaga os já concluídos há mais de "dias"
+    def limpar(self, dias):
+        return self._banco.executar(
+            "DELETE FROM pagamentos WHERE estado != ? AND criado_em < ?", (AGUARDANDO, time.time() - dias * 86400)
+        )
+
+    # Reserva um lote (os menos verificados primeiro) para nenhum outro worker consultar os mesmos;
+    # quem já foi verificado depois de "desde" fica para a próxima varredura
+    def _reservar_lote(self, quantidade, desde):
+        agora = time.time()
+        with self._banco.transacao() as conexao:
+            linhas = conexao.execute(
+                """SELECT order_id, reference_id, dados, criado_em FROM pagamentos
+                   WHERE estado = ? AND criado_em < ? AND (reservado_em IS NULL OR reservado_em < ?)
+                   AND COALESCE(verificado_em, 0) < ?
+                   ORDER BY COALESCE(verificado_em, 0), criado_em LIMIT ?""",
+                (AGUARDANDO, agora - self.idade_minima, agora - self.segundos_reserva, desde, quantidade)
+            ).fetchall()
+            if linhas:
+                conexao.executemany(
+                    "UPDATE pagamentos SET reservado_em = ? WHERE order_id = ?",
+                    [(agora, linha[0]) for linha in linhas]
+                )
+        return [
+            {"order_id": linha[0], "reference_id": linha[1], "dados": json.loads(linha[2]), "criado_em": linha[3]}
+            for linha in linhas
+        ]
+
+    def _gravar_estados(self, estados):
+        agora = time.time()
+        with self._banco.transacao() as conexao:
+            conexao.executemany(
+                """UPDATE pagamentos SET estado = ?, verificado_em = ?, reservado_em = NULL,
+                   tentativas = tentativas + 1 WHERE order_id = ?""",
+                [(estado, agora, order_id) for order_id, estado in estados]
+            )
+
+    # Uma varredura completa (até "limite" pedidos). Retorna o resumo.
+    def varrer(self, limite=None):
+        inicio = time.monotonic()
+        desde = time.time()
+        resumo = {"verificados": 0, "pagos": 0, "finalizados": 0, "expirados": 0, "aguardando": 0, "erros": 0}
+        limitador = LimiteTaxa(self.por_segundo)
+        pendentes = limite or float("inf")
+        indisponivel = threading.Event()
+
+        def verificar(registro):
+            if indisponivel.is_set():
+                return registro, None, None
+            limitador.aguardar()
+            try:
+                status, dados = self.consultar(registro["order_id"])
+                return registro, status, dados
+            except PagBankIndisponivel as e:
+                # Circuit breaker aberto: não adianta continuar martelando a API
+                indisponivel.set()
+                print(f"⚠️ Reconciliação interrompida: {e}")
+            except Exception as e:
+                print(f"⚠️ Erro ao consultar {registro['order_id']} na reconciliação: {e}")
+            return registro, None, None
+
+        with ThreadPoolExecutor(max_workers=self.trabalhadores, thread_name_prefix="reconciliacao") as executor:
+            while pendentes > 0 and not indisponivel.is_set():
+                lote = self._reservar_lote(int(min(self.tamanho_lote, pendentes)), desde)
+                if not lote:
+                    break
+                pendentes -= len(lote)
+
+                pagos = []
+                estados = []
+                limite_expiracao = time.time() - self.horas_expiracao * 3600
+                for registro, status, dados in executor.map(verificar, lote):
+                    if status is None:
+                        resumo["erros"] += 1
+                        estados.append((registro["order_id"], AGUARDANDO))
+                        continue
+                    resumo["verificados"] += 1
+                    if status == "PAID":
+                        pagos.append((registro, dados))
+                        estados.append((registro["order_id"], PAGO))
+                    elif status in STATUS_FINAIS:
+                        resumo["finalizados"] += 1
+                        estados.append((registro["order_id"], STATUS_FINAIS[status]))
+                    elif registro["criado_em"] < limite_expiracao:
+                        resumo["expirados"] += 1
+                        estados.append((registro["order_id"], EXPIRADO))
+                    else:
+                        resumo["aguardando"] += 1
+                        estados.append((registro["order_id"], AGUARDANDO))
+
+                if pagos:
+                    try:
+                        self.aplicar_pagos(pagos)
+                        resumo["pagos"] += len(pagos)
+                    except Exception as e:
+                        # Voltam a "aguardando" e entram de novo na próxima varredura
+                        print(f"❌ Erro ao gravar pagamentos reconciliados: {e}")
+                        ids = {registro["order_id"] for registro, _ in pagos}
+                        estados = [(order_id, AGUARDANDO if order_id in ids else estado) for order_id, estado in estados]
+                        resumo["erros"] += len(pagos)
+                self._gravar_estados(estados)
+
+        resumo["segundos"] = round(time.monotonic() - inicio, 2)
+        return resumo
+
+    # Thread de varredura periódica no processo atual (de novo depois de um fork do gunicorn)
+    def garantir_iniciado(self):
+        if not self.intervalo or self._pid == os.getpid():
+            return
+        with self._trava_inicio:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._executar, name="reconciliacao", daemon=True).start()
+
+    def _executar(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                resumo = self.varrer()
+                if resumo["verificados"] or resumo["erros"]:
+                    print(f"🔎 Reconciliação: {resumo}")
+            except Exception as e:
+                print(f"❌ Erro na reconciliação de pagamentos: {e}")
@@ -0,0 +1,192 @@
+# Spool local (SQLite em modo WAL) dos webhooks do PagBank.
+# O webhook só grava o payload e responde; threads em segundo plano reservam
+# lotes e entregam para processar_lote. Registros pendentes sobrevivem a restarts
+# e a chave única descarta notificações repetidas. Se um lote falha, os registros são
+# refeitos um a um; quem falha max_tentativas vezes vai para "falhou" e sai da fila.
+import json
+import os
+import threading
+import time
+
+from banco_sqlite import BancoSQLite
+
+PENDENTE = "pendente"
+PROCESSANDO = "processando"
+FEITO = "feito"
+FALHOU = "falhou"
+
+class SpoolWebhooks:
+    def __init__(self, caminho, processar_lote, tamanho_lote=50, janela_ms=200, trabalhadores=1,
+                 segundos_reserva=60, dias_retencao=7, max_tentativas=5):
+        self.caminho = caminho
+        self.processar_lote = processar_lote
+        self.tamanho_lote = tamanho_lote
+        self.janela = janela_ms / 1000
+        self.trabalhadores = trabalhadores
+        self.segundos_reserva = segundos_reserva
+        self.dias_retencao = dias_retencao
+        self.max_tentativas = max_tentativas
+        self._banco = BancoSQLite(caminho)
+        self._acordar = threading.Event()
+        self._trava_inicio = threading.Lock()
+        self._pid = None
+        self._criar_tabela()
+
+    def _criar_tabela(self):
+        with self._banco.conexao() as conexao:
+            conexao.execute("""
+                CREATE TABLE IF NOT EXISTS webhooks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chave TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    recebido_em REAL NOT NULL,
+                    estado TEXT NOT NULL,
+                    reservado_em REAL,
+                    tentativas INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_webhooks_estado ON webhooks (estado, id)")
+
+    # Grava o payload; retorna False se a chave já existia (notificação repetida).
+    # processado=True só marca a chave, para um pagamento já tratado na própria requisição
+    # (ou num comando do flask): não há o que entregar e as threads não são iniciadas.
+    def registrar(self, chave, payload, processado=False):
+        if not processado:
+            self.garantir_iniciado()
+        novo = self._banco.executar(
+            "INSERT OR IGNORE INTO webhooks (chave, payload, recebido_em, estado) VALUES (?, ?, ?, ?)",
+            (chave, json.dumps(payload, ensure_ascii=False), time.time(), FEITO if processado else PENDENTE)
+        ) == 1
+        if novo and not processado:
+            self._acordar.set()
+        return novo
+
+    # Reescreve os payloads que contêm o texto (ex.: um campo que nunca deveria ter sido
+    # gravado). secure_delete sobrescreve as páginas antigas em vez de só liberá-las.
+    # Retorna quantos registros mudaram.
+    def reescrever(self, contendo, transformar):
+        with self._banco.conexao() as conexao:
+            conexao.execute("PRAGMA secure_delete=ON")
+            try:
+                with self._banco.transacao():
+                    linhas = conexao.execute(
+                        "SELECT id, payload FROM webhooks WHERE instr(payload, ?) > 0", (contendo,)
+                    ).fetchall()
+                    for id_registro, payload in linhas:
+                        conexao.execute(
+                            "UPDATE webhooks SET payload = ? WHERE id = ?",
+                            (json.dumps(transformar(json.loads(payload)), ensure_ascii=False), id_registro)
+                        )
+                if linhas:
+                    conexao.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conexao.execute("PRAGMA secure_delete=OFF")
+        return len(linhas)
+
+    def pendentes(self):
+        linha = self._banco.consultar_um(
+            "SELECT COUNT(*) FROM webhooks WHERE estado IN (?, ?)", (PENDENTE, PROCESSANDO)
+        )
+        return linha[0]
+
+    def falhados(self):
+        return self._banco.consultar_um("SELECT COUNT(*) FROM webhooks WHERE estado = ?", (FALHOU,))[0]
+
+    # Inicia as threads no processo atual (de novo depois de um fork do gunicorn)
+    def garantir_iniciado(self):
+        if self._pid == os.getpid():
+            return
+        with self._trava_inicio:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.trabalhadores):
+                threading.Thread(target=self._executar, name=f"spool-webhooks-{i}", daemon=True).start()
+            # Replay do que ficou pendente antes do restart
+            self._acordar.set()
+
+    def _reservar_lote(self):
+        agora = time.time()
+        with self._banco.transacao() as conexao:
+            # Registros "processando" de um processo que morreu voltam depois da reserva expirar
+            linhas = conexao.execute(
+                """SELECT id, payload FROM webhooks
+                   WHERE estado = ? OR (estado = ? AND reservado_em < ?)
+                   ORDER BY id LIMIT ?""",
+                (PENDENTE, PROCESSANDO, agora - self.segundos_reserva, self.tamanho_lote)
+            ).fetchall()
+            if linhas:
+                conexao.executemany(
+                    "UPDATE webhooks SET estado = ?, reservado_em = ? WHERE id = ?",
+                    [(PROCESSANDO, agora, linha[0]) for linha in linhas]
+                )
+        return [(linha[0], json.loads(linha[1])) for linha in linhas]
+
+    def _concluir(self, ids):
+        with self._banco.transacao() as conexao:
+            conexao.executemany("UPDATE webhooks SET estado = ? WHERE id = ?", [(FEITO, id_registro) for id_registro in ids])
+
+    # Volta para a fila, ou vai para "falhou" ao esgotar as tentativas
+    def _falhar(self, id_registro):
+        self._banco.executar(
+            "UPDATE webhooks SET tentativas = tentativas + 1, estado = CASE WHEN tentativas + 1 >= ? THEN ? ELSE ? END WHERE id = ?",
+            (self.max_tentativas, FALHOU, PENDENTE, id_registro)
+        )
+
+    # Lote que falhou, registro por registro: um payload ruim não segura os outros.
+    # Retorna quantos foram processados.
+    def _processar_um_a_um(self, registros):
+        falhas = []
+        for registro in registros:
+            try:
+                self.processar_lote([registro])
+            except Exception as e:
+                print(f"❌ Erro ao processar webhook {registro[0]} do spool: {e}")
+                falhas.append(registro[0])
+                continue
+            self._concluir([registro[0]])
+        processados = len(registros) - len(falhas)
+        if processados == 0 and len(falhas) > 1:
+            # Todos falharam: o problema é do destino, não dos payloads; não gasta tentativa
+            self._banco.executar_varios("UPDATE webhooks SET estado = ? WHERE id = ?", [(PENDENTE, i) for i in falhas])
+        else:
+            for id_registro in falhas:
+                self._falhar(id_registro)
+        return processados
+
+    def _limpar(self):
+        limite = time.time() - self.dias_retencao * 86400
+        self._banco.executar("DELETE FROM webhooks WHERE estado = ? AND recebido_em < ?", (FEITO, limite))
+
+    def _executar(self):
+        ultima_limpeza = 0
+        falhas_seguidas = 0
+        while True:
+            self._acordar.wait(timeout=self.segundos_reserva / 2)
+            self._acordar.clear()
+            # Janela curta para juntar webhooks que chegam em rajada no mesmo lote
+            time.sleep(self.janela)
+            try:
+                while True:
+                    registros = self._reservar_lote()
+                    if not registros:
+                        break
+                    try:
+                        self.processar_lote(registros)
+                    except Exception as e:
+                        print(f"❌ Erro ao processar lote de webhooks: {e}")
+                        if not self._processar_um_a_um(registros):
+                            # Nenhum passou sozinho (ex.: destino fora do ar): espera antes de tentar de novo
+                            falhas_seguidas += 1
+                            time.sleep(min(30, 2 ** falhas_seguidas))
+                            break
+                    else:
+                        self._concluir([id_registro for id_registro, _ in registros])
+                    falhas_seguidas = 0
+
+                if time.time() - ultima_limpeza > 3600:
+                    self._limpar()
+                    ultima_limpeza = time.time()
+            except Exception as e:
+                print(f"❌ Erro no spool de webhooks: {e}")
+                time.sleep(1)
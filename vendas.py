@@ -0,0 +1,157 @@
+# Rollups de vendas por hora e por dia para o endpoint de analytics (/api/vendas).
+# Cada pedido soma uma vez no balde da sua hora e do seu dia (created_at); consultas
+# por intervalo leem só os baldes, nunca os pedidos. Os incrementos usam caminhos
+# pontilhados ("itens.Calabresa.quantidade") para servir tanto ao $inc do MongoDB
+# quanto ao cubo em memória.
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+# Tamanho do prefixo de created_at (ISO) que identifica o balde de cada nível
+NIVEIS = {"hora": 13, "dia": 10}
+DURACOES = {"hora": timedelta(hours=1), "dia": timedelta(days=1)}
+
+# Nomes de itens e métodos de pagamento viram chaves de documento: sem "." nem "$"
+def chave_campo(nome):
+    return str(nome or "").replace(".", "．").replace("$", "＄") or "sem_nome"
+
+# O pagamento com cartão na página grava "CREDIT"/"DEBIT" e o webhook grava o tipo do
+# PagBank ("CREDIT_CARD", "DEBIT_CARD"): nos rollups os dois contam como CARTAO
+CATEGORIAS_PAGAMENTO = {
+    "PIX": "PIX",
+    "CREDIT": "CARTAO",
+    "DEBIT": "CARTAO",
+    "CARD": "CARTAO",
+    "CREDIT_CARD": "CARTAO",
+    "DEBIT_CARD": "CARTAO"
+}
+
+def categoria_pagamento(metodo):
+    metodo = str(metodo or "UNKNOWN").upper()
+    return CATEGORIAS_PAGAMENTO.get(metodo, chave_campo(metodo))
+
+# Incrementos (caminho -> valor) que um pedido soma no seu balde
+def contribuicao(pedido):
+    total = pedido.get("total") or 0
+    metodo = categoria_pagamento(pedido.get("payment_method"))
+    incrementos = {
+        "pedidos": 1,
+        "receita": total,
+        f"pagamento.{metodo}.pedidos": 1,
+        f"pagamento.{metodo}.receita": total
+    }
+    for item in pedido.get("items") or []:
+        nome = chave_campo(item.get("name"))
+        quantidade = item.get("quantity") or 0
+        receita = quantidade * (item.get("unit_amount") or 0) / 100
+        incrementos[f"itens.{nome}.quantidade"] = incrementos.get(f"itens.{nome}.quantidade", 0) + quantidade
+        incrementos[f"itens.{nome}.receita"] = incrementos.get(f"itens.{nome}.receita", 0) + receita
+    return incrementos
+
+def periodos(pedido):
+    created_at = pedido.get("created_at") or ""
+    return {nivel: created_at[:tamanho] for nivel, tamanho in NIVEIS.items()}
+
+# Faixa de ids de balde [de, ate) que cobre created_at em [inicio, fim). Balde é indivisível:
+# inicio arredonda para baixo e fim no meio de um balde arredonda para cima, senão "hoje até
+# agora" perderia a hora (ou o dia) corrente inteira.
+def faixa(inicio, fim, nivel):
+    tamanho = NIVEIS[nivel]
+    de = (inicio or "")[:tamanho]
+    if not fim:
+        return de, None
+    ate = fim[:tamanho]
+    if datetime.fromisoformat(fim) > datetime.fromisoformat(ate):
+        ate = (datetime.fromisoformat(ate) + DURACOES[nivel]).isoformat()[:tamanho]
+    return de, ate
+
+def aplicar(balde, incrementos):
+    for caminho, valor in incrementos.items():
+        *pais, folha = caminho.split(".")
+        destino = balde
+        for parte in pais:
+            destino = destino.setdefault(parte, {})
+        destino[folha] = destino.get(folha, 0) + valor
+
+def _somar(destino, origem):
+    for chave, valor in origem.items():
+        if isinstance(valor, dict):
+            _somar(destino.setdefault(chave, {}), valor)
+        elif isinstance(valor, (int, float)):
+            destino[chave] = destino.get(chave, 0) + valor
+
+# Junta os baldes [(periodo, balde)] no relatório devolvido pela API
+def relatorio(baldes, top=10):
+    totais = {}
+    serie = []
+    for periodo, balde in baldes:
+        _somar(totais, balde)
+        serie.append({
+            "periodo": periodo,
+            "pedidos": balde.get("pedidos", 0),
+            "receita": round(balde.get("receita", 0), 2)
+        })
+
+    pedidos = totais.get("pedidos", 0)
+    receita = totais.get("receita", 0)
+    # Baldes gravados antes das categorias ainda têm os tipos originais: junta aqui também
+    pagamentos = {}
+    for metodo, valores in totais.get("pagamento", {}).items():
+        _somar(pagamentos.setdefault(categoria_pagamento(metodo), {}), valores)
+    por_pagamento = {
+        metodo: {
+            "pedidos": valores.get("pedidos", 0),
+            "receita": round(valores.get("receita", 0), 2),
+            "participacao": round(valores.get("pedidos", 0) / pedidos, 4) if pedidos else 0
+        }
+        for metodo, valores in pagamentos.items()
+    }
+    itens = sorted(
+        totais.get("itens", {}).items(),
+        key=lambda item: (item[1].get("quantidade", 0), item[1].get("receita", 0)),
+        reverse=True
+    )
+    return {
+        "resumo": {
+            "pedidos": pedidos,
+            "receita": round(receita, 2),
+            "ticket_medio": round(receita / pedidos, 2) if pedidos else 0
+        },
+        "por_pagamento": por_pagamento,
+        "itens_populares": [
+            {"nome": nome, "quantidade": valores.get("quantidade", 0), "receita": round(valores.get("receita", 0), 2)}
+            for nome, valores in itens[:top]
+        ],
+        "serie": serie
+    }
+
+# Cubo em memória (modo sem MongoDB): baldes por nível e ids ordenados para consultas por faixa.
+# Não acompanha o descarte do ArmazemMemoria: o histórico de vendas continua valendo.
+class CuboVendas:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._baldes = {nivel: {} for nivel in NIVEIS}
+        self._ordenados = {nivel: [] for nivel in NIVEIS}
+
+    def registrar(self, pedido):
+        incrementos = contribuicao(pedido)
+        with self._trava:
+            for nivel, periodo in periodos(pedido).items():
+                baldes = self._baldes[nivel]
+                if periodo not in baldes:
+                    baldes[periodo] = {}
+                    insort(self._ordenados[nivel], periodo)
+                aplicar(baldes[periodo], incrementos)
+
+    # Monta o relatório sob a trava: os baldes são lidos sem cópia e não podem mudar no meio
+    def relatorio(self, inicio, fim, nivel, top=10):
+        de, ate = faixa(inicio, fim, nivel)
+        with self._trava:
+            ordenados = self._ordenados[nivel]
+            baixo = bisect_left(ordenados, de)
+            alto = bisect_left(ordenados, ate) if ate is not None else len(ordenados)
+            return relatorio([(periodo, self._baldes[nivel][periodo]) for periodo in ordenados[baixo:alto]], top)
+
+    def baldes(self, nivel):
+        with self._trava:
+            return [(periodo, self._baldes[nivel][periodo]) for periodo in self._ordenados[nivel]]